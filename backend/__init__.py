@@ -1,13 +1,22 @@
-from fastapi import FastAPI
+import time
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from .api.routes import api  # import APIRouter from routes.py
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    from backend.api.services import shutdown_job_queue
+    shutdown_job_queue()  # stops the solve workers
+
+
 def create_app() -> FastAPI:
     """
     Factory function to create FastAPI app with CORS and routes.
     """
-    app = FastAPI(title="Optimization API")
+    app = FastAPI(title="Optimization API", lifespan=lifespan)
 
     # Add CORS middleware
     app.add_middleware(
@@ -21,9 +30,29 @@ def create_app() -> FastAPI:
     # Include API routes
     app.include_router(api, prefix="/api")
 
+    api_paths = {"/api" + route.path for route in api.routes}
+
+    @app.middleware("http")
+    async def record_request_metrics(request: Request, call_next):
+        """Latency and in-flight count of the /api routes (see /api/metrics)"""
+        from backend.core.utils.metrics import REQUEST_LATENCY, REQUESTS_IN_FLIGHT
+        route = request.url.path
+        if route not in api_paths:
+            return await call_next(request)
+        REQUESTS_IN_FLIGHT.inc(route=route)
+        start = time.perf_counter()
+        status = 500
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            return response
+        finally:
+            REQUESTS_IN_FLIGHT.dec(route=route)
+            REQUEST_LATENCY.observe(time.perf_counter() - start, route=route, method=request.method, status=status)
+
     try:
         app.mount("/", StaticFiles(directory="frontend/build", html=True), name="react")
-    except FileNotFoundError:
+    except (FileNotFoundError, RuntimeError):  # StaticFiles raises RuntimeError for a missing directory
         print("frontend/build not found, skipping static files mount")
 
     return app
\ No newline at end of file
@@ -0,0 +1,238 @@
+import os
+import tempfile
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict, deque
+
+##############################################
+### SOLVE JOB QUEUE                        ###
+##############################################
+
+# Solves run in worker processes instead of the uvicorn event loop. Every job gets an id that the /api/jobs routes
+# use to report its status and result. There are as many workers as the cores available to the process divided by
+# the threads of each HiGHS solve. When `workers + max_queued` jobs are already pending, `submit` raises `QueueFull`,
+# which the routes turn into a 429.
+# Each worker keeps its own persistent models and template cache (see `get_model_store`), so every worker is a pool
+# of one process with its own queue: the jobs submitted with the same `key` (scenario or model structure) all run
+# in the same worker and find its models, the jobs without a key go to the worker with the fewest pending jobs.
+# A job is handed to its pool only when the worker is free, so that a queued job can always be cancelled. The metrics recorded
+# by a job and the statistics of these caches come back with its result and are recorded in the API process,
+# which serves /api/metrics (see `backend.core.utils.metrics`).
+# `cancel` drops a queued job, or asks the worker running it to stop HiGHS through a flag file
+# (see `backend.core.utils.cancellation`). The solve then returns with the "cancelled" status.
+
+
+class QueueFull(Exception):
+    pass
+
+
+def available_cores() -> int:
+    """Cores this process may run on (CPU affinity / container limits when available)"""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def default_workers(highs_threads: int = 1) -> int:
+    return max(1, available_cores() // max(1, highs_threads))
+
+
+def _init_worker(highs_threads: int):
+    from backend.core.highs_solver import set_default_options
+    set_default_options(threads=highs_threads)
+
+
+def _worker_stats() -> dict:
+    """Statistics of the caches of this worker"""
+    from backend.api import services
+    from backend.core import model_cache
+    return {"template_cache": model_cache._TEMPLATE_CACHE.stats() if model_cache._TEMPLATE_CACHE is not None else None,
+            "model_store": services._MODEL_STORE.stats() if services._MODEL_STORE is not None else None}
+
+
+def _run_job(cancel_file: str, fn, *args) -> tuple:
+    """Runs fn(*args) in a worker, cancellable through `cancel_file`.
+    Returns (result, metrics records, pid, cache statistics of the worker)"""
+    from backend.core.utils.cancellation import set_cancel_file
+    from backend.core.utils.metrics import collect_records
+    set_cancel_file(cancel_file)
+    try:
+        with collect_records() as records:
+            result = fn(*args)
+        return result, records, os.getpid(), _worker_stats()
+    finally:
+        set_cancel_file(None)
+        if os.path.exists(cancel_file):
+            os.remove(cancel_file)
+
+
+class Job:
+    """One submitted solve: status is "queued", "running", "done", "failed" or "cancelled".
+    `future` holds the result of fn, once the metrics of `task` (the future of the pool, None while the job waits
+    in the queue of its worker) are recorded"""
+
+    def __init__(self, kind: str):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.future = None
+        self.task = None
+        self.call = None  # (fn, args) until handed to the pool
+        self.worker = None
+        self.cancel_file = os.path.join(tempfile.gettempdir(), f"safepaw-cancel-{self.id}")
+        self.cancelled = False
+        self.submitted = time.time()
+        self.finished = None
+
+    @property
+    def status(self) -> str:
+        if not self.future.done():
+            return "running" if self.task is not None else "queued"
+        if self.cancelled:
+            return "cancelled"
+        return "failed" if self.future.exception() is not None else "done"
+
+    def as_dict(self) -> dict:
+        job = {"job_id": self.id, "kind": self.kind, "status": self.status, "submitted": self.submitted,
+               "finished": self.finished}
+        if self.finished is not None:
+            job["duration_s"] = round(self.finished - self.submitted, 6)
+        if job["status"] == "done":
+            job["result"] = self.future.result()
+        elif job["status"] == "failed":
+            error = self.future.exception()
+            job["error"] = str(error) or type(error).__name__
+        return job
+
+
+class JobQueue:
+    """Bounded process pool with a registry of the submitted jobs (the last `keep_finished` finished ones are kept)"""
+
+    def __init__(self, workers: int | None = None, highs_threads: int = 1, max_queued: int = 16, keep_finished: int = 100):
+        self.workers = workers or default_workers(highs_threads)
+        self.highs_threads = highs_threads
+        self.max_queued = max_queued
+        self.keep_finished = keep_finished
+        self.jobs = OrderedDict()
+        self.executors = [None] * self.workers
+        self.queues = [deque() for _ in range(self.workers)]  # jobs waiting for their worker
+        self.running = [None] * self.workers
+        self.lock = threading.Lock()
+
+    def _pending(self) -> int:
+        return sum(not job.future.done() for job in self.jobs.values())
+
+    def _worker(self, key: str | None) -> int:
+        """Worker of the jobs of `key`, or the least loaded one without a key"""
+        if key is not None:
+            return zlib.crc32(key.encode()) % self.workers
+        pending = [0] * self.workers
+        for job in self.jobs.values():
+            if job.worker is not None and not job.future.done():
+                pending[job.worker] += 1
+        return pending.index(min(pending))
+
+    def submit(self, kind: str, fn, *args, key: str | None = None) -> Job:
+        """Runs fn(*args) in a worker process, the same one for every job of `key`.
+        Raises `QueueFull` when the pool and the queue are saturated"""
+        from concurrent.futures import Future
+
+        with self.lock:
+            if self._pending() >= self.workers + self.max_queued:
+                raise QueueFull(f"{self.workers} workers busy and {self.max_queued} jobs queued")
+            job = Job(kind)
+            job.worker = self._worker(key)
+            job.future = Future()
+            job.call = (fn, args)
+            self.jobs[job.id] = job
+            finished = [key for key, other in self.jobs.items() if other.finished is not None]
+            for key in finished[:max(0, len(finished) - self.keep_finished)]:
+                del self.jobs[key]
+            self.queues[job.worker].append(job)
+            self._start(job.worker)
+        return job
+
+    def _start(self, worker: int):
+        """Hands the next queued job of `worker` to its pool when the worker is free (lock held)"""
+        from concurrent.futures import ProcessPoolExecutor
+        if self.running[worker] is not None or not self.queues[worker]:
+            return
+        job = self.queues[worker].popleft()
+        if self.executors[worker] is None:
+            self.executors[worker] = ProcessPoolExecutor(max_workers=1, initializer=_init_worker,
+                                                         initargs=(self.highs_threads,))
+        fn, args = job.call
+        job.call = None
+        job.task = self.executors[worker].submit(_run_job, job.cancel_file, fn, *args)
+        self.running[worker] = job
+        job.task.add_done_callback(lambda _: self._finished(job))
+
+    def completed(self, kind: str, result) -> Job:
+        """Registers a job answered without solving (e.g. from the result cache)"""
+        from concurrent.futures import Future
+        job = Job(kind)
+        job.future = Future()
+        job.future.set_result(result)
+        job.finished = job.submitted
+        with self.lock:
+            self.jobs[job.id] = job
+        return job
+
+    def _finished(self, job: Job):
+        from backend.core.utils.metrics import replay_records, set_worker_stats
+        job.finished = time.time()
+        if os.path.exists(job.cancel_file):  # cancelled while finishing
+            os.remove(job.cancel_file)
+        if job.task.cancelled():
+            job.future.cancel()
+        elif job.task.exception() is not None:
+            job.future.set_exception(job.task.exception())
+        else:
+            result, records, pid, stats = job.task.result()
+            replay_records(records)
+            set_worker_stats(pid, stats)
+            job.future.set_result(result)
+        with self.lock:
+            if self.running[job.worker] is job:
+                self.running[job.worker] = None
+                self._start(job.worker)
+
+    def get(self, job_id: str) -> Job | None:
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> Job | None:
+        """Cancels a queued job, or stops the solve of a running one (its result keeps the best incumbent)"""
+        from backend.core.utils.cancellation import request_cancel
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or job.future.done():
+                return job
+            job.cancelled = True
+            if job.task is None:  # still in the queue of its worker
+                self.queues[job.worker].remove(job)
+                job.finished = time.time()
+                job.future.cancel()
+                return job
+        if not job.task.cancel():
+            request_cancel(job.cancel_file)
+        return job
+
+    def stats(self) -> dict:
+        with self.lock:
+            pending = self._pending()
+        return {"workers": self.workers, "highs_threads": self.highs_threads, "pending": pending,
+                "max_queued": self.max_queued, "saturated": pending >= self.workers + self.max_queued}
+
+    def shutdown(self):
+        with self.lock:
+            queued = [job for queue in self.queues for job in queue]
+            for queue in self.queues:
+                queue.clear()
+        for job in queued:
+            job.future.cancel()
+        for i, executor in enumerate(self.executors):
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
+                self.executors[i] = None
@@ -0,0 +1,112 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+##############################################
+### RESULT CACHE KEYED BY CONTENT          ###
+##############################################
+
+# Responses of the optimize routes keyed by a hash of everything they depend on: the instance (dict_instance
+# records or the uploaded params / metadata bytes), the request options and the config sections read by the
+# pipeline. Entries are stored as JSON bytes in an LRU bounded by their size, and as <key>.json files when
+# `directory` is set. Disk entries survive restarts and are shared by the workers; they are not evicted.
+# Solves stopped by a deadline or cancelled are not cached.
+
+CONFIG_SECTIONS = ("data_maternity", "solver", "results")
+UNCACHED_STATUSES = ("time_limit", "cancelled")
+
+
+def content_key(kind: str, *parts) -> str:
+    """sha256 of `kind`, `parts` (bytes or JSON-serializable) and the config sections of the pipeline"""
+    from backend.core.utils.data_utils import read_configs
+    digest = hashlib.sha256(kind.encode())
+    configs = {section: read_configs(section) for section in CONFIG_SECTIONS}
+    configs["solver"] = {key: value for key, value in (configs["solver"] or {}).items() if key != "time_limit"}
+    for part in (*parts, configs):
+        data = part if isinstance(part, bytes) else json.dumps(part, sort_keys=True, default=str).encode()
+        digest.update(len(data).to_bytes(8, "little"))
+        digest.update(data)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """LRU of JSON responses bounded by memory size, with an optional directory and hit/miss counters"""
+
+    def __init__(self, max_bytes: int = 64 * 2**20, directory: str | None = None):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.entries = OrderedDict()  # key: JSON bytes
+        self.nbytes = 0
+        self.hits, self.disk_hits, self.misses, self.evictions = 0, 0, 0, 0
+        self.lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _insert(self, key: str, data: bytes):
+        if len(data) > self.max_bytes:
+            return
+        if key in self.entries:
+            self.nbytes -= len(self.entries.pop(key))
+        self.entries[key] = data
+        self.nbytes += len(data)
+        while self.nbytes > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.nbytes -= len(evicted)
+            self.evictions += 1
+
+    def get(self, key: str) -> dict | None:
+        with self.lock:
+            data = self.entries.get(key)
+            if data is not None:
+                self.hits += 1
+                self.entries.move_to_end(key)
+            elif self.directory and os.path.exists(self._path(key)):
+                with open(self._path(key), "rb") as f:
+                    data = f.read()
+                self.hits += 1
+                self.disk_hits += 1
+                self._insert(key, data)
+            else:
+                self.misses += 1
+                return None
+        return json.loads(data)
+
+    def __contains__(self, key: str) -> bool:
+        """Whether `key` is cached, without counting a lookup"""
+        with self.lock:
+            return key in self.entries or bool(self.directory and os.path.exists(self._path(key)))
+
+    def put(self, key: str, content: dict):
+        data = json.dumps(content).encode()
+        with self.lock:
+            self._insert(key, data)
+        if self.directory:
+            tmp_path = f"{self._path(key)}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(key))  # atomic, readers never see a partial file
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"hits": self.hits, "disk_hits": self.disk_hits, "misses": self.misses, "evictions": self.evictions,
+                    "hit_rate": self.hits / lookups if lookups else None, "entries": len(self.entries),
+                    "nbytes": self.nbytes, "max_bytes": self.max_bytes, "directory": self.directory}
+
+
+def cacheable(content: dict) -> bool:
+    """Responses of complete solves (not stopped by a deadline or a cancellation)"""
+    return content.get("status") not in UNCACHED_STATUSES
+
+
+def strip_timing(content: dict) -> dict:
+    """Response without the per-request "timing" field (top level for /optimize, in "results" for /optimize_maternite)"""
+    content = {key: value for key, value in content.items() if key != "timing"}
+    if isinstance(content.get("results"), dict) and "timing" in content["results"]:
+        content["results"] = {key: value for key, value in content["results"].items() if key != "timing"}
+    return content
@@ -1,6 +1,8 @@
-from fastapi import APIRouter, UploadFile, HTTPException, Body
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, UploadFile, HTTPException, Body, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
+from backend.api.jobs import QueueFull
 from backend.api.services import  ExecutableNotFound
+import asyncio
 import tempfile
 
 api = APIRouter()
@@ -9,86 +11,435 @@ api = APIRouter()
 def health():
     return {"status": "ok"}
 
+
+@api.get("/metrics")
+def metrics() -> PlainTextResponse:
+    """Route latencies, solver and model cache metrics in the Prometheus text format"""
+    from backend.core.utils.metrics import REGISTRY
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+async def _run_job(request: Request, kind: str, fn, *args, cache_key: str | None = None, worker_key: str | None = None):
+    """Solves in the job queue and waits for the result without blocking the event loop.
+    The solve is cancelled when the client disconnects"""
+    from backend.api.services import get_job_queue
+    job = _submit_job(kind, fn, *args, cache_key=cache_key, worker_key=worker_key)
+    future = asyncio.wrap_future(job.future)
+    while not future.done():
+        await asyncio.wait({future}, timeout=DISCONNECT_POLL_S)
+        if not future.done() and await request.is_disconnected():
+            get_job_queue().cancel(job.id)
+            raise HTTPException(status_code=499, detail="Client closed request")
+    return future.result()
+
+
+def _submit_job(kind: str, fn, *args, cache_key: str | None = None, worker_key: str | None = None):
+    """Submits fn(*args) to the job queue, in the worker of `worker_key` (see `JobQueue.submit`). With a `cache_key`,
+    a cached response is returned as an already finished job (with "cached": true) and the response of a complete
+    solve is cached"""
+    from backend.api.result_cache import cacheable, strip_timing
+    from backend.api.services import get_job_queue, get_result_cache
+    cache = get_result_cache() if cache_key is not None else None
+    if cache is not None:
+        content = cache.get(cache_key)
+        if content is not None:
+            return get_job_queue().completed(kind, {**content, "cached": True})
+    try:
+        job = get_job_queue().submit(kind, fn, *args, key=worker_key)
+    except QueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "5"})
+    if cache is not None:
+        def _store(future):
+            if not future.cancelled() and future.exception() is None and cacheable(future.result()):
+                cache.put(cache_key, strip_timing(future.result()))
+        job.future.add_done_callback(_store)
+    return job
+
+
+def _optimize_key(params_filepath: str, metadata_filepath: str, mip_gap: float | None) -> str:
+    """Result cache key of an /optimize request: uploaded params, their metadata file and the MIP gap"""
+    import os
+    from backend.api.result_cache import content_key
+    parts = []
+    for filepath in (params_filepath, metadata_filepath):
+        if os.path.exists(filepath):
+            with open(filepath, "rb") as f:
+                parts.append(f.read())
+        else:
+            parts.append(None)
+    return content_key("optimize", *parts, mip_gap)
+
+
+def _maternite_key(df_instance, transfers: float, n_regions: int | None, mode: str | None,
+                   mip_gap: float | None) -> str:
+    """Result cache key of an /optimize_maternite request: dict_instance records and the solve options"""
+    from backend.api.result_cache import content_key
+    return content_key("optimize_maternite", df_instance.to_dict(orient="records"), transfers, n_regions, mode, mip_gap)
+
+
+def _structure_worker_key(params_filepath: str) -> str | None:
+    """Job queue key of an /optimize request: the index sets of the uploaded params, which select the model
+    template (None when the file cannot be read, the job then fails as usual)"""
+    import json
+    from backend.core.model_cache import structure_key
+    try:
+        with open(params_filepath) as f:
+            return structure_key(json.load(f))
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def _scenario_worker_key(df_instance, n_regions: int | None) -> str | None:
+    """Job queue key of a maternity request: its scenario, which selects the persistent model"""
+    from backend.api.services import get_scenario_key
+    try:
+        return get_scenario_key(df_instance, n_regions)
+    except KeyError:
+        return None
+
+
+async def _read_optimize_upload(file_params: UploadFile) -> tuple[str, str]:
+    """Stores the uploaded params in a temporary file, returns (params_filepath, metadata_filepath)"""
+    with tempfile.NamedTemporaryFile(delete=False) as tmp_file:
+        tmp_file.write(await file_params.read())
+        params_filepath = tmp_file.name
+    original_filename = file_params.filename
+    return params_filepath, "backend/data/metadata_" + original_filename.split('_')[1]
+
+
+def _read_solve_limits(time_limit, mip_gap) -> tuple:
+    """(deadline, mip_gap) from the `time_limit` (s, counted from now, queue included) and `mip_gap` of a request,
+    `solver` section of config.yaml when None"""
+    import time
+    from backend.core.utils.data_utils import read_configs
+    configs = read_configs("solver") or {}
+    time_limit = configs.get("time_limit") if time_limit is None else time_limit
+    mip_gap = configs.get("mip_gap") if mip_gap is None else mip_gap
+    try:
+        time_limit = float(time_limit) if time_limit is not None else None
+        mip_gap = float(mip_gap) if mip_gap is not None else None
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=422, detail="'time_limit' and 'mip_gap' must be numbers")
+    if (time_limit is not None and time_limit <= 0) or (mip_gap is not None and mip_gap < 0):
+        raise HTTPException(status_code=422, detail="'time_limit' must be positive and 'mip_gap' non-negative")
+    return (time.time() + time_limit if time_limit is not None else None), mip_gap
+
+
+def _read_maternite_payload(payload: dict) -> tuple:
+    """(df_instance, transfers, n_regions, mode, timing, deadline, mip_gap) of an /optimize_maternite payload"""
+    from backend.core.utils.data_utils import read_configs
+    import pandas as pd 
+    df_instance = pd.DataFrame(payload.get("dict_instance"))
+    transfers = float(payload.get("transfers"))
+    n_regions = payload.get("n_regions", read_configs("data_maternity").get("n_regions"))
+    n_regions = int(n_regions) if n_regions is not None else None
+    mode = payload.get("mode")
+    timing = bool(payload.get("timing", False))
+    if mode not in (None, "exact", "relaxed"):
+        raise HTTPException(status_code=422, detail="'mode' must be 'exact' or 'relaxed'")
+    return df_instance, transfers, n_regions, mode, timing, *_read_solve_limits(payload.get("time_limit"), payload.get("mip_gap"))
+
+
+def _read_sweep_payload(payload: dict) -> tuple:
+    """(df_instance, list_transfers, list_alpha, n_regions, timing, deadline, mip_gap) of a /sweep_maternite payload"""
+    from backend.api.services import get_sweep_values
+    from backend.core.utils.data_utils import read_configs
+    import pandas as pd 
+    df_instance = pd.DataFrame(payload.get("dict_instance"))
+    if payload.get("transfers") is None:
+        raise HTTPException(status_code=422, detail="Missing 'transfers'")
+    config = read_configs("data_maternity")
+    list_transfers = get_sweep_values(payload["transfers"])
+    list_alpha = get_sweep_values(payload.get("alpha"), config["alpha"])
+    n_regions = payload.get("n_regions", config.get("n_regions"))
+    n_regions = int(n_regions) if n_regions is not None else None
+    return df_instance, list_transfers, list_alpha, n_regions, bool(payload.get("timing", False)), \
+        *_read_solve_limits(payload.get("time_limit"), payload.get("mip_gap"))
+
+
+DISCONNECT_POLL_S = 0.5
+
+MISSING_TYPE_3 = {
+    "status": "Infeasible",
+    "details": "Missing facility of type 3",
+    "results": None
+}
+
+
 @api.post("/optimize")
-async def optimize(file_params: UploadFile) -> JSONResponse:
-    from backend.api.services import run_optimization, get_regions_metadata
+async def optimize(request: Request, file_params: UploadFile, timing: bool = False, time_limit: float | None = None,
+                   mip_gap: float | None = None) -> JSONResponse:
+    from backend.api.services import optimize_job
     import traceback
 
     try:
-        with tempfile.NamedTemporaryFile(delete=False) as tmp_file:
-            tmp_file.write(await file_params.read())
-            params_filepath = tmp_file.name
-        
-        original_filename = file_params.filename
-        metadata_filepath = "backend/data/metadata_" + original_filename.split('_')[1]
-
-        regions = get_regions_metadata(metadata_filepath)
-        
-        status, objective_str, list_patient_transfers, list_facility_load, list_facility_load_regions = run_optimization(
-            params_filepath, metadata_filepath)
+        limits = _read_solve_limits(time_limit, mip_gap)
+        params_filepath, metadata_filepath = await _read_optimize_upload(file_params)
+        content = await _run_job(request, "optimize", optimize_job, params_filepath, metadata_filepath, timing, *limits,
+                                 cache_key=_optimize_key(params_filepath, metadata_filepath, limits[1]),
+                                 worker_key=_structure_worker_key(params_filepath))
+        return JSONResponse(status_code=200, content=content)
 
-        return JSONResponse(
-            status_code=200,
-            content={
-                "status": status,
-                "obj_val": objective_str,
-                "list_patient_transfers": [pt.as_geojson_feature() for pt in list_patient_transfers],
-                "list_facility_load": [pt.as_geojson_feature() for pt in list_facility_load],
-                "list_facility_load_regions" : [pt.as_geojson_feature() for pt in list_facility_load_regions],
-                "regions": regions
-            },
-        )
+    except HTTPException:
+        raise
 
     except ExecutableNotFound as e:
         raise HTTPException(status_code=500, detail=str(e))
 
     except Exception as e:
         print("Error in optimize route:", e)
-        traceback.print_exc()
+        traceback.print_exception(e)
         raise HTTPException(status_code=500, detail="Internal server error")
 
 
 @api.post("/optimize_maternite")
-async def optimize_maternite(payload = Body(...)) -> JSONResponse:
-    from backend.api.services import run_optimization_maternite
-    import pandas as pd 
+async def optimize_maternite(request: Request, payload = Body(...)) -> JSONResponse:
+    from backend.api.services import optimize_maternite_job
     import traceback
-    df_instance = pd.DataFrame(payload.get("dict_instance"))
-    transfers = float(payload.get("transfers"))
-    if "3" not in df_instance["type"].unique():
-        return {
-            "status": "Infeasible",
-            "details": "Missing facility of type 3",
-            "results": None
-        }
+    args = _read_maternite_payload(payload)
+    if "3" not in args[0]["type"].unique():
+        return MISSING_TYPE_3
     try:
-        status, avg_distance, list_patient_transfers, list_facility_load, list_facility_load_regions, regions =\
-              run_optimization_maternite(df_instance, transfers)
-
-        return {
-                "status": status,
-                "results": {"avg_distance": avg_distance,
-                        "list_patient_transfers": [pt.as_geojson_feature() for pt in list_patient_transfers],
-                        "list_facility_load": [pt.as_geojson_feature() for pt in list_facility_load],
-                        "list_facility_load_regions" : [pt.as_geojson_feature() for pt in list_facility_load_regions],
-                        "regions": regions}
-            }
+        return await _run_job(request, "optimize_maternite", optimize_maternite_job, *args,
+                              cache_key=_maternite_key(*args[:4], args[6]), worker_key=_scenario_worker_key(args[0], args[2]))
+
+    except HTTPException:
+        raise
+
     except ExecutableNotFound as e:
         raise HTTPException(status_code=500, detail=str(e))
 
     except Exception as e:
         print("Error in optimize route:")
-        traceback.print_exc()
+        traceback.print_exception(e)
         raise HTTPException(status_code=500, detail="Internal server error")
 
 
 
 
+@api.post("/sweep_maternite")
+async def sweep_maternite(request: Request, payload = Body(...)) -> JSONResponse:
+    """Trade-off curve in one call: `transfers` and `alpha` are numbers, lists or ranges {"start", "stop", "num"}"""
+    from backend.api.services import sweep_maternite_job
+    import traceback
+    args = _read_sweep_payload(payload)
+    if "3" not in args[0]["type"].unique():
+        return MISSING_TYPE_3
+    try:
+        return await _run_job(request, "sweep_maternite", sweep_maternite_job, *args,
+                              worker_key=_scenario_worker_key(args[0], args[3]))
+
+    except HTTPException:
+        raise
+
+    except ExecutableNotFound as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    except Exception as e:
+        print("Error in sweep route:")
+        traceback.print_exception(e)
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+
+##############################################
+### SOLVE JOBS (submit and poll)           ###
+##############################################
+
+# Same inputs as /optimize, /optimize_maternite and /sweep_maternite, answered at once with a job id (202).
+# GET /jobs/{job_id} returns the status ("queued", "running", "done", "failed" or "cancelled") and, once done, the
+# response of the synchronous route in "result". DELETE /jobs/{job_id} cancels the job. Saturated queue: 429 with
+# a Retry-After header.
+
+def _job_accepted(job) -> JSONResponse:
+    return JSONResponse(status_code=202, content={"job_id": job.id, "status": job.status},
+                        headers={"Location": f"/api/jobs/{job.id}"})
+
+
+@api.post("/jobs/optimize")
+async def submit_optimize(file_params: UploadFile, timing: bool = False, time_limit: float | None = None,
+                          mip_gap: float | None = None) -> JSONResponse:
+    from backend.api.services import optimize_job
+    limits = _read_solve_limits(time_limit, mip_gap)
+    params_filepath, metadata_filepath = await _read_optimize_upload(file_params)
+    return _job_accepted(_submit_job("optimize", optimize_job, params_filepath, metadata_filepath, timing, *limits,
+                                     cache_key=_optimize_key(params_filepath, metadata_filepath, limits[1]),
+                                     worker_key=_structure_worker_key(params_filepath)))
+
+
+@api.post("/jobs/optimize_maternite")
+async def submit_optimize_maternite(payload = Body(...)) -> JSONResponse:
+    from backend.api.services import optimize_maternite_job
+    args = _read_maternite_payload(payload)
+    if "3" not in args[0]["type"].unique():
+        return MISSING_TYPE_3
+    return _job_accepted(_submit_job("optimize_maternite", optimize_maternite_job, *args,
+                                     cache_key=_maternite_key(*args[:4], args[6]),
+                                     worker_key=_scenario_worker_key(args[0], args[2])))
+
+
+@api.post("/jobs/sweep_maternite")
+async def submit_sweep_maternite(payload = Body(...)) -> JSONResponse:
+    from backend.api.services import sweep_maternite_job
+    args = _read_sweep_payload(payload)
+    if "3" not in args[0]["type"].unique():
+        return MISSING_TYPE_3
+    return _job_accepted(_submit_job("sweep_maternite", sweep_maternite_job, *args,
+                                     worker_key=_scenario_worker_key(args[0], args[3])))
+
+
+@api.get("/jobs")
+def jobs_stats() -> dict:
+    """Workers and queue depth"""
+    from backend.api.services import get_job_queue
+    return get_job_queue().stats()
+
+
+@api.get("/result_cache")
+def result_cache_stats() -> dict:
+    """Hits, misses and size of the cache of optimize responses"""
+    from backend.api.services import get_result_cache
+    cache = get_result_cache()
+    return cache.stats() if cache is not None else {"enabled": False}
+
+
+@api.get("/jobs/{job_id}")
+def job_status(job_id: str) -> JSONResponse:
+    from backend.api.services import get_job_queue
+    job = get_job_queue().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job '{job_id}'")
+    return JSONResponse(status_code=200, content=job.as_dict())
+
+
+@api.delete("/jobs/{job_id}")
+def cancel_job(job_id: str) -> JSONResponse:
+    """Cancels a queued or running job (a running solve stops with its best incumbent, status "cancelled")"""
+    from backend.api.services import get_job_queue
+    job = get_job_queue().cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job '{job_id}'")
+    return JSONResponse(status_code=200, content={"job_id": job.id, "status": job.status})
+
+
+##############################################
+### SCENARIO SESSIONS                      ###
+##############################################
+
+# POST /sessions creates a scenario from a region / department of the maternity dataset (or a dict_instance)
+# and returns its session_id. PATCH /sessions/{session_id} applies a delta (see `backend.api.sessions`) and
+# returns the totals with the GeoJSON of the edited facilities only. POST /sessions/{session_id}/optimize solves
+# the current scenario without re-serializing what the edits did not touch.
+
+def _get_session(session_id: str):
+    from backend.api.services import get_session_store
+    session = get_session_store().get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail=f"Unknown session '{session_id}'")
+    return session
+
+
+def _session_content(session, facilities: list | None = None) -> dict:
+    """Session summary with the dashboard and the GeoJSON of `facilities` (all when None)"""
+    from backend.api.services import get_facility_capacity_maternite, get_maternite_dashboard
+    df_instance = session.df_instance
+    if facilities is not None:
+        df_instance = df_instance[df_instance["nofinesset"].astype(str).isin(facilities)]
+    return {**session.summary(), "dashboard_stats": get_maternite_dashboard(session.df_instance),
+            "list_facility_load": get_facility_capacity_maternite(df_instance)}
+
+
+@api.post("/sessions")
+async def create_session(payload = Body(...)) -> JSONResponse:
+    from backend.api.sessions import ScenarioSession
+    from backend.api.services import get_session_store
+    from backend.core.mappers.datasets_mappers.maternite_serializer import get_maternity_dataset
+    from backend.core.utils.data_utils import read_configs
+    import pandas as pd 
+    if payload.get("dict_instance") is not None:
+        df_instance = pd.DataFrame(payload["dict_instance"])
+    else:
+        df_instance = get_maternity_dataset().subset(payload.get("region"), payload.get("department"))
+    if df_instance.empty:
+        raise HTTPException(status_code=422, detail="No maternity in the selected region / department")
+    n_regions = payload.get("n_regions", read_configs("data_maternity").get("n_regions"))
+    if payload.get("mode") not in (None, "exact", "relaxed"):
+        raise HTTPException(status_code=422, detail="'mode' must be 'exact' or 'relaxed'")
+    session = ScenarioSession(df_instance, float(payload.get("transfers", 0)),
+                              int(n_regions) if n_regions is not None else None, payload.get("mode"))
+    get_session_store().put(session)
+    return JSONResponse(status_code=201, content=_session_content(session),
+                        headers={"Location": f"/api/sessions/{session.id}"})
+
+
+@api.get("/sessions/{session_id}")
+def get_session(session_id: str, instance: bool = False) -> JSONResponse:
+    """Summary, dashboard and facilities of the session (and its dict_instance with instance=true)"""
+    session = _get_session(session_id)
+    content = _session_content(session)
+    if instance:
+        content["dict_instance"] = session.df_instance.to_dict(orient="records")
+    return JSONResponse(status_code=200, content=content)
+
+
+@api.patch("/sessions/{session_id}")
+async def edit_session(session_id: str, payload = Body(...)) -> JSONResponse:
+    session = _get_session(session_id)
+    facilities = set(session.df_instance["nofinesset"].astype(str))
+    try:
+        changed = session.apply_delta(payload)
+    except (TypeError, ValueError) as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    removed = sorted(facilities - set(session.df_instance["nofinesset"].astype(str)))
+    return JSONResponse(status_code=200, content={**_session_content(session, changed), "removed": removed})
+
+
+@api.delete("/sessions/{session_id}")
+def delete_session(session_id: str) -> JSONResponse:
+    from backend.api.services import get_session_store
+    if not get_session_store().delete(session_id):
+        raise HTTPException(status_code=404, detail=f"Unknown session '{session_id}'")
+    return JSONResponse(status_code=200, content={"session_id": session_id, "status": "deleted"})
+
+
+@api.post("/sessions/{session_id}/optimize")
+async def optimize_session(request: Request, session_id: str, payload = Body(default={})) -> JSONResponse:
+    """Solves the current scenario of the session, same response as /optimize_maternite"""
+    from backend.api.services import get_result_cache, optimize_maternite_job, serialize_maternite_regions
+    import traceback
+    session = _get_session(session_id)
+    deadline, mip_gap = _read_solve_limits(payload.get("time_limit"), payload.get("mip_gap"))
+    if "3" not in session.df_instance["type"].unique():
+        return MISSING_TYPE_3
+    # State of this request: edits made while it waits for the workers apply to the next solve
+    df_instance, transfers, n_regions, mode, version = \
+        session.df_instance, session.transfers, session.n_regions, session.mode, session.version
+    cache_key = _maternite_key(df_instance, transfers, n_regions, mode, mip_gap)
+    try:
+        cache = get_result_cache()
+        params = session.params
+        if params is None and (cache is None or cache_key not in cache):
+            params = await _run_job(request, "serialize_maternite", serialize_maternite_regions, df_instance, n_regions)
+            session.set_params(params, version)
+        return await _run_job(request, "optimize_maternite", optimize_maternite_job, df_instance, transfers, n_regions,
+                              mode, bool(payload.get("timing", False)), deadline, mip_gap, params, cache_key=cache_key,
+                              worker_key=_scenario_worker_key(df_instance, n_regions))
+
+    except HTTPException:
+        raise
+
+    except ExecutableNotFound as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    except Exception as e:
+        print("Error in session optimize route:")
+        traceback.print_exception(e)
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+
 @api.post("/update_maternites")
 async def update_maternites(payload = Body(...)) -> JSONResponse:
     from backend.api.services import get_facility_capacity_maternite
     from backend.api.services import get_maternite_dashboard
-    from backend.core.mappers.datasets_mappers.maternite_serializer import read_maternity
+    from backend.core.mappers.datasets_mappers.maternite_serializer import get_maternity_dataset
     import traceback
 
     try:
@@ -98,25 +449,17 @@ async def update_maternites(payload = Body(...)) -> JSONResponse:
                 content=payload,
             )
         else:
-            df_maternites = read_maternity()
-            df_instance = df_maternites
-
             region =  payload.get("region")
             department = payload.get("department")
-            
-            if region:
-                df_instance = df_instance[df_instance["region_name"] == region ]
-
-            if department:
-                df_instance = df_instance[df_instance["dep_name"] == department ]
+            df_instance = get_maternity_dataset().subset(region, department)
 
             if "global_capacity" in payload:
                 perc = payload["global_capacity"] / 100
-                df_instance["beds"] = df_instance["beds"].apply(lambda x : int(x + x * perc))
+                df_instance["beds"] = (df_instance["beds"] + df_instance["beds"] * perc).astype(int)
                 
             if "demand" in payload:
                 perc = payload["demand"] / 100
-                df_instance["deliveries_per_facility"] = df_instance["deliveries_per_facility"].apply(lambda x : int(x + x * perc))
+                df_instance["deliveries_per_facility"] = (df_instance["deliveries_per_facility"] + df_instance["deliveries_per_facility"] * perc).astype(int)
             
             list_facility_load = get_facility_capacity_maternite(df_instance)
             dashboard_stats = get_maternite_dashboard(df_instance)
@@ -142,20 +485,13 @@ async def read_maternites(payload = Body(...)) -> JSONResponse:
     import traceback
     from backend.api.services import get_facility_capacity_maternite
     from backend.api.services import get_maternite_dashboard
-    from backend.core.mappers.datasets_mappers.maternite_serializer import read_maternity
+    from backend.core.mappers.datasets_mappers.maternite_serializer import get_maternity_dataset
 
     try:
 
-        df_maternites = read_maternity()
-        df_instance = df_maternites
         region =  payload.get("region")
         department = payload.get("department")
-        
-        if region:
-            df_instance = df_instance[df_instance["region_name"] == region ]
-
-        if department:
-            df_instance = df_instance[df_instance["dep_name"] == department ]
+        df_instance = get_maternity_dataset().subset(region, department)
 
 
         list_facility_load = get_facility_capacity_maternite(df_instance)
@@ -1,6 +1,12 @@
 from pathlib import Path
 from typing import Tuple
+from backend.api.jobs import JobQueue
+from backend.api.result_cache import ResultCache
+from backend.api.sessions import SessionStore
 from backend.core.mappers.output_mappers import create_facilityStats, create_patientTransfers
+from backend.core.persistent_model import ModelStore, PersistentModel
+from backend.core.utils.metrics import REGISTRY, Counter, Gauge, worker_stats
+from backend.core.utils.tracing import span
 import pandas as pd 
 import logging
 logging.basicConfig(level=logging.DEBUG)
@@ -18,53 +24,370 @@ def check_executable(exec_name="highs"):
     if solver_path is None:
         raise ExecutableNotFound(f"Executable '{exec_name}' not found")
 
-def run_optimization_maternite(df_instance : pd.DataFrame, transfers : float) -> Tuple[str, str, list, list]:
-    """Run the optimization problem with a the upper bound of allowed resource export set to `transfers`"""
+
+def get_solver_configs() -> dict:
+    """Returns the `solver` section of config.yaml (+ `decomposition` when enabled), checking for the `highs` executable
+    only when it is needed"""
+    from backend.core.utils.data_utils import read_configs
+    solver_configs = read_configs("solver") or {}
+    if solver_configs.get("solver", "highs_cmd") == "highs_cmd":
+        check_executable()
+    decomposition = read_configs("decomposition") or {}
+    if decomposition.get("processes", 1) > 1:
+        solver_configs["decomposition"] = decomposition
+    return solver_configs
+
+
+def use_persistent_model(solver_configs: dict) -> bool:
+    """Persistent models need the arrays engine with in-process highs, and are not used with the block decomposition"""
+    return solver_configs.get("engine") == "arrays" and solver_configs.get("solver") == "highs" and "decomposition" not in solver_configs
+
+_MODEL_STORE = None
+
+def _model_store_stats() -> list:
+    """Model store statistics of this process and of the job workers"""
+    return ([_MODEL_STORE.stats()] if _MODEL_STORE is not None else []) + worker_stats("model_store")
+
+
+REGISTRY.register(Gauge("safepaw_persistent_models", "Scenarios kept alive in the persistent model stores",
+                        function=lambda: {(): sum(stats["models"] for stats in _model_store_stats())}))
+REGISTRY.register(Counter("safepaw_persistent_model_lookups_total", "Lookups of the persistent model stores", ("result",),
+                          function=lambda: {("hit",): sum(stats["hits"] for stats in _model_store_stats()),
+                                            ("miss",): sum(stats["misses"] for stats in _model_store_stats())}))
+
+def get_model_store() -> ModelStore | None:
+    """Returns the process-wide store of persistent models (None when disabled in config.yaml)"""
+    global _MODEL_STORE
+    from backend.core.utils.data_utils import read_configs
+    if _MODEL_STORE is None:
+        max_models = (read_configs("persistent_models") or {}).get("max_models", 0)
+        if max_models <= 0:
+            return None
+        _MODEL_STORE = ModelStore(max_models=max_models)
+    return _MODEL_STORE
+
+
+_JOB_QUEUE = None
+
+REGISTRY.register(Gauge("safepaw_jobs_pending", "Solve jobs queued or running in the job queue",
+                        function=lambda: {(): _JOB_QUEUE.stats()["pending"] if _JOB_QUEUE is not None else 0}))
+
+def get_job_queue() -> JobQueue:
+    """Returns the process-wide queue of solve jobs, sized by the `jobs` section of config.yaml"""
+    global _JOB_QUEUE
+    from backend.core.utils.data_utils import read_configs
+    if _JOB_QUEUE is None:
+        configs = read_configs("jobs") or {}
+        _JOB_QUEUE = JobQueue(workers=configs.get("workers"), highs_threads=configs.get("highs_threads", 1),
+                              max_queued=configs.get("max_queued", 16), keep_finished=configs.get("keep_finished", 100))
+    return _JOB_QUEUE
+
+
+def shutdown_job_queue():
+    global _JOB_QUEUE
+    if _JOB_QUEUE is not None:
+        _JOB_QUEUE.shutdown()
+        _JOB_QUEUE = None
+
+
+_RESULT_CACHE = None
+
+REGISTRY.register(Gauge("safepaw_result_cache_bytes", "Memory held by the cached optimize responses",
+                        function=lambda: {(): _RESULT_CACHE.nbytes if _RESULT_CACHE is not None else 0}))
+REGISTRY.register(Counter("safepaw_result_cache_lookups_total", "Lookups of the optimize result cache", ("result",),
+                          function=lambda: {("hit",): _RESULT_CACHE.hits, ("miss",): _RESULT_CACHE.misses}
+                          if _RESULT_CACHE is not None else {}))
+
+def get_result_cache() -> ResultCache | None:
+    """Returns the process-wide cache of optimize responses (None when disabled in config.yaml)"""
+    global _RESULT_CACHE
+    from backend.core.utils.data_utils import read_configs
+    if _RESULT_CACHE is None:
+        configs = read_configs("result_cache") or {}
+        if configs.get("max_mb", 0) <= 0:
+            return None
+        _RESULT_CACHE = ResultCache(max_bytes=int(configs["max_mb"] * 2**20), directory=configs.get("directory"))
+    return _RESULT_CACHE
+
+
+_SESSION_STORE = None
+
+REGISTRY.register(Gauge("safepaw_scenario_sessions", "Scenario sessions kept by the API process",
+                        function=lambda: {(): len(_SESSION_STORE.sessions) if _SESSION_STORE is not None else 0}))
+
+def get_session_store() -> SessionStore:
+    """Returns the process-wide store of scenario sessions, sized by the `sessions` section of config.yaml"""
+    global _SESSION_STORE
+    from backend.core.utils.data_utils import read_configs
+    if _SESSION_STORE is None:
+        configs = read_configs("sessions") or {}
+        _SESSION_STORE = SessionStore(max_sessions=configs.get("max_sessions", 100), ttl_s=configs.get("ttl_s", 3600))
+    return _SESSION_STORE
+
+
+def get_scenario_key(df_instance : pd.DataFrame, n_regions : int | None = None) -> str:
+    """Hash of a maternity instance, ignoring the beds (they only change the right-hand side of the model)"""
+    import hashlib
+    import json
+    from backend.core.utils.data_utils import read_configs
+    content = df_instance.drop(columns=["beds"]).to_json(orient="records") + json.dumps(read_configs("data_maternity"), sort_keys=True)\
+        + str(n_regions)
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def serialize_maternite_regions(df_instance : pd.DataFrame, n_regions : int | None = None) -> tuple[dict, dict]:
+    """`serialize_maternite` followed by the aggregation of the communes into at most `n_regions` super-regions"""
     from backend.core.mappers.datasets_mappers.maternite_serializer import serialize_maternite
+    from backend.core.mappers.region_aggregation import aggregate_regions
+    with span("serialize", H=len(df_instance)):
+        params_system, params_metadata = serialize_maternite(df_instance)
+    if n_regions is not None:
+        n_communes = len(params_system["R"])
+        with span("aggregate_regions", R=n_communes) as current:
+            params_system, params_metadata = aggregate_regions(params_system, params_metadata, n_regions)
+            current.set(n_regions=len(params_system["R"]))
+        print(f"Aggregated {n_communes} communes into {len(params_system['R'])} regions")
+    return params_system, params_metadata
+
+
+def get_solve_info(info: dict, mode: str) -> dict:
+    """Solve mode, MIP gap and bound (of the best incumbent when the solve was stopped) and, for mode="relaxed",
+    the relaxation bound and the gap of the rounded solution"""
+    import math
+
+    def finite(value):  # JSON has no inf / nan (no incumbent or no bound yet)
+        return value if value is None or math.isfinite(value) else None
+
+    return {"mode": mode, "mip_gap": finite(info.get("mip_gap")), "objective_bound": finite(info.get("objective_bound")),
+            "relaxation_bound": info.get("relaxation_bound"), "gap": info.get("gap"), "rounding": info.get("rounding")}
+
+
+def apply_solve_limits(solver_configs: dict, deadline: float | None = None, mip_gap: float | None = None) -> dict:
+    """Sets the time left before `deadline` (time.time() seconds) and the MIP gap in the `run_driver` arguments"""
+    import time
+    if deadline is not None:
+        solver_configs["time_limit"] = max(deadline - time.time(), 0.0)
+    if mip_gap is not None:
+        solver_configs["mip_gap"] = mip_gap
+    return solver_configs
+
+
+def solve_maternite_persistent(df_instance : pd.DataFrame, transfers : float, model_store: ModelStore | None,
+                               n_regions : int | None = None, mode : str = "exact", deadline : float | None = None,
+                               mip_gap : float | None = None, params : tuple | None = None):
+    """Re-solves the live model of the scenario after editing transfers and capacities, or builds it on first use
+    (kept in `model_store` unless it is None) from `params` (serialized instance of a session) when given"""
+    from backend.core.mappers.datasets_mappers.maternite_serializer import get_capacities
+    key = get_scenario_key(df_instance, n_regions)
+    b_hl_out = [[transfers] for _ in range(len(df_instance))]
+    handle = model_store.get(key) if model_store is not None else None
+    if handle is None:
+        params_system, params_metadata = (dict(params[0]), params[1]) if params is not None else \
+            serialize_maternite_regions(df_instance, n_regions)
+        params_system["b_hl_out"] = b_hl_out
+        handle = PersistentModel(params_system, params_metadata)
+        if model_store is not None:
+            model_store.put(key, handle)
+        with handle.lock:
+            status, objective, results = handle.solve(mode, **apply_solve_limits({}, deadline, mip_gap))
+            solve_info = get_solve_info(handle.result.info, mode)
+    else:
+        with handle.lock:
+            handle.update(b_hl_out=b_hl_out, m_hl=get_capacities(df_instance))
+            status, objective, results = handle.solve(mode, **apply_solve_limits({}, deadline, mip_gap))
+            solve_info = get_solve_info(handle.result.info, mode)
+    return status, objective, results, handle.params_system, handle.params_metadata, solve_info
+
+
+def run_optimization_maternite(df_instance : pd.DataFrame, transfers : float, n_regions : int | None = None,
+                               mode : str | None = None, deadline : float | None = None,
+                               mip_gap : float | None = None, params : tuple | None = None) -> Tuple[str, str, list, list]:
+    """Run the optimization problem with a the upper bound of allowed resource export set to `transfers`.
+    With `n_regions` the communes are grouped into at most `n_regions` super-regions (faster, approximate).
+    `mode` ("exact" or "relaxed", default from config.yaml) selects the MIP or the LP relaxation with rounded transfers.
+    The solve stops at `deadline` (time.time() seconds) or at `mip_gap`, with status "time_limit" and the best
+    incumbent when the deadline is reached. `params` is the (params_system, params_metadata) of `df_instance` when
+    already serialized (scenario sessions)"""
     from backend.core.mappers.output_mappers import get_average_distance
+    from backend.core.mappers.region_aggregation import disaggregate_results
     from backend.core.main import run_driver
-    check_executable() # Check solver
-    params_system, params_metadata = serialize_maternite(df_instance)
-    params_system["b_hl_out"] = [[transfers] for _ in range(len(params_system["H"]))]
+    solver_configs = get_solver_configs() # Check solver
+    if mode is not None:
+        solver_configs["mode"] = mode
+    mode = solver_configs.get("mode", "exact")
     print("Starting optimization driver...")
-    status, objective, results = run_driver(params_system)
+    if use_persistent_model(solver_configs):
+        status, objective, results, params_system, params_metadata, solve_info = \
+            solve_maternite_persistent(df_instance, transfers, get_model_store(), n_regions, mode, deadline, mip_gap, params)
+    else:
+        params_system, params_metadata = (dict(params[0]), params[1]) if params is not None else \
+            serialize_maternite_regions(df_instance, n_regions)
+        params_system["b_hl_out"] = [[transfers] for _ in range(len(params_system["H"]))]
+        info = {}
+        status, objective, results = run_driver(params_system, **apply_solve_limits(solver_configs, deadline, mip_gap), info=info)
+        solve_info = get_solve_info(info, mode)
     print("Optimization driver finished with status:", status)
+    with span("disaggregate"):
+        results, params_system, params_metadata = disaggregate_results(results, params_system, params_metadata)
     if objective is None:
-        return status, None, [], [], [], params_metadata["regions"]
+        return status, None, [], [], [], params_metadata["regions"], solve_info
     else:
-        list_patient_transfers = create_patientTransfers(results, params_system, params_metadata) if objective is not None else []
-        list_facility_load = create_facilityStats(results, params_system, params_metadata) if objective is not None else []
-        list_facility_load_regions = create_facilityStats(results, params_system, params_metadata, by_region=True) if objective is not None else [] 
-        average_distance = get_average_distance(results, params_system)
-    return status, average_distance, list_patient_transfers, list_facility_load, list_facility_load_regions, params_metadata["regions"]
+        with span("mapping", R=len(params_system["R"]), H=len(params_system["H"])):
+            list_patient_transfers = create_patientTransfers(results, params_system, params_metadata) if objective is not None else []
+            list_facility_load = create_facilityStats(results, params_system, params_metadata) if objective is not None else []
+            list_facility_load_regions = create_facilityStats(results, params_system, params_metadata, by_region=True) if objective is not None else [] 
+            average_distance = get_average_distance(results, params_system)
+    return status, average_distance, list_patient_transfers, list_facility_load, list_facility_load_regions, params_metadata["regions"], solve_info
+
+
+
+def get_sweep_values(values, default: float | None = None) -> list[float]:
+    """Sweep axis from the payload: a number, a list of numbers or a range {"start", "stop", "num"}"""
+    import numpy as np
+    if values is None:
+        return [float(default)]
+    if isinstance(values, dict):
+        return [float(v) for v in np.linspace(values["start"], values["stop"], int(values.get("num", 5)))]
+    if isinstance(values, (list, tuple)):
+        return [float(v) for v in values]
+    return [float(values)]
+
+
+def get_facility_loads(results: dict, params_system: dict, params_metadata: dict) -> dict:
+    """Total load (patients) per facility name"""
+    from backend.core.mappers.output_mappers import _compute_load
+    df_loads = _compute_load(results, False, False, False, params_system)
+    return {params_metadata["facilities"][row.facility.split("_")[1]]["name"]: float(row.load)
+            for row in df_loads.itertuples(index=False)}
 
 
+def run_sweep_maternite(df_instance : pd.DataFrame, list_transfers : list[float], list_alpha : list[float],
+                        n_regions : int | None = None, deadline : float | None = None,
+                        mip_gap : float | None = None) -> list[dict]:
+    """Solves the maternity instance for every (alpha, transfers) point of the grid.
+    The instance is serialized once; with the arrays engine and highs the same model is re-solved from
+    the previous solution, only the right-hand sides (transfers) and the objective (alpha) being edited.
+    `deadline` applies to the whole sweep: the points solved after it get the "time_limit" status"""
+    import copy
+    from backend.core.mappers.output_mappers import get_average_distance
+    from backend.core.mappers.region_aggregation import disaggregate_results
+    from backend.core.main import run_driver
+    solver_configs = get_solver_configs() # Check solver
+    params_system, params_metadata = serialize_maternite_regions(df_instance, n_regions)
+    n_facilities = len(params_system["H"])
+    persistent = use_persistent_model(solver_configs)
+    handle = PersistentModel(params_system, params_metadata) if persistent else None
+
+    list_points = []
+    for alpha in list_alpha:
+        for transfers in list_transfers:
+            b_hl_out = [[transfers] for _ in range(n_facilities)]
+            print(f"Sweep point alpha={alpha}, transfers={transfers}")
+            if persistent:
+                handle.update(b_hl_out=b_hl_out, alpha=alpha)
+                status, objective, results = handle.solve(solver_configs.get("mode", "exact"),
+                                                          **apply_solve_limits({}, deadline, mip_gap))
+                params_point = handle.params_system
+            else:
+                params_point = copy.deepcopy(params_system)
+                params_point["b_hl_out"], params_point["alpha"] = b_hl_out, [alpha]
+                status, objective, results = run_driver(params_point, **apply_solve_limits(solver_configs, deadline, mip_gap))
+            point = {"alpha": alpha, "transfers": transfers, "status": status, "objective": objective,
+                     "avg_distance": None, "facility_load": {}}
+            if objective is not None:
+                with span("mapping"):
+                    results, params_point, metadata_point = disaggregate_results(results, params_point, params_metadata)
+                    point["avg_distance"] = get_average_distance(results, params_point)
+                    point["facility_load"] = get_facility_loads(results, params_point, metadata_point)
+            list_points.append(point)
+    return list_points
+
 
-def run_optimization(params_filepath: str | Path, metadata_filepath: str | Path) -> Tuple[str, str, list, list]:
+def run_optimization(params_filepath: str | Path, metadata_filepath: str | Path, deadline: float | None = None,
+                     mip_gap: float | None = None) -> Tuple[str, str, list, list]:
     from backend.core.utils import data_utils
     from backend.core.main import run_driver
 
     # Check solver
-    check_executable()
+    solver_configs = get_solver_configs()
 
     # Load input
-    params_system = data_utils.read_inputs(params_filepath)
-    params_metadata = data_utils.read_metadata(metadata_filepath)
+    with span("read_inputs"):
+        params_system = data_utils.read_inputs(params_filepath)
+        params_metadata = data_utils.read_metadata(metadata_filepath)
 
     # Run optimization
     print("Starting optimization driver...")
-    status, objective, results = run_driver(params_system)
+    info = {}
+    status, objective, results = run_driver(params_system, **apply_solve_limits(solver_configs, deadline, mip_gap), info=info)
     print("Optimization driver finished with status:", status)
 
     # Format output
     objective_str = f"{objective:.2f}" if objective is not None else "N/A"
     
-    list_patient_transfers = create_patientTransfers(results, params_system, params_metadata)
-    list_facility_load = create_facilityStats(results, params_system, params_metadata)
-    list_facility_load_regions = create_facilityStats(results, params_system, params_metadata, by_region=True)
+    if objective is None:  # no solution (infeasible, or stopped before the first incumbent)
+        return status, objective_str, [], [], [], get_solve_info(info, solver_configs.get("mode", "exact"))
+    with span("mapping", R=len(params_system["R"]), H=len(params_system["H"])):
+        list_patient_transfers = create_patientTransfers(results, params_system, params_metadata)
+        list_facility_load = create_facilityStats(results, params_system, params_metadata)
+        list_facility_load_regions = create_facilityStats(results, params_system, params_metadata, by_region=True)
     
 
-    return status, objective_str, list_patient_transfers, list_facility_load, list_facility_load_regions
+    return status, objective_str, list_patient_transfers, list_facility_load, list_facility_load_regions, \
+        get_solve_info(info, solver_configs.get("mode", "exact"))
+
+
+##############################################
+### JOBS (run in the job queue workers)    ###
+##############################################
+
+def optimize_job(params_filepath: str, metadata_filepath: str, timing: bool = False, deadline: float | None = None,
+                 mip_gap: float | None = None) -> dict:
+    """Content of the /optimize response"""
+    regions = get_regions_metadata(metadata_filepath)
+    with span("optimize") as trace:
+        status, objective_str, list_patient_transfers, list_facility_load, list_facility_load_regions, solve_info = \
+            run_optimization(params_filepath, metadata_filepath, deadline, mip_gap)
+    content = {"status": status,
+               "obj_val": objective_str,
+               "list_patient_transfers": list_patient_transfers,
+               "list_facility_load": list_facility_load,
+               "list_facility_load_regions": list_facility_load_regions,
+               "regions": regions,
+               "solve_info": solve_info}
+    if timing:
+        content["timing"] = trace.summary()
+    return content
+
+
+def optimize_maternite_job(df_instance : pd.DataFrame, transfers : float, n_regions : int | None = None,
+                           mode : str | None = None, timing: bool = False, deadline: float | None = None,
+                           mip_gap: float | None = None, params : tuple | None = None) -> dict:
+    """Content of the /optimize_maternite response"""
+    with span("optimize_maternite", H=len(df_instance)) as trace:
+        status, avg_distance, list_patient_transfers, list_facility_load, list_facility_load_regions, regions, solve_info =\
+              run_optimization_maternite(df_instance, transfers, n_regions, mode, deadline, mip_gap, params)
+    results = {"avg_distance": avg_distance,
+               "list_patient_transfers": list_patient_transfers,
+               "list_facility_load": list_facility_load,
+               "list_facility_load_regions": list_facility_load_regions,
+               "regions": regions,
+               "solve_info": solve_info}
+    if timing:
+        results["timing"] = trace.summary()
+    return {"status": status, "results": results}
+
+
+def sweep_maternite_job(df_instance : pd.DataFrame, list_transfers : list[float], list_alpha : list[float],
+                        n_regions : int | None = None, timing: bool = False, deadline: float | None = None,
+                        mip_gap: float | None = None) -> dict:
+    """Content of the /sweep_maternite response"""
+    with span("sweep_maternite", H=len(df_instance), n_points=len(list_transfers) * len(list_alpha)) as trace:
+        list_points = run_sweep_maternite(df_instance, list_transfers, list_alpha, n_regions, deadline, mip_gap)
+    response = {"status": "Done", "results": list_points}
+    if timing:
+        response["timing"] = trace.summary()
+    return response
 
 
 def get_regions_metadata(metadata_filepath: str | Path)-> dict:
@@ -91,27 +414,11 @@ def get_maternite_dashboard(df_maternites):
 
 
 def get_facility_capacity_maternite(df_maternites) -> list:
-    """ Returns a list of FacilityStats Instances """
-    from backend.core.data_models.output_models import FacilityStats
-
-    list_facilities_capacity = []
-
-    for h in df_maternites["facility_name"].unique():
-        
-        beds_capacity = int(df_maternites.loc[df_maternites["facility_name"] == h, "beds"].iloc[0])
-        coords = df_maternites.loc[df_maternites["facility_name"] == h,"coords"].iloc[0]
-        facility_type = df_maternites.loc[df_maternites["facility_name"] == h,"type"].iloc[0]
-
-        facility_instance = FacilityStats(
-            facility_id=h,
-            facility_type=facility_type,
-            coordinates=coords,
-            patient_group=None,
-            patient_pathway=None,
-            region_id=None,
-            capacities={"beds": beds_capacity}
-        )
-
-        list_facilities_capacity.append(facility_instance)
-    
-    return [pt.as_geojson_feature() for pt in list_facilities_capacity]
\ No newline at end of file
+    """ Returns the GeoJSON features of FacilityStats (beds capacity), one per facility name """
+    from backend.core.data_models.output_models import FacilityStats, geojson_features
+
+    df_facilities = df_maternites.drop_duplicates("facility_name")
+    return geojson_features(FacilityStats, "Point", [list(coords) for coords in df_facilities["coords"]],
+                            facility_id=df_facilities["facility_name"].to_numpy(),
+                            facility_type=df_facilities["type"].to_numpy(),
+                            capacities=[{"beds": beds} for beds in df_facilities["beds"].astype(int).tolist()])
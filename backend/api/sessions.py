@@ -0,0 +1,161 @@
+import threading
+import time
+import uuid
+import numpy as np
+from collections import OrderedDict
+
+##############################################
+### SCENARIO SESSIONS (DELTA EDITS)        ###
+##############################################
+
+# A session keeps a maternity instance, the solve options (transfers, n_regions, mode) and, once serialized, its
+# (params_system, params_metadata) on the server, so that clients send edits instead of the whole dict_instance.
+# The edits are kept against the instance the session was created with (`base_instance`), from which the current
+# `df_instance` is derived, so that percentages set a level and do not compound. `apply_delta` applies:
+#   "remove": [nofinesset]        facilities dropped from the scenario
+#   "beds": {nofinesset: beds}    capacity of some facilities, before the global_capacity scaling
+#   "global_capacity": percent    beds of every facility: base beds scaled by (1 + percent / 100), 0 to reset
+#   "demand": percent             deliveries of every facility: base deliveries scaled by (1 + percent / 100)
+#   "transfers", "n_regions", "mode"
+# and only recomputes what the edit touches: m_hl for beds, D for the demand, the facility sets and the columns of
+# w_rh for removals. Removing the last facility of a department changes the communes, so the instance is
+# serialized again (as after a change of n_regions). Sessions live in the memory of one API process.
+
+
+class ScenarioSession:
+    """Instance and serialized parameters of one scenario, `version` being incremented by every edit"""
+
+    def __init__(self, df_instance, transfers: float, n_regions: int | None = None, mode: str | None = None):
+        self.id = uuid.uuid4().hex
+        self.base_instance = df_instance.reset_index(drop=True)
+        self.df_instance = self.base_instance
+        self.removed, self.beds = set(), {}  # edits of the base instance: removed ids, beds by id
+        self.global_capacity, self.demand = 0.0, 0.0  # percents applied to the base instance
+        self.transfers, self.n_regions, self.mode = transfers, n_regions, mode
+        self.params = None  # (params_system, params_metadata) of `version`, None until serialized
+        self.version = 0
+        self.last_used = time.time()
+
+    def set_params(self, params: tuple, version: int) -> bool:
+        """Stores the serialization of `version` (ignored when the session was edited since)"""
+        if version != self.version:
+            return False
+        self.params = params
+        return True
+
+    def _instance(self, removed: set, beds: dict, global_capacity: float, demand: float):
+        """Base instance without the `removed` facilities, with the `beds` and the percents applied"""
+        df = self.base_instance
+        df = df[~df["nofinesset"].astype(str).isin(removed).to_numpy()].reset_index(drop=True)
+        if beds:
+            df = df.assign(beds=[beds.get(f, b) for f, b in zip(df["nofinesset"].astype(str), df["beds"])])
+        if global_capacity:
+            df = df.assign(beds=(df["beds"] + df["beds"] * global_capacity / 100).astype(int))
+        if demand:
+            df = df.assign(deliveries_per_facility=(df["deliveries_per_facility"]
+                                                    + df["deliveries_per_facility"] * demand / 100).astype(int))
+        return df
+
+    def apply_delta(self, delta: dict) -> list:
+        """Applies the edits of `delta`, returns the ids of the facilities whose beds changed.
+        Raises ValueError on unknown facilities or invalid values"""
+        df = self.df_instance
+        ids = df["nofinesset"].astype(str)
+        unknown = [str(f) for f in list(delta.get("remove") or []) + list(delta.get("beds") or {}) if str(f) not in set(ids)]
+        if unknown:
+            raise ValueError(f"Unknown facilities {unknown}")
+        if delta.get("beds") and min(int(b) for b in delta["beds"].values()) < 0:
+            raise ValueError("'beds' must be non-negative")
+        if delta.get("mode", self.mode) not in (None, "exact", "relaxed"):
+            raise ValueError("'mode' must be 'exact' or 'relaxed'")
+        numbers = {key: float(delta[key]) for key in ("global_capacity", "demand", "transfers") if delta.get(key) is not None}
+        n_regions = int(delta["n_regions"]) if delta.get("n_regions") is not None else delta.get("n_regions", self.n_regions)
+        keep = ~ids.isin([str(f) for f in delta.get("remove") or []]).to_numpy()
+        if not keep.any():
+            raise ValueError("A scenario needs at least one facility")
+
+        removed = self.removed | set(ids[~keep])
+        beds = {**self.beds, **{str(f): int(b) for f, b in (delta.get("beds") or {}).items()}}
+        global_capacity = numbers.get("global_capacity", self.global_capacity)
+        demand = numbers.get("demand", self.demand)
+        df = self._instance(removed, beds, global_capacity, demand)
+        if not keep.all():
+            self._remove_facilities(df, keep, set(df["dep_code"]) != set(self.df_instance["dep_code"]))
+        changed = {str(f) for f in delta.get("beds") or {}}
+        if "global_capacity" in numbers:
+            changed.update(df["nofinesset"].astype(str))
+
+        self.removed, self.beds, self.global_capacity, self.demand = removed, beds, global_capacity, demand
+        self.transfers = numbers.get("transfers", self.transfers)
+        self.mode = delta.get("mode", self.mode)
+        if n_regions != self.n_regions:
+            self.n_regions = n_regions
+            self.params = None
+
+        self.df_instance = df
+        if self.params is not None:
+            from backend.core.mappers.datasets_mappers.maternite_serializer import get_capacities
+            params_system, params_metadata = self.params
+            params_system = {**params_system, "m_hl": get_capacities(df),
+                             "D": [int(df["deliveries_per_facility"].sum())]}
+            self.params = (params_system, params_metadata)
+        self.version += 1
+        return sorted(changed)
+
+    def _remove_facilities(self, df, keep: np.ndarray, departments_changed: bool):
+        """Serialized parameters without the removed facilities: facility sets recomputed and w_rh columns sliced"""
+        from backend.core.mappers.datasets_mappers.maternite_serializer import serialize_maternite_facilities
+        if self.params is None or departments_changed:
+            self.params = None
+            return
+        params_system, params_metadata = self.params
+        facilities_system, facilities_metadata = serialize_maternite_facilities(df)
+        params_system = {**params_system, **facilities_system, "w_rh": np.asarray(params_system["w_rh"])[:, keep].tolist()}
+        params_metadata = {**params_metadata, "facilities": facilities_metadata}
+        if "aggregation" in params_metadata:
+            aggregation = params_metadata["aggregation"]
+            params_metadata["aggregation"] = {**aggregation, "w_rh": np.asarray(aggregation["w_rh"])[:, keep].tolist()}
+        self.params = (params_system, params_metadata)
+
+    def summary(self) -> dict:
+        df = self.df_instance
+        return {"session_id": self.id, "version": self.version, "n_facilities": len(df), "transfers": self.transfers,
+                "n_regions": self.n_regions, "mode": self.mode, "serialized": self.params is not None,
+                "global_capacity": self.global_capacity, "demand": self.demand,
+                "demand_total": int(df["deliveries_per_facility"].sum()), "capacity_total": int(df["beds"].sum())}
+
+
+class SessionStore:
+    """Sessions by id, the least recently used beyond `max_sessions` and the idle ones after `ttl_s` being dropped"""
+
+    def __init__(self, max_sessions: int = 100, ttl_s: float = 3600):
+        self.max_sessions = max_sessions
+        self.ttl_s = ttl_s
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _expire(self):
+        now = time.time()
+        for key in [key for key, session in self.sessions.items() if now - session.last_used > self.ttl_s]:
+            del self.sessions[key]
+        while len(self.sessions) > self.max_sessions:
+            self.sessions.popitem(last=False)
+
+    def put(self, session: ScenarioSession) -> ScenarioSession:
+        with self.lock:
+            self.sessions[session.id] = session
+            self._expire()
+        return session
+
+    def get(self, session_id: str) -> ScenarioSession | None:
+        with self.lock:
+            self._expire()
+            session = self.sessions.get(session_id)
+            if session is not None:
+                session.last_used = time.time()
+                self.sessions.move_to_end(session_id)
+            return session
+
+    def delete(self, session_id: str) -> bool:
+        with self.lock:
+            return self.sessions.pop(session_id, None) is not None
@@ -0,0 +1,187 @@
+import copy
+import json
+import platform
+import time
+import numpy as np
+
+##############################################
+### BENCHMARK OF THE PIPELINE PHASES       ###
+##############################################
+
+# Every case goes through the phases of an API call, timed separately:
+#   serialize_maternite (maternity cases) or convert_dm_to_json (synthetic data models),
+#   model build, solve and extraction of the results for each engine ("arrays": assemble_model, solve_highs,
+#   ModelArrays.unpack; "pulp": build_pulp_model, HiGHS through pulp, package_results), define_xarray,
+#   and the output mappers.
+# Synthetic cases are generated at growing sizes, `scaling_curves` fits t ~ n_cols^k for every phase.
+#
+# Run from the repository root:
+#   python -m backend.benchmarks.run_benchmarks --instances toy burdett synthetic --scales 1 2 4 --output bench.json
+
+FILE_INSTANCES = {"toy": ("backend/data/params_toy.json", "backend/data/metadata_toy.json"),
+                  "ptg": ("backend/data/params_ptg_pth.json", None)}
+LEGACY_INSTANCES = {"burdett": "backend/data/legacy/legacy_format_Burdett_v0.txt"}
+SYNTHETIC_BASE = {"n_groups": 4, "n_pathways": 2, "n_regions": 20, "n_activities": 2, "n_facilities": 5, "n_resources": 1}
+SYNTHETIC_SCALED = ("n_regions", "n_facilities")
+
+
+def _time_phase(phases: dict, name: str, repeat: int, fn, *args, **kwargs):
+    """Runs fn `repeat` times, stores the best wall time (s) in phases[name] and returns the last result"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    phases[name] = best
+    return result
+
+
+def _default_metadata(params_system: dict) -> dict:
+    """Metadata for instances shipped without one (names and coordinates are placeholders)"""
+    return {"facilities": {str(h): {"coordinates": [0.0, 0.0], "name": f"facility_{h}"} for h in params_system["H"]},
+            "regions": {str(r): {"coordinates": [0.0, 0.0], "name": f"region_{r}"} for r in params_system["R"]}}
+
+
+def _sizes(params_system: dict) -> dict:
+    return {"G": len(params_system["G"]), "K": max(params_system["K_g"]), "R": len(params_system["R"]),
+            "A": max(max(A_g) for A_g in params_system["A_gk"]), "H": len(params_system["H"]), "L": len(params_system["L"])}
+
+
+def _run_arrays(params_system: dict, phases: dict, repeat: int):
+    from backend.core.assembly import assemble_model
+    from backend.core.highs_solver import solve_highs
+
+    # assemble_model and not build_model: the template cache would hide the build time after the first repeat
+    model = _time_phase(phases, "arrays.build", repeat, assemble_model, params_system)
+    result = _time_phase(phases, "arrays.solve", repeat, solve_highs, model)
+    dict_results = _time_phase(phases, "arrays.unpack", repeat, model.unpack, result.col_value)
+    model_size = {"n_rows": model.n_rows, "n_cols": model.n_cols, "nnz": model.nnz}
+    return result.status, result.objective, dict_results, model_size
+
+
+def _run_pulp(params_system: dict, phases: dict, repeat: int):
+    import pulp
+    from backend.core.main import build_pulp_model
+    from backend.core.utils.data_utils import package_results
+
+    LP, variables = _time_phase(phases, "pulp.build", repeat, build_pulp_model, params_system)
+    _time_phase(phases, "pulp.solve", repeat, LP.solve, pulp.HiGHS(msg=0))
+    dict_results = _time_phase(phases, "pulp.package_results", repeat, package_results, *variables)
+    objective = pulp.value(LP.objective) if LP.status == pulp.LpStatusOptimal else None
+    model_size = {"n_rows": len(LP.constraints), "n_cols": len(LP.variables())}
+    return pulp.LpStatus[LP.status], objective, dict_results, model_size
+
+
+def benchmark_case(name: str, params_system: dict | None = None, params_metadata: dict | None = None,
+                   system_data=None, df_instance=None, engines: tuple = ("arrays", "pulp"), repeat: int = 1) -> dict:
+    """Times every phase of one case. The input is a params_system, a `SystemData` or a maternity `df_instance`"""
+    from backend.core.main import normalize_params_system
+    from backend.core.utils.data_utils import define_xarray
+    from backend.core.mappers.output_mappers import create_facilityStats, create_patientTransfers, get_average_distance
+
+    phases = {}
+    if df_instance is not None:
+        from backend.core.mappers.datasets_mappers.maternite_serializer import serialize_maternite
+        params_system, params_metadata = _time_phase(phases, "serialize_maternite", repeat, serialize_maternite, df_instance)
+    elif system_data is not None:
+        from backend.core.mappers.input_mappers import convert_dm_to_json
+        params_system, params_metadata = _time_phase(phases, "convert_dm_to_json", repeat, convert_dm_to_json, system_data)
+    params_system = normalize_params_system(copy.deepcopy(params_system))
+    params_metadata = params_metadata or _default_metadata(params_system)
+
+    case = {"name": name, "sizes": _sizes(params_system), "phases": phases, "engines": {}}
+    results = None
+    for engine in engines:
+        run = {"arrays": _run_arrays, "pulp": _run_pulp}[engine]
+        status, objective, dict_results, model_size = run(params_system, phases, repeat)
+        case["engines"][engine] = {"status": status, "objective": objective, **model_size}
+        xarray_results = _time_phase(phases, f"{engine}.define_xarray", repeat, define_xarray, params_system, dict_results)
+        if objective is not None:
+            results = xarray_results
+
+    # Output mappers, on the results of the last engine with a solution
+    if results is not None:
+        _time_phase(phases, "output.facility_stats", repeat, create_facilityStats, results, params_system, params_metadata)
+        _time_phase(phases, "output.facility_stats_by_region", repeat, create_facilityStats, results, params_system,
+                    params_metadata, by_region=True)
+        _time_phase(phases, "output.average_distance", repeat, get_average_distance, results, params_system)
+        _time_phase(phases, "output.patient_transfers", repeat, create_patientTransfers, results, params_system, params_metadata)
+    return case
+
+
+def scaling_curves(cases: list) -> dict:
+    """{phase: {"n_cols", "seconds", "exponent"}} over the synthetic cases, exponent being the slope of
+    log(seconds) against log(n_cols) (None with less than two sizes)"""
+    synthetic = [case for case in cases if case.get("family") == "synthetic" and "arrays" in case["engines"]]
+    curves = {}
+    for phase in sorted({phase for case in synthetic for phase in case["phases"]}):
+        points = sorted((case["engines"]["arrays"]["n_cols"], case["phases"][phase])
+                        for case in synthetic if phase in case["phases"])
+        n_cols, seconds = np.array(points, dtype=float).T
+        exponent = None
+        if len(set(n_cols)) > 1 and (seconds > 0).all():
+            exponent = float(np.polyfit(np.log(n_cols), np.log(seconds), 1)[0])
+        curves[phase] = {"n_cols": n_cols.astype(int).tolist(), "seconds": seconds.tolist(), "exponent": exponent}
+    return curves
+
+
+def run_benchmarks(instances: tuple = ("toy", "burdett", "synthetic", "maternity"), scales: tuple = (1, 2, 4),
+                   engines: tuple = ("arrays", "pulp"), repeat: int = 1, maternity_facilities: int = 20) -> dict:
+    """Runs every case and returns the report (JSON-serializable)"""
+    from backend.benchmarks.synthetic import synthetic_maternity, synthetic_system_data
+    from backend.core.mappers.input_mappers import run_legacy_reader
+    from backend.core.utils.data_utils import read_inputs, read_metadata
+
+    cases = []
+    for name in instances:
+        if name in FILE_INSTANCES:
+            params_file, metadata_file = FILE_INSTANCES[name]
+            metadata = read_metadata(metadata_file) if metadata_file else None
+            cases.append({"family": "file", **benchmark_case(name, read_inputs(params_file), metadata, engines=engines,
+                                                             repeat=repeat)})
+        elif name in LEGACY_INSTANCES:
+            cases.append({"family": "legacy", **benchmark_case(name, run_legacy_reader(LEGACY_INSTANCES[name]),
+                                                               engines=engines, repeat=repeat)})
+        elif name == "synthetic":
+            for scale in scales:
+                sizes = {key: value * scale if key in SYNTHETIC_SCALED else value for key, value in SYNTHETIC_BASE.items()}
+                cases.append({"family": "synthetic", "scale": scale,
+                              **benchmark_case(f"synthetic_x{scale}", system_data=synthetic_system_data(**sizes),
+                                               engines=engines, repeat=repeat)})
+        elif name == "maternity":
+            try:
+                case = benchmark_case("maternity", df_instance=synthetic_maternity(maternity_facilities),
+                                      engines=engines, repeat=repeat)
+            except (FileNotFoundError, ImportError) as e:
+                # The open data files (labours, communes geometries) are not shipped with every checkout
+                case = {"name": "maternity", "skipped": repr(e)}
+            cases.append({"family": "maternity", **case})
+        else:
+            raise ValueError(f"Unknown instance '{name}'")
+
+    return {"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+            "machine": platform.machine(), "repeat": repeat, "cases": cases, "scaling": scaling_curves(cases)}
+
+
+if __name__ == "__main__":
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Times every phase of the optimization pipeline")
+    parser.add_argument("--instances", nargs="+", default=["toy", "burdett", "synthetic", "maternity"],
+                        help="toy, ptg, burdett, synthetic and/or maternity")
+    parser.add_argument("--scales", nargs="+", type=int, default=[1, 2, 4], help="multipliers of R and H for the synthetic cases")
+    parser.add_argument("--engines", nargs="+", default=["arrays", "pulp"])
+    parser.add_argument("--repeat", type=int, default=1, help="best of `repeat` runs for every phase")
+    parser.add_argument("--maternity-facilities", type=int, default=20)
+    parser.add_argument("--output", help="JSON report path (stdout when omitted)")
+    args = parser.parse_args()
+
+    report = run_benchmarks(tuple(args.instances), tuple(args.scales), tuple(args.engines), args.repeat,
+                            args.maternity_facilities)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
@@ -0,0 +1,99 @@
+import numpy as np
+import pandas as pd
+from backend.core.data_models.input_models import Facility, Region, Instance, Resource, PatientsGroup, Activity, Pathway, SystemData
+
+##############################################
+### SYNTHETIC INSTANCES                    ###
+##############################################
+
+# Inputs of any size for the benchmarks: `synthetic_system_data` builds the data models that `convert_dm_to_json`
+# turns into params_system / params_metadata, `synthetic_maternity` a `df_instance` shaped as `read_maternity()`.
+# Facilities and regions are drawn uniformly over mainland France, every pathway is available in at least one
+# facility and the capacities cover the demand, so that the instances are feasible.
+
+LON_RANGE, LAT_RANGE = (-4.5, 7.5), (43.0, 50.5)
+
+
+def _random_coordinates(rng, n: int) -> np.ndarray:
+    return np.column_stack([rng.uniform(*LON_RANGE, n), rng.uniform(*LAT_RANGE, n)])
+
+
+def _distances_m(points_a: np.ndarray, points_b: np.ndarray) -> np.ndarray:
+    """Approximate distances (m) between lon/lat points"""
+    scale = np.array([111_000 * np.cos(np.radians(np.mean(LAT_RANGE))), 111_000])
+    return np.sqrt((((points_a[:, None, :] - points_b[None, :, :]) * scale) ** 2).sum(axis=2))
+
+
+def synthetic_system_data(n_groups: int = 4, n_pathways: int = 2, n_regions: int = 20, n_activities: int = 2,
+                          n_facilities: int = 5, n_resources: int = 1, n_links: int = 3, seed: int = 0) -> SystemData:
+    """Returns a `SystemData` with G=n_groups, K_g=n_pathways, R=n_regions, A_gk=n_activities, H=n_facilities and
+    L=n_resources. Affinities are 1/distance as for the maternity dataset, each facility can transfer to its
+    `n_links` nearest facilities"""
+    rng = np.random.default_rng(seed)
+    facility_coords, region_coords = _random_coordinates(rng, n_facilities), _random_coordinates(rng, n_regions)
+    distances = _distances_m(region_coords, facility_coords)
+    affinities = 1 / np.maximum(distances, 100)
+    facility_ids = [f"h{h}" for h in range(n_facilities)]
+    resource_ids = [f"l{l}" for l in range(n_resources)]
+    pathway_ids = [str(k) for k in range(n_pathways)]
+
+    regions = [Region(region_id=f"r{r}", coordinates=region_coords[r].tolist(),
+                      facilities_affinity=dict(zip(facility_ids, affinities[r].tolist()))) for r in range(n_regions)]
+    resources = [Resource(resource_id=l, resource_type=l) for l in resource_ids]
+    patients = [PatientsGroup(group_id=str(g), possible_pathways=pathway_ids) for g in range(n_groups)]
+    pathways = [Pathway(pathway_id=k, associated_group_id=str(g), quality_level="0", list_activities=[],
+                        group_benefit=round(float(rng.uniform(1, 2)), 3), list_next=[])
+                for g in range(n_groups) for k in pathway_ids]
+    consumption = rng.uniform(0.5, 5, (n_groups, n_pathways, n_activities, n_resources)).round(2)
+    activities = [Activity(activity_id=str(a), associated_pathway=k, associated_group=str(g), transferable=False,
+                           transfer_to="", required_resources=dict(zip(resource_ids, consumption[g, int(k), a].tolist())))
+                  for g in range(n_groups) for k in pathway_ids for a in range(n_activities)]
+
+    # Pathway 0 everywhere, the others in about half of the facilities (at least one)
+    available = rng.random((n_facilities, n_pathways)) < 0.5
+    available[:, 0] = True
+    available[rng.integers(n_facilities, size=n_pathways), np.arange(n_pathways)] = True
+
+    # Whole demand on the most consuming pathway, spread over the facilities with a 50% margin
+    d_total = 100 * n_regions
+    load = d_total * consumption.sum(axis=2).max(axis=(0, 1)) / n_facilities
+    capacities = (1.5 * load[None, :] * rng.uniform(1, 2, (n_facilities, 1))).astype(int)
+    capacities += np.arange(n_resources)[None, :]  # distinct values, `reconstruct_m_hl` drops duplicates
+    nearest = np.argsort(_distances_m(facility_coords, facility_coords), axis=1)[:, 1:n_links + 1]
+
+    facilities = [Facility(facility_id=facility_ids[h], facility_name=f"Facility {h}", region=None,
+                           coordinates=facility_coords[h].tolist(),
+                           resources_capacity=dict(zip(resource_ids, capacities[h].tolist())),
+                           available_pathways=[k for k in pathway_ids if available[h, int(k)]],
+                           linked_facilities=[facility_ids[h2] for h2 in nearest[h]],
+                           max_transferable_in=dict.fromkeys(resource_ids, 0.1),
+                           max_transferable_out=dict.fromkeys(resource_ids, 0.1))
+                  for h in range(n_facilities)]
+
+    demand = rng.random((n_groups, n_regions))
+    instance = Instance(d_total=d_total, d_gr=(0.9 * demand / demand.sum()).tolist(), under_q_g=[0.0] * n_groups,
+                        over_q_g=[1.0] * n_groups, under_q_gu=[[0.0] for _ in range(n_groups)],
+                        over_q_gu=[[1.0] for _ in range(n_groups)], p_transf=1.0, delta_l=[1] * n_resources,
+                        alpha=0.0125)
+    return SystemData(regions=regions, resources=resources, facilities=facilities, patients=patients,
+                      pathways=pathways, activities=activities, instance=instance)
+
+
+def synthetic_maternity(n_facilities: int = 20, dep_codes: tuple = ("75", "92", "93", "94"), seed: int = 0) -> pd.DataFrame:
+    """Returns a `df_instance` with the columns of `read_maternity()` and `n_facilities` maternities spread over
+    `dep_codes` (the communes and their demand still come from the open data files)"""
+    rng = np.random.default_rng(seed)
+    coords = _random_coordinates(rng, n_facilities)
+    dep = rng.choice(list(dep_codes), n_facilities)
+    return pd.DataFrame({
+        "nofinesset": [f"{990000000 + h}" for h in range(n_facilities)],
+        "region_code": "00", "region_name": "Synthetic",
+        "type": rng.choice(["1", "2a", "2b", "3"], n_facilities, p=[0.4, 0.25, 0.2, 0.15]),
+        "dep_code": dep, "dep_name": [f"Department {d}" for d in dep],
+        "comm_code": [f"{d}000" for d in dep],
+        "facility_name": [f"Maternity {h}" for h in range(n_facilities)],
+        "comm_name": [f"Commune {h}" for h in range(n_facilities)],
+        "coords": [tuple(c) for c in coords.tolist()],
+        "deliveries_per_facility": rng.uniform(300, 4000, n_facilities).round(1),
+        "beds": rng.integers(10, 80, n_facilities),
+    })
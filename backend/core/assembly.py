@@ -0,0 +1,565 @@
+import numpy as np
+from dataclasses import dataclass, field
+
+#####################################################
+### ARRAY-BASED ASSEMBLY OF THE CASE-MIX MODEL    ###
+#####################################################
+
+# This module produces the same model as `optimization.py` (objective of `set_obj_fn` and rows of
+# `declare_constraints`, in the same order) but as NumPy arrays: column bounds, objective vector
+# and a CSR constraint matrix with row bounds. Each `_rows_*` function mirrors one `def_const_*`.
+#
+# With `sparse=True`, P and Q only get columns for the valid tuples (g,k,r,a,h), i.e. k < K_g,
+# a < A_{g,k} and h \in O_{g,k}. The O_{g,k} rows (P = 0) and the Q >= 0 rows (already column
+# bounds) are then not generated, and rows whose left-hand side variable does not exist are skipped.
+
+INF = np.inf
+
+# Blocks whose coefficients and bounds only depend on the index sets (G, K_g, A_gk, O_gk, J_h, N_gka_*, |R|, |H|, |L|):
+# their coefficients are +-1 or masks, so a model with the same structure can reuse them as they are
+STRUCTURAL_BLOCKS = ("P_gkr", "P_gk", "O_gk", "J_h", "Q_gkrah", "Q", "delta_zero")
+
+
+@dataclass
+class ModelArrays:
+    """Column-oriented description of the LP/MIP (maximisation)"""
+    col_cost: np.ndarray
+    col_lower: np.ndarray
+    col_upper: np.ndarray
+    integrality: np.ndarray
+    row_lower: np.ndarray
+    row_upper: np.ndarray
+    a_start: np.ndarray  # CSR row pointer
+    a_index: np.ndarray  # CSR column indices
+    a_value: np.ndarray  # CSR values
+    layout: dict  # variable name: (offset, shape)
+    row_blocks: dict  # constraint name: (first row, last row + 1)
+    sense: str = "maximize"
+    sets: dict = field(default_factory=dict, repr=False)
+    col_positions: dict = field(default_factory=dict)  # variable name: flat cells of `shape` that have a column
+
+    @property
+    def n_cols(self) -> int:
+        return len(self.col_cost)
+
+    @property
+    def n_rows(self) -> int:
+        return len(self.row_lower)
+
+    @property
+    def nnz(self) -> int:
+        return len(self.a_value)
+
+    def n_cols_of(self, name: str) -> int:
+        """Number of columns of variable `name`"""
+        _, shape = self.layout[name]
+        positions = self.col_positions.get(name)
+        return int(np.prod(shape)) if positions is None else len(positions)
+
+    def column_indices(self, name: str) -> np.ndarray:
+        """Returns the column indices of variable `name` shaped as its index set (-1 where there is no column)"""
+        offset, shape = self.layout[name]
+        return _index_map(offset, shape, self.col_positions.get(name))
+
+    def unpack(self, col_values, sparse: tuple = ()) -> dict:
+        """Splits a flat column-value array into one array per variable (same keys as `package_results`).
+        Cells without a column are filled with zeros. Variables named in `sparse` are returned as `CooTensor`
+        holding their non-zero columns only"""
+        from backend.core.utils.result_tensors import CooTensor
+        col_values = np.asarray(col_values, dtype=float)
+        unpacked = {}
+        for name, (offset, shape) in self.layout.items():
+            values = col_values[offset: offset + self.n_cols_of(name)]
+            positions = self.col_positions.get(name)
+            if name in sparse:
+                positions = np.arange(len(values)) if positions is None else positions
+                unpacked[name] = CooTensor.from_flat(positions, values, shape, dtype=float)
+                continue
+            if positions is not None:
+                dense = np.zeros(int(np.prod(shape)))
+                dense[positions] = values
+                values = dense
+            unpacked[name] = values.reshape(shape)
+        return unpacked
+
+
+def _index_map(offset, shape, positions=None):
+    """Column index of every cell of `shape`, -1 for cells without a column"""
+    if positions is None:
+        return offset + np.arange(int(np.prod(shape)), dtype=np.int64).reshape(shape)
+    index = np.full(int(np.prod(shape)), -1, dtype=np.int64)
+    index[positions] = offset + np.arange(len(positions), dtype=np.int64)
+    return index.reshape(shape)
+
+
+#####################################
+### INDEX SETS AS DENSE ARRAYS    ###
+#####################################
+
+
+def _pad(values, shape, dtype=float):
+    """Array of `shape` from an array or nested lists: rectangular input is cut to `shape`, ragged lists are padded
+    (missing entries are 0). Raises TypeError on rows that are neither sequences nor arrays"""
+    out = np.zeros(shape, dtype=dtype)
+    try:
+        array = np.asarray(values, dtype=dtype)
+    except (ValueError, TypeError):  # ragged lists
+        array = None
+    if array is not None and array.ndim == len(shape):
+        cut = tuple(slice(0, min(n, m)) for n, m in zip(array.shape, shape))
+        out[cut] = array[cut]
+        return out
+
+    def fill(dst, src, depth):
+        if not isinstance(src, (list, tuple, np.ndarray)):
+            raise TypeError(f"Expected a list or an array at depth {depth} of a {len(shape)}-d parameter, "
+                            f"got {type(src).__name__}")
+        if depth == len(shape) - 1:
+            n = min(len(src), shape[-1])
+            dst[:n] = src[:n]
+            return
+        for i, item in enumerate(src[:shape[depth]]):
+            fill(dst[i], item, depth + 1)
+
+    fill(out, values, 0)
+    return out
+
+
+def index_arrays(params_system: dict) -> dict:
+    """Converts the index sets and parameters of `params_system` into dense NumPy arrays"""
+    K_g = np.asarray(params_system["K_g"], dtype=np.int64)
+    nG, nR, nH, nL = len(params_system["G"]), len(params_system["R"]), len(params_system["H"]), len(params_system["L"])
+    nK = int(K_g.max(initial=0))
+    A_gk = _pad(params_system["A_gk"], (nG, nK), dtype=np.int64)
+    valid_gk = np.arange(nK)[None, :] < K_g[:, None]
+    A_gk = np.where(valid_gk, A_gk, 0)
+    nA = int(np.asarray(A_gk).max(initial=0))
+    valid_gka = np.arange(nA)[None, None, :] < A_gk[:, :, None]
+
+    allowed = np.zeros((nG, nK, nH), dtype=bool)
+    for g in range(nG):
+        for k in range(K_g[g]):
+            allowed[g, k, [h for h in params_system["O_gk"][g][k] if h is not None and h < nH]] = True
+
+    J_len = max((len(J) for J in params_system["J_h"]), default=0)
+    J_pad = np.zeros((nH, J_len), dtype=np.int64)
+    J_mask = np.zeros((nH, J_len), dtype=bool)
+    for h, J in enumerate(params_system["J_h"]):
+        J = [h2 for h2 in J if h2 is not None]
+        J_pad[h, :len(J)] = J
+        J_mask[h, :len(J)] = True
+
+    return {
+        "nG": nG, "nK": nK, "nR": nR, "nA": nA, "nH": nH, "nL": nL,
+        "K_g": K_g, "A_gk": A_gk, "valid_gk": valid_gk, "valid_gka": valid_gka,
+        "allowed": allowed, "J_pad": J_pad, "J_mask": J_mask,
+        "t_gkal": _pad(params_system["t_gkal"], (nG, nK, nA, nL)),
+        "c_gk": _pad(params_system["c_gk"], (nG, nK)),
+        "w_rh": _pad(params_system["w_rh"], (nR, nH)),
+        "d_gr": _pad(params_system["d_gr"], (nG, nR)),
+        "m_hl": _pad(params_system["m_hl"], (nH, nL)),
+        "b_hl_in": _pad(params_system["b_hl_in"], (nH, nL)),
+        "b_hl_out": _pad(params_system["b_hl_out"], (nH, nL)),
+        "delta_l": np.asarray(params_system["delta_l"], dtype=float)[:nL],
+        "D": float(params_system["D"][0]),
+    }
+
+
+def _transfer_pairs(params_system: dict, sets: dict):
+    """Returns (g, k, a, a') for every a \\in N_gka_1[g][k] in loop order, a' being its N_gka_2 counterpart"""
+    pairs = []
+    for g in range(sets["nG"]):
+        for k in range(sets["K_g"][g]):
+            N1 = params_system["N_gka_1"][g][k]
+            N2 = params_system["N_gka_2"][g][k]
+            for a in N1:
+                pairs.append((g, k, a, N2[N1.index(a)]))
+    return np.asarray(pairs, dtype=np.int64).reshape(-1, 4)
+
+
+#####################################
+### ROW BLOCK ACCUMULATOR         ###
+#####################################
+
+
+class _RowBuilder:
+    """Accumulates COO triplets and row bounds block by block, each block being compressed when closed"""
+
+    def __init__(self, n_cols):
+        self.n_cols = n_cols
+        self.pending = []
+        self.counts, self.index, self.value = [], [], []
+        self.lower, self.upper = [], []
+        self.blocks = {}
+        self.n_rows = 0
+
+    def add(self, name, n, terms, lower, upper):
+        """Adds `n` rows. `terms` is a list of (cols, vals) with cols of shape (n, m) or (n,)"""
+        for cols, vals in (terms if n else []):
+            cols = np.asarray(cols, dtype=np.int64).reshape(n, -1)
+            vals = np.broadcast_to(np.asarray(vals, dtype=float).reshape(n, -1) if np.ndim(vals) else vals, cols.shape)
+            rows = np.broadcast_to(np.arange(n, dtype=np.int64)[:, None], cols.shape)
+            self.add_coo(rows.ravel(), cols.ravel(), vals.ravel())
+        self.close(name, n, lower, upper)
+
+    def add_coo(self, rows, cols, vals):
+        """Adds triplets with row indices local to the block being built"""
+        self.pending.append((np.asarray(rows, dtype=np.int64), np.asarray(cols, dtype=np.int64),
+                             np.asarray(vals, dtype=float)))
+
+    def close(self, name, n, lower, upper):
+        """Sorts the pending triplets by (row, column), sums duplicates and drops zeros"""
+        if self.pending:
+            # columns < 0 are variables that were not created (fixed to 0)
+            keys = np.concatenate([rows[cols >= 0] * self.n_cols + cols[cols >= 0] for rows, cols, _ in self.pending])
+            vals = np.concatenate([v[cols >= 0] for _, cols, v in self.pending])
+            order = np.argsort(keys, kind="stable")
+            keys, vals = keys[order], vals[order]
+            first = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]]) if len(keys) else np.zeros(0, dtype=np.int64)
+            sums = np.add.reduceat(vals, first) if len(keys) else vals
+            keys = keys[first]
+            keep = sums != 0
+            keys, sums = keys[keep], sums[keep]
+        else:
+            keys, sums = np.zeros(0, dtype=np.int64), np.zeros(0)
+        self.pending = []
+        self.counts.append(np.bincount(keys // self.n_cols, minlength=n))
+        self.index.append(keys % self.n_cols)
+        self.value.append(sums)
+        self.lower.append(np.broadcast_to(np.asarray(lower, dtype=float), (n,)))
+        self.upper.append(np.broadcast_to(np.asarray(upper, dtype=float), (n,)))
+        self.blocks[name] = (self.n_rows, self.n_rows + n)
+        self.n_rows += n
+
+    def extend(self, name, counts, index, value, lower, upper):
+        """Appends an already compressed block"""
+        self.counts.append(counts)
+        self.index.append(index)
+        self.value.append(value)
+        self.lower.append(lower)
+        self.upper.append(upper)
+        self.blocks[name] = (self.n_rows, self.n_rows + len(counts))
+        self.n_rows += len(counts)
+
+    def to_csr(self):
+        """Returns (row_lower, row_upper, start, index, value)"""
+        a_start = np.zeros(self.n_rows + 1, dtype=np.int64)
+        if self.counts:
+            np.cumsum(np.concatenate(self.counts), out=a_start[1:])
+        concat = lambda arrays, dtype: np.concatenate(arrays) if arrays else np.zeros(0, dtype=dtype)
+        return (concat(self.lower, float), concat(self.upper, float), a_start,
+                concat(self.index, np.int64), concat(self.value, float))
+
+
+###########################################
+### CONSTRAINT BLOCKS (see optimization) ###
+###########################################
+
+
+# \sum_h P_{g,k,r,a,h} = P_{g,k,r}, for g \in G, k \in K_g, r \in R, a \in A_{g,k}
+
+def _rows_P_gkr(rb, s, P, P_gkr):
+    g, k, r, a = np.nonzero(np.broadcast_to(s["valid_gka"][:, :, None, :], (s["nG"], s["nK"], s["nR"], s["nA"])))
+    rb.add("P_gkr", len(g), [(P[g, k, r, a, :], 1.0), (P_gkr[g, k, r], -1.0)], 0.0, 0.0)
+
+
+# \sum_r P_{g,k,r} = P_{g,k}, for g \in G, k \in K_g
+
+def _rows_P_gk(rb, s, P_gkr, P_gk):
+    g, k = np.nonzero(s["valid_gk"])
+    rb.add("P_gk", len(g), [(P_gkr[g, k, :], 1.0), (P_gk[g, k], -1.0)], 0.0, 0.0)
+
+
+# \sum_k P_{g,k,r} == d_{g,r}, for g \in G, r \in R
+
+def _rows_d_gr(rb, s, P_gkr):
+    g, r = np.nonzero(np.ones((s["nG"], s["nR"]), dtype=bool))
+    rb.add("d_gr", len(g), [(P_gkr[g, :, r], s["valid_gk"][g, :])], s["d_gr"][g, r], s["d_gr"][g, r])
+
+
+# \sum_k P_{g,k} \geq (resp. \leq) q_g \cdot \sum_{g'} \sum_{k'} P_{g',k'}, for g \in G
+
+def _rows_q_g(rb, name, s, P_gk, q_g, lower, upper):
+    nG = s["nG"]
+    q_g = np.asarray(q_g, dtype=float)[:nG]
+    vals = (np.eye(nG)[:, :, None] - q_g[:, None, None]) * s["valid_gk"][None, :, :]
+    rb.add(name, nG, [(np.broadcast_to(P_gk.ravel(), (nG, P_gk.size)), vals.reshape(nG, -1))], lower, upper)
+
+
+# \sum_{k \in I_{g,u}} P_{g,k} \geq (resp. \leq) q_{g,u} \cdot \sum_k P_{g,k}, for g \in G, u \in U_g
+
+def _rows_q_gk(rb, name, s, P_gk, U, I_gu, q_gu, lower, upper):
+    rows_g, vals = [], []
+    for g in range(s["nG"]):
+        for u in range(U[g]):
+            row = -q_gu[g][u] * s["valid_gk"][g].astype(float)
+            for c in I_gu[g][u]:
+                row[c] += 1.0
+            rows_g.append(g)
+            vals.append(row)
+    g = np.asarray(rows_g, dtype=np.int64)
+    vals = np.asarray(vals, dtype=float).reshape(len(g), s["nK"])
+    rb.add(name, len(g), [(P_gk[g, :], vals)], lower, upper)
+
+
+# P_{g,k,r,a,h} = 0, for g \in G, k \in K_g, r \in R, a \in A_{g,k}, h \notin O_{g,k}
+
+def _rows_O_gk(rb, s, P):
+    mask = s["valid_gka"][:, :, None, :, None] & ~s["allowed"][:, :, None, None, :]
+    mask = np.broadcast_to(mask, P.shape)
+    rb.add("O_gk", int(mask.sum()), [(P[mask], 1.0)], 0.0, 0.0)
+
+
+# P_{g,k,r,a,h} \leq \sum_{h' \in J_h} P_{g,k,r,a+1,h'}, for g \in G, k \in K_g, r \in R, a < A_{g,k} - 1, h \in H
+
+def _J_h_candidates(s, P):
+    """(g, k, r, a, h) of every J_h row"""
+    chained = np.arange(s["nA"])[None, None, :] < (s["A_gk"] - 1)[:, :, None]
+    mask = np.broadcast_to((chained & s["valid_gka"])[:, :, None, :, None], P.shape)
+    g, k, r, a, h = np.nonzero(mask)
+    keep = P[g, k, r, a, h] >= 0
+    return g[keep], k[keep], r[keep], a[keep], h[keep]
+
+
+def _rows_J_h(rb, s, P, rows=None):
+    g, k, r, a, h = _J_h_candidates(s, P) if rows is None else rows
+    next_cols = P[g[:, None], k[:, None], r[:, None], a[:, None] + 1, s["J_pad"][h]]
+    rb.add("J_h", len(g), [(P[g, k, r, a, h], 1.0), (next_cols, -s["J_mask"][h].astype(float))], -INF, 0.0)
+
+
+# Q_{g,k,r,a,h} \geq P_{g,k,r,a,h} - P_{g,k,r,a',h}, for g \in G, k \in K_g, r \in R, a \in N^1_{g,k}, h \in H
+
+def _rows_Q_gkrah(rb, s, pairs, P, Q):
+    nR, nH = s["nR"], s["nH"]
+    blocks = []
+    for g, k in dict.fromkeys(map(tuple, pairs[:, :2])):
+        sel = pairs[(pairs[:, 0] == g) & (pairs[:, 1] == k)]
+        r, i, h = (x.ravel() for x in np.meshgrid(np.arange(nR), np.arange(len(sel)), np.arange(nH), indexing="ij"))
+        blocks.append(np.column_stack([np.full(len(r), g), np.full(len(r), k), r, sel[i, 2], sel[i, 3], h]))
+    g, k, r, a, a_prime, h = np.concatenate(blocks).T if blocks else np.zeros((6, 0), dtype=np.int64)
+    keep = Q[g, k, r, a, h] >= 0
+    g, k, r, a, a_prime, h = g[keep], k[keep], r[keep], a[keep], a_prime[keep], h[keep]
+    rb.add("Q_gkrah", len(g), [(Q[g, k, r, a, h], 1.0), (P[g, k, r, a, h], -1.0), (P[g, k, r, a_prime, h], 1.0)], 0.0, INF)
+
+
+# \sum_g \sum_k \sum_r \sum_{a \in N^1_{g,k}} \sum_h Q_{g,k,r,a,h} \leq f \cdot \sum_g \sum_k n_g \cdot P_{g,k}
+
+def _rows_f(rb, s, pairs, f, Q, P_gk):
+    g_p, k_p, a_p = pairs[:, 0], pairs[:, 1], pairs[:, 2]
+    n_gk = np.zeros((s["nG"], s["nK"]))
+    np.add.at(n_gk, (g_p, k_p), 1.0)
+    n_g = n_gk.max(axis=1, initial=0)
+    g, k = np.nonzero(s["valid_gk"])
+    rb.add("f", 1, [(Q[g_p, k_p, :, a_p, :].ravel(), 1.0), (P_gk[g, k], -f[0] * n_g[g])], -INF, 0.0)
+
+
+# Q_{g,k,r,a,h} \geq 0, for g \in G, k \in K_g, r \in R, a \in A_{g,k}, h \in H
+
+def _rows_Q(rb, s, Q):
+    mask = np.broadcast_to(s["valid_gka"][:, :, None, :, None], Q.shape)
+    rb.add("Q", int(mask.sum()), [(Q[mask], 1.0)], 0.0, INF)
+
+
+# \sum_g \sum_k \sum_r \sum_a D \cdot P_{g,k,r,a,h} \cdot t_{g,k,a,l} \leq m_{h,l} + \Delta_{h,l}^{+} - \Delta_{h,l}^{-}, for h \in H, l \in L
+
+def _rows_m_hl_2(rb, s, P, Delta_plus, Delta_moins):
+    nH, nL = s["nH"], s["nL"]
+    T = s["D"] * s["t_gkal"] * s["valid_gka"][..., None]
+    g, k, a, l = np.nonzero(T)
+    cols = P[g, k, :, a, :]  # (nnz_t, R, H)
+    rows = np.arange(nH)[None, None, :] * nL + l[:, None, None]
+    rb.add_coo(np.broadcast_to(rows, cols.shape).ravel(), cols.ravel(),
+               np.broadcast_to(T[g, k, a, l][:, None, None], cols.shape).ravel())
+    rb.add_coo(np.arange(nH * nL), Delta_plus.ravel(), -np.ones(nH * nL))
+    rb.add_coo(np.arange(nH * nL), Delta_moins.ravel(), np.ones(nH * nL))
+    rb.close("m_hl_2", nH * nL, -INF, s["m_hl"].ravel())
+
+
+# \sum_h \Delta_{h,l}^{+} - \sum_h \Delta_{h,l}^{-} = 0, for l \in L
+
+def _rows_delta_zero(rb, s, Delta_plus, Delta_moins):
+    rb.add("delta_zero", s["nL"], [(Delta_plus.T, 1.0), (Delta_moins.T, -1.0)], 0.0, 0.0)
+
+
+# \Delta_{h,l} = \delta_l \cdot z_{h,l}, for h \in H, l \in L
+
+def _rows_delta_delta(rb, name, s, Delta, z):
+    n = s["nH"] * s["nL"]
+    delta = np.broadcast_to(s["delta_l"][None, :], Delta.shape).ravel()
+    rb.add(name, n, [(Delta.ravel(), 1.0), (z.ravel(), -delta)], 0.0, 0.0)
+
+
+# \Delta_{h,l} \leq b_{h,l} \cdot m_{h,l}, for h \in H, l \in L
+
+def _rows_delta_b_hl(rb, name, s, Delta, b_hl):
+    rb.add(name, s["nH"] * s["nL"], [(Delta.ravel(), 1.0)], -INF, (b_hl * s["m_hl"]).ravel())
+
+
+def violated_J_h_rows(model: ModelArrays, col_value, tol: float = 1e-7) -> tuple:
+    """(g, k, r, a, h) of the J_h rows violated by `col_value`: P_{g,k,r,a,h} > sum_{h' in J_h} P_{g,k,r,a+1,h'} + tol"""
+    s = model.sets
+    P = model.unpack(col_value)["P_gkrah"]
+    J = np.zeros((s["nH"], s["nH"]))
+    J[np.repeat(np.arange(s["nH"]), s["J_pad"].shape[1])[s["J_mask"].ravel()], s["J_pad"][s["J_mask"]]] = 1.0
+    next_sum = np.zeros_like(P)
+    next_sum[:, :, :, :-1, :] = P[:, :, :, 1:, :] @ J.T
+    g, k, r, a, h = _J_h_candidates(s, model.column_indices("P_gkrah"))
+    violated = P[g, k, r, a, h] - next_sum[g, k, r, a, h] > tol
+    return g[violated], k[violated], r[violated], a[violated], h[violated]
+
+
+def J_h_row_count(model: ModelArrays) -> int:
+    """Number of J_h rows of the full model"""
+    return len(_J_h_candidates(model.sets, model.column_indices("P_gkrah"))[0])
+
+
+def missing_J_h_rows(model: ModelArrays, added: np.ndarray) -> tuple:
+    """(g, k, r, a, h) of the J_h rows of the full model not marked in `added` (boolean, shape of P_gkrah)"""
+    g, k, r, a, h = _J_h_candidates(model.sets, model.column_indices("P_gkrah"))
+    missing = ~added[g, k, r, a, h]
+    return g[missing], k[missing], r[missing], a[missing], h[missing]
+
+
+def J_h_rows(model: ModelArrays, rows: tuple | None = None) -> tuple:
+    """(row_lower, row_upper, start, index, value) of the J_h rows `rows` (all of them when None)"""
+    rb = _RowBuilder(model.n_cols)
+    _rows_J_h(rb, model.sets, model.column_indices("P_gkrah"), rows)
+    return rb.to_csr()
+
+
+def _objective_costs(s, n_cols, P, P_gk, Delta_plus, Delta_moins, alpha):
+    D = s["D"]
+    col_cost = np.zeros(n_cols)
+    col_cost[P_gk] = (1 - alpha) * s["c_gk"] * D * s["valid_gk"]
+    cost_P = np.broadcast_to(alpha * D * s["w_rh"][None, None, :, None, :] * s["valid_gka"][:, :, None, :, None], P.shape)
+    col_cost[P[P >= 0]] = cost_P[P >= 0]
+    col_cost[Delta_plus] = -1e-6
+    col_cost[Delta_moins] = -1e-6
+    return col_cost
+
+
+def objective_costs(model: ModelArrays, alpha: float) -> np.ndarray:
+    """Objective vector of `model` for another value of alpha (the constraint matrix does not depend on it)"""
+    return _objective_costs(model.sets, model.n_cols, model.column_indices("P_gkrah"), model.column_indices("P_gk"),
+                            model.column_indices("Delta_plus"), model.column_indices("Delta_moins"), alpha)
+
+
+#################################################
+### SUPER FUNCTION TO ASSEMBLE EVERYTHING     ###
+#################################################
+
+
+def _constraint_blocks(params_system: dict, s: dict, cols, sparse: bool) -> list:
+    """(block name, function adding its rows) in the order of `declare_constraints`"""
+    P, P_gkr, P_gk, Q = cols("P_gkrah"), cols("P_gkr"), cols("P_gk"), cols("Q_gkrah")
+    Delta_plus, Delta_moins = cols("Delta_plus"), cols("Delta_moins")
+    z_hl_plus, z_hl_moins = cols("z_hl_plus"), cols("z_hl_moins")
+    pairs = _transfer_pairs(params_system, s)
+    p = params_system
+    blocks = [
+        ("P_gkr", lambda rb: _rows_P_gkr(rb, s, P, P_gkr)),
+        ("P_gk", lambda rb: _rows_P_gk(rb, s, P_gkr, P_gk)),
+        ("d_gr", lambda rb: _rows_d_gr(rb, s, P_gkr)),
+        ("q_g", lambda rb: _rows_q_g(rb, "q_g", s, P_gk, p["Under_q_g"], 0.0, INF)),
+        ("Overq_g", lambda rb: _rows_q_g(rb, "Overq_g", s, P_gk, p["Over_q_g"], -INF, 0.0)),
+        ("q_gk", lambda rb: _rows_q_gk(rb, "q_gk", s, P_gk, p["U"], p["I_gu"], p["Under_q_gu"], 0.0, INF)),
+        ("Overq_gk", lambda rb: _rows_q_gk(rb, "Overq_gk", s, P_gk, p["U"], p["I_gu"], p["Over_q_gu"], -INF, 0.0)),
+        ("O_gk", lambda rb: _rows_O_gk(rb, s, P)),
+        ("J_h", lambda rb: _rows_J_h(rb, s, P)),
+        ("Q_gkrah", lambda rb: _rows_Q_gkrah(rb, s, pairs, P, Q)),
+        ("f", lambda rb: _rows_f(rb, s, pairs, p["p_transf"], Q, P_gk)),
+        ("Q", lambda rb: _rows_Q(rb, s, Q)),
+        ("m_hl_2", lambda rb: _rows_m_hl_2(rb, s, P, Delta_plus, Delta_moins)),
+        ("delta_zero", lambda rb: _rows_delta_zero(rb, s, Delta_plus, Delta_moins)),
+        ("delta_plus_delta", lambda rb: _rows_delta_delta(rb, "delta_plus_delta", s, Delta_plus, z_hl_plus)),
+        ("delta_moins_delta", lambda rb: _rows_delta_delta(rb, "delta_moins_delta", s, Delta_moins, z_hl_moins)),
+        ("delta_plus_b_hl_in", lambda rb: _rows_delta_b_hl(rb, "delta_plus_b_hl_in", s, Delta_plus, s["b_hl_in"])),
+        ("delta_moins_b_hl_out", lambda rb: _rows_delta_b_hl(rb, "delta_moins_b_hl_out", s, Delta_moins, s["b_hl_out"])),
+    ]
+    if sparse:
+        blocks = [(name, add_rows) for name, add_rows in blocks if name not in ("O_gk", "Q")]
+    return blocks
+
+
+def assemble_model(params_system: dict, sparse: bool = True, cached_blocks: dict | None = None,
+                   lazy_blocks: tuple = ()) -> ModelArrays:
+    """Builds objective, bounds and constraint matrix of the case-mix model from `params_system`.
+    Rows follow the order of `declare_constraints`; the objective is the one of `set_obj_fn`.
+    `sparse=False` keeps the full G x K2 x R x A2 x H box for P and Q and reproduces every pulp row.
+    `cached_blocks` (name: (counts, index, value, lower, upper)) are copied instead of being rebuilt,
+    see `STRUCTURAL_BLOCKS` and `backend.core.model_cache`. Blocks in `lazy_blocks` are left out (only "J_h" can be
+    generated afterwards, see `violated_J_h_rows`)"""
+    s = index_arrays(params_system)
+    nG, nK, nR, nA, nH, nL = s["nG"], s["nK"], s["nR"], s["nA"], s["nH"], s["nL"]
+
+    # Valid (g,k,r,a,h): k < K_g, a < A_{g,k}, h \in O_{g,k}
+    valid_P = np.broadcast_to(s["valid_gka"][:, :, None, :, None] & s["allowed"][:, :, None, None, :],
+                              (nG, nK, nR, nA, nH))
+    col_positions = {"P_gkrah": np.flatnonzero(valid_P), "Q_gkrah": np.flatnonzero(valid_P)} if sparse else {}
+
+    layout, offset = {}, 0
+    for name, shape in [("P_gkrah", (nG, nK, nR, nA, nH)), ("P_gkr", (nG, nK, nR)), ("P_gk", (nG, nK)),
+                        ("Q_gkrah", (nG, nK, nR, nA, nH)), ("Delta_plus", (nH, nL)), ("Delta_moins", (nH, nL)),
+                        ("z_hl_plus", (nH, nL)), ("z_hl_moins", (nH, nL))]:
+        layout[name] = (offset, shape)
+        offset += len(col_positions[name]) if name in col_positions else int(np.prod(shape))
+    n_cols = offset
+
+    def cols(name):
+        off, shape = layout[name]
+        return _index_map(off, shape, col_positions.get(name))
+
+    # Objective (see set_obj_fn)
+    col_cost = _objective_costs(s, n_cols, cols("P_gkrah"), cols("P_gk"), cols("Delta_plus"), cols("Delta_moins"),
+                                params_system["alpha"][0])
+
+    integrality = np.zeros(n_cols, dtype=bool)
+    integrality[cols("z_hl_plus")] = True
+    integrality[cols("z_hl_moins")] = True
+
+    # Constraints (see declare_constraints)
+    rb = _RowBuilder(n_cols)
+    for name, add_rows in _constraint_blocks(params_system, s, cols, sparse):
+        if name in lazy_blocks:
+            continue
+        elif cached_blocks is not None and name in cached_blocks:
+            rb.extend(name, *cached_blocks[name])
+        else:
+            add_rows(rb)
+
+    row_lower, row_upper, a_start, a_index, a_value = rb.to_csr()
+
+    return ModelArrays(col_cost=col_cost, col_lower=np.zeros(n_cols), col_upper=np.full(n_cols, INF),
+                       integrality=integrality, row_lower=row_lower, row_upper=row_upper,
+                       a_start=a_start, a_index=a_index, a_value=a_value,
+                       layout=layout, row_blocks=rb.blocks, sets=s, col_positions=col_positions)
+
+
+def to_pulp(model: ModelArrays, name: str = "Regional Case Mix"):
+    """Creates a pulp problem from a `ModelArrays`. Returns the problem and its variables in column order"""
+    import pulp
+
+    variables = []
+    for var_name, (_, shape) in model.layout.items():
+        cat = pulp.LpInteger if var_name.startswith("z_") else pulp.LpContinuous
+        positions = model.col_positions.get(var_name, np.arange(int(np.prod(shape))))
+        variables.extend(pulp.LpVariable(var_name + "_" + "_".join(map(str, idx)), 0, None, cat=cat)
+                         for idx in zip(*np.unravel_index(positions, shape)))
+
+    LP = pulp.LpProblem(name, pulp.LpMaximize)
+    nz = np.flatnonzero(model.col_cost)
+    LP += pulp.LpAffineExpression([(variables[j], model.col_cost[j]) for j in nz])
+
+    for i in range(model.n_rows):
+        start, end = model.a_start[i], model.a_start[i + 1]
+        expr = pulp.LpAffineExpression([(variables[j], v) for j, v in
+                                        zip(model.a_index[start:end].tolist(), model.a_value[start:end].tolist())])
+        lo, up = model.row_lower[i], model.row_upper[i]
+        if lo == up:
+            LP += pulp.LpConstraint(expr, pulp.LpConstraintEQ, rhs=lo)
+        else:
+            if np.isfinite(lo):
+                LP += pulp.LpConstraint(expr, pulp.LpConstraintGE, rhs=lo)
+            if np.isfinite(up):
+                LP += pulp.LpConstraint(expr, pulp.LpConstraintLE, rhs=up)
+    return LP, variables
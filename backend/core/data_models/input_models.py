@@ -10,7 +10,7 @@ class Region(BaseModel):
     region_id: str
     region_lbl: Optional[str] = None
     coordinates: list
-    facilities_affinity: Dict[str, float] # {facility id: affinity_score}
+    facilities_affinity: Optional[Dict[str, float]] = None # {facility id: affinity_score}, or w_rh given to convert_dm_to_json
 
 
 class Resource(BaseModel):
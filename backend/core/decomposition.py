@@ -0,0 +1,177 @@
+import numpy as np
+from backend.core.assembly import index_arrays
+
+###########################################
+### BLOCK DECOMPOSITION OF THE MODEL    ###
+###########################################
+
+# Regions and facilities are the nodes of a coupling graph:
+#  - r -- h when a patient group with demand in r may be treated in h (h \in O_{g,k}) and w_rh >= min_affinity.
+#    Each (r, g, k) is always linked to its best facility so that d_gr can still be met;
+#  - h -- h' when h' \in J_h and some pathway has chained activities (J_h rows);
+#  - all facilities that may send or receive resources (b_hl_in, b_hl_out), as \sum_h \Delta^+ = \sum_h \Delta^- is
+#    a single pool, unless `local_transfers` balances the transfers within each block.
+# The q_g, q_gk and f rows sum over all regions and facilities: the model is only split when they cannot bind
+# (q bounds 0/1 with I_gu covering the pathways, no transferable activities). With min_affinity=0 and
+# local_transfers=False every block is an exact independent sub-problem.
+
+
+def _global_rows_vacuous(params_system: dict, s: dict) -> bool:
+    """True when the q_g, q_gk and f rows are satisfied by any P >= 0"""
+    p = params_system
+    if any(q > 0 for q in p["Under_q_g"][:s["nG"]]) or any(q < 1 for q in p["Over_q_g"][:s["nG"]]):
+        return False
+    for g in range(s["nG"]):
+        covers_all = lambda u: set(range(s["K_g"][g])) <= set(p["I_gu"][g][u])
+        for u in range(p["U"][g]):
+            if p["Under_q_gu"][g][u] > 0 and not (covers_all(u) and p["Under_q_gu"][g][u] <= 1):
+                return False
+            if p["Over_q_gu"][g][u] < 1:
+                return False
+    return not any(a for N in p["N_gka_1"] for N_k in N for a in N_k)
+
+
+def _links(params_system: dict, s: dict, min_affinity: float) -> np.ndarray:
+    """(R x H) boolean matrix of the region -- facility links"""
+    w_rh, d_gr = s["w_rh"], s["d_gr"]
+    links = np.zeros((s["nR"], s["nH"]), dtype=bool)
+    for g in range(s["nG"]):
+        demand = d_gr[g] > 0
+        for k in range(s["K_g"][g]):
+            allowed = s["allowed"][g, k]
+            if not allowed.any():
+                continue
+            links |= demand[:, None] & allowed[None, :] & (w_rh >= min_affinity)
+            best = np.where(allowed[None, :], w_rh, -np.inf).argmax(axis=1)
+            links[np.flatnonzero(demand), best[demand]] = True
+    return links
+
+
+def _min_label(mask: np.ndarray, labels: np.ndarray, axis: int) -> np.ndarray:
+    """Smallest label among the neighbours given by `mask` (max int64 when there is none)"""
+    none = np.iinfo(np.int64).max
+    return np.where(mask, labels, none).min(axis=axis, initial=none)
+
+
+def coupling_components(params_system: dict, min_affinity: float = 0.0, local_transfers: bool = False) -> list:
+    """Returns [(regions, facilities)] of the independent blocks, as index arrays.
+    Regions without demand and blocks without region are left out (all their variables are 0)"""
+    s = index_arrays(params_system)
+    nR, nH = s["nR"], s["nH"]
+    if not _global_rows_vacuous(params_system, s):
+        return [(np.arange(nR), np.arange(nH))]
+
+    links = _links(params_system, s, min_affinity)
+    facility_links = np.zeros((nH, nH), dtype=bool)
+    if (s["A_gk"] > 1).any():
+        facility_links[np.repeat(np.arange(nH), s["J_pad"].shape[1])[s["J_mask"].ravel()], s["J_pad"][s["J_mask"]]] = True
+    if not local_transfers:
+        pool = ((s["b_hl_in"] * s["m_hl"] > 0) | (s["b_hl_out"] * s["m_hl"] > 0)).any(axis=1)
+        facility_links |= pool[:, None] & pool[None, :]
+
+    # Label propagation: every node takes the smallest label of its neighbours
+    region_label, facility_label = np.arange(nR), nR + np.arange(nH)
+    while True:
+        new_facility_label = np.minimum.reduce([facility_label, _min_label(links, region_label[:, None], axis=0),
+                                                _min_label(facility_links, facility_label[None, :], axis=1)])
+        new_region_label = np.minimum(region_label, _min_label(links, new_facility_label[None, :], axis=1))
+        if np.array_equal(new_facility_label, facility_label) and np.array_equal(new_region_label, region_label):
+            break
+        region_label, facility_label = new_region_label, new_facility_label
+
+    demand = s["d_gr"].sum(axis=0) > 0
+    components = []
+    for label in np.unique(region_label[demand]):
+        components.append((np.flatnonzero((region_label == label) & demand), np.flatnonzero(facility_label == label)))
+    return components
+
+
+def split_params_system(params_system: dict, regions: np.ndarray, facilities: np.ndarray) -> dict:
+    """Sub-problem restricted to `regions` and `facilities` (renumbered from 0)"""
+    new_h = {int(h): i for i, h in enumerate(facilities)}
+    p = dict(params_system)
+    p["R"] = list(range(len(regions)))
+    p["H"] = list(range(len(facilities)))
+    p["w_rh"] = [[params_system["w_rh"][r][h] for h in facilities] for r in regions]
+    p["d_gr"] = [[d_r[r] for r in regions] for d_r in params_system["d_gr"]]
+    p["O_gk"] = [[[new_h[h] for h in O if h in new_h] for O in O_g] for O_g in params_system["O_gk"]]
+    p["J_h"] = [[new_h[h2] for h2 in params_system["J_h"][h] if h2 in new_h] for h in facilities]
+    for key in ("m_hl", "b_hl_in", "b_hl_out"):
+        p[key] = [params_system[key][h] for h in facilities]
+    return p
+
+
+def _solve_block(args):
+    from backend.core.main import run_driver
+    params_block, engine, solver, mode, lazy_rows, time_limit, mip_gap = args
+    info = {}
+    status, objective, results = run_driver(params_block, engine=engine, solver=solver, mode=mode, lazy_rows=lazy_rows,
+                                            time_limit=time_limit, mip_gap=mip_gap, info=info)
+    return status, objective, {name: result.values for name, result in results.items()}, info
+
+
+def merge_block_info(block_infos: list) -> dict:
+    """Solver information of the whole problem: bounds and counters summed over the blocks, worst mip_gap"""
+    info = {"blocks": len(block_infos)}
+    for key in ("objective_bound", "simplex_iteration_count", "mip_node_count"):
+        values = [block_info.get(key) for block_info in block_infos]
+        if values and all(value is not None for value in values):
+            info[key] = sum(values)
+    gaps = [block_info["mip_gap"] for block_info in block_infos if block_info.get("mip_gap") is not None]
+    if gaps:
+        info["mip_gap"] = max(gaps)
+    return info
+
+
+def run_driver_decomposed(params_system: dict, engine: str = "arrays", solver: str = "highs", mode: str = "exact",
+                          processes: int = 1, min_affinity: float = 0.0, local_transfers: bool = False,
+                          lazy_rows: bool = False, time_limit: float | None = None, mip_gap: float | None = None,
+                          info: dict | None = None):
+    """`run_driver` solving every independent block (`coupling_components`) in its own process.
+    The block results are merged into the `dict_xarray_results` of the whole problem. Every block gets the whole
+    `time_limit`, the status being "time_limit" as soon as one block is stopped. `info` is updated with the merged
+    solver information of the blocks (see `merge_block_info`)"""
+    from concurrent.futures import ProcessPoolExecutor
+    from backend.core.main import normalize_params_system, run_driver
+    from backend.core.utils.data_utils import define_xarray
+    from backend.core.utils.result_tensors import compact_results, get_results_storage
+
+    params_system = normalize_params_system(params_system)
+    components = coupling_components(params_system, min_affinity, local_transfers)
+    print(f"Decomposition: {len(components)} block(s), sizes (R, H):", [(len(r), len(h)) for r, h in components])
+    if len(components) <= 1 and min_affinity <= 0 and not local_transfers:
+        return run_driver(params_system, engine=engine, solver=solver, mode=mode, lazy_rows=lazy_rows,
+                          time_limit=time_limit, mip_gap=mip_gap, info=info)
+
+    tasks = [(split_params_system(params_system, regions, facilities), engine, solver, mode, lazy_rows, time_limit, mip_gap)
+             for regions, facilities in components]
+    if processes > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=min(processes, len(tasks))) as executor:
+            block_results = list(executor.map(_solve_block, tasks))
+    else:
+        block_results = [_solve_block(task) for task in tasks]
+
+    s = index_arrays(params_system)
+    nG, nK, nR, nA, nH, nL = s["nG"], s["nK"], s["nR"], s["nA"], s["nH"], s["nL"]
+    dict_results = {"P_gkrah": np.zeros((nG, nK, nR, nA, nH)), "P_gkr": np.zeros((nG, nK, nR)), "P_gk": np.zeros((nG, nK)),
+                    "Q_gkrah": np.zeros((nG, nK, nR, nA, nH)), "Delta_plus": np.zeros((nH, nL)),
+                    "Delta_moins": np.zeros((nH, nL)), "z_hl_plus": np.zeros((nH, nL)), "z_hl_moins": np.zeros((nH, nL))}
+    status, objective = "Optimal", 0.0
+    for (regions, facilities), (block_status, block_objective, block, _) in zip(components, block_results):
+        if block_objective is None:
+            status, objective = block_status, None
+        else:
+            if block_status != "Optimal" and status == "Optimal":
+                status = block_status  # stopped block, its incumbent is kept
+            if objective is not None:
+                objective += block_objective
+        for name in ("P_gkrah", "Q_gkrah"):
+            dict_results[name][np.ix_(range(nG), range(nK), regions, range(nA), facilities)] = block[name]
+        dict_results["P_gkr"][:, :, regions] = block["P_gkr"]
+        dict_results["P_gk"] += block["P_gk"]
+        for name in ("Delta_plus", "Delta_moins", "z_hl_plus", "z_hl_moins"):
+            dict_results[name][facilities] = block[name]
+    if info is not None:
+        info.update(merge_block_info([block_info for *_, block_info in block_results]))
+
+    return status, objective, compact_results(define_xarray(params_system, dict_results), **get_results_storage())
@@ -0,0 +1,238 @@
+import numpy as np
+from dataclasses import dataclass, field
+from backend.core.assembly import ModelArrays, J_h_rows, J_h_row_count, missing_J_h_rows, violated_J_h_rows
+from backend.core.utils.cancellation import cancel_requested, cancellable
+
+##########################################
+### IN-PROCESS HiGHS SOLVE (highspy)   ###
+##########################################
+
+# The model arrays are handed to `highspy.Highs` in memory and the solution is read back as arrays:
+# no MPS/solution files and no `highs` executable. Statuses follow the mapping of `pulp.HiGHS_CMD`
+# so that callers of `run_driver` see the same strings ("Optimal", "Infeasible", ...).
+
+# Statuses of the solves stopped before proving optimality (the best incumbent is returned when there is one)
+TIME_LIMIT = "time_limit"
+CANCELLED = "cancelled"
+
+# HiGHS options applied to every instance of the process before the per-call `options` (e.g. "threads" in the
+# workers of the job queue, see `backend.api.jobs`)
+DEFAULT_OPTIONS = {}
+
+
+def set_default_options(**options):
+    DEFAULT_OPTIONS.update(options)
+
+
+def solve_options(time_limit: float | None = None, mip_gap: float | None = None) -> dict:
+    """HiGHS options of a deadline (s) and a relative MIP gap tolerance, None leaving the HiGHS defaults"""
+    options = {}
+    if time_limit is not None:
+        options["time_limit"] = max(float(time_limit), 0.0)
+    if mip_gap is not None:
+        options["mip_rel_gap"] = float(mip_gap)
+    return options
+
+
+@dataclass
+class SolveResult:
+    """Solver output as flat arrays, in the column/row order of the `ModelArrays`"""
+    status: str
+    objective: float | None
+    col_value: np.ndarray
+    col_dual: np.ndarray | None = None
+    row_dual: np.ndarray | None = None
+    model_status: str = ""
+    info: dict = field(default_factory=dict)
+
+
+def to_highs_lp(model: ModelArrays, relax: bool = False):
+    """Converts a `ModelArrays` into a `highspy.HighsLp` (row-wise matrix)"""
+    import highspy
+
+    lp = highspy.HighsLp()
+    lp.num_col_ = model.n_cols
+    lp.num_row_ = model.n_rows
+    lp.sense_ = highspy.ObjSense.kMaximize if model.sense == "maximize" else highspy.ObjSense.kMinimize
+    lp.col_cost_ = model.col_cost
+    lp.col_lower_ = model.col_lower
+    lp.col_upper_ = model.col_upper
+    lp.row_lower_ = model.row_lower
+    lp.row_upper_ = model.row_upper
+    lp.a_matrix_.format_ = highspy.MatrixFormat.kRowwise
+    lp.a_matrix_.num_col_ = model.n_cols
+    lp.a_matrix_.num_row_ = model.n_rows
+    lp.a_matrix_.start_ = model.a_start.astype(np.int32)
+    lp.a_matrix_.index_ = model.a_index.astype(np.int32)
+    lp.a_matrix_.value_ = model.a_value
+    if not relax and model.integrality.any():
+        lp.integrality_ = [highspy.HighsVarType.kInteger if i else highspy.HighsVarType.kContinuous
+                           for i in model.integrality]
+    return lp
+
+
+def create_highs(model: ModelArrays, msg: bool = False, options: dict | None = None, relax: bool = False):
+    """Returns a `highspy.Highs` instance holding `model`"""
+    import highspy
+
+    h = highspy.Highs()
+    h.setOptionValue("output_flag", bool(msg))
+    for name, value in {**DEFAULT_OPTIONS, **(options or {})}.items():
+        h.setOptionValue(name, value)
+    h.passModel(to_highs_lp(model, relax=relax))
+    if cancellable():
+        # Job workers: stop at the next interrupt check once the job is cancelled
+        def interrupt(event):
+            if cancel_requested():
+                event.interrupt()
+        h.cbSimplexInterrupt += interrupt
+        h.cbIpmInterrupt += interrupt
+        h.cbMipInterrupt += interrupt
+    return h
+
+
+def read_result(h) -> SolveResult:
+    """Reads status, objective and primal/dual arrays from a solved `highspy.Highs` instance"""
+    import highspy
+    import pulp
+
+    model_status = h.getModelStatus()
+    info = h.getInfo()
+    solution = h.getSolution()
+    feasible = info.primal_solution_status == highspy.SolutionStatus.kSolutionStatusFeasible
+
+    # Same decision order as pulp.HiGHS_CMD, except for the solves stopped by a deadline or a cancellation
+    stopped = {highspy.HighsModelStatus.kTimeLimit: TIME_LIMIT, highspy.HighsModelStatus.kInterrupt: CANCELLED}
+    if model_status == highspy.HighsModelStatus.kOptimal:
+        status = pulp.LpStatusOptimal
+    elif model_status in stopped:
+        status = stopped[model_status]
+    elif feasible:
+        status = pulp.LpStatusOptimal
+    elif model_status == highspy.HighsModelStatus.kInfeasible:
+        status = pulp.LpStatusInfeasible
+    elif model_status == highspy.HighsModelStatus.kUnbounded:
+        status = pulp.LpStatusUnbounded
+    else:
+        status = pulp.LpStatusNotSolved
+
+    n_cols = h.getNumCol()
+    if (status == pulp.LpStatusOptimal or status in stopped.values() and feasible) and solution.value_valid:
+        col_value = np.asarray(solution.col_value, dtype=float)
+        objective = info.objective_function_value
+    else:
+        col_value = np.full(n_cols, np.nan)
+        objective = None
+
+    return SolveResult(
+        status=pulp.LpStatus.get(status, status),
+        objective=objective,
+        col_value=col_value,
+        col_dual=np.asarray(solution.col_dual, dtype=float) if solution.dual_valid else None,
+        row_dual=np.asarray(solution.row_dual, dtype=float) if solution.dual_valid else None,
+        model_status=h.modelStatusToString(model_status),
+        info={"mip_gap": info.mip_gap, "simplex_iteration_count": info.simplex_iteration_count,
+              "mip_node_count": info.mip_node_count, "objective_bound": info.mip_dual_bound},
+    )
+
+
+def solve_highs(model: ModelArrays, msg: bool = False, options: dict | None = None) -> SolveResult:
+    """Solves `model` in memory with highspy"""
+    h = create_highs(model, msg=msg, options=options)
+    h.run()
+    return read_result(h)
+
+
+def _add_rows(h, rows: tuple):
+    lower, upper, start, index, value = rows
+    h.addRows(len(lower), lower, upper, len(index), start[:-1].astype(np.int32), index.astype(np.int32), value)
+
+
+def solve_highs_lazy(model: ModelArrays, msg: bool = False, options: dict | None = None, max_rounds: int = 50) -> SolveResult:
+    """Cutting-plane loop on the J_h rows. `model` is assembled without them (lazy_blocks=("J_h",)): after each solve
+    the violated J_h rows are added and HiGHS re-solves from its current basis, until none is violated.
+    After `max_rounds` the J_h rows not added yet are all added. Rounds and added rows are in `info`"""
+    import time
+
+    h = create_highs(model, msg=msg, options=options)
+    rounds, n_rows = 0, 0
+    added = np.zeros(model.column_indices("P_gkrah").shape, dtype=bool)
+    time_limit = {**DEFAULT_OPTIONS, **(options or {})}.get("time_limit")
+    start = time.perf_counter()
+    while True:
+        if time_limit is not None:
+            h.setOptionValue("time_limit", max(time_limit - (time.perf_counter() - start), 0.0))
+        h.run()
+        result = read_result(h)
+        rounds += 1
+        if result.objective is None or result.status != "Optimal" or rounds > max_rounds:
+            break
+        rows = violated_J_h_rows(model, result.col_value)
+        if len(rows[0]) == 0:
+            break
+        if rounds >= max_rounds:
+            rows = missing_J_h_rows(model, added)
+        added[rows] = True
+        block = J_h_rows(model, rows)
+        _add_rows(h, block)
+        n_rows += len(block[0])
+    if result.objective is not None and result.status != "Optimal" and len(violated_J_h_rows(model, result.col_value)[0]):
+        # Incumbent of a stopped solve that does not satisfy the J_h rows left out
+        result.objective, result.col_value = None, np.full(model.n_cols, np.nan)
+    result.info.update(lazy_rounds=rounds, lazy_rows=n_rows, J_h_rows=J_h_row_count(model))
+    return result
+
+
+def relative_gap(bound: float, objective: float) -> float:
+    """|bound - objective| / |bound|"""
+    return abs(bound - objective) / max(abs(bound), 1e-9)
+
+
+def _round_transfers(model: ModelArrays, col_value: np.ndarray) -> np.ndarray:
+    """Integer values for z_hl_plus / z_hl_moins close to the relaxed ones, keeping \\sum_h z^+ = \\sum_h z^- for every l.
+    z^+ are rounded up (within b_hl_in * m_hl / delta_l) and z^- down, then the side in excess is decreased
+    where the rounding moved it the most. Returns the values in the column order of both variables"""
+    s = model.sets
+    tol = 1e-6
+    z_plus, z_moins = col_value[model.column_indices("z_hl_plus")], col_value[model.column_indices("z_hl_moins")]
+    upper_plus = np.floor(s["b_hl_in"] * s["m_hl"] / np.where(s["delta_l"] > 0, s["delta_l"], 1)[None, :] + tol)
+    plus = np.minimum(np.ceil(z_plus - tol), np.maximum(upper_plus, np.floor(z_plus + tol)))
+    moins = np.floor(z_moins + tol)
+    for l in range(s["nL"]):
+        excess = int(round(plus[:, l].sum() - moins[:, l].sum()))
+        side, relaxed = (plus, z_plus) if excess > 0 else (moins, z_moins)
+        for _ in range(abs(excess)):
+            moved = np.where(side[:, l] > 0, side[:, l] - relaxed[:, l], -np.inf)
+            side[np.argmax(moved), l] -= 1
+    return np.concatenate([plus.ravel(), moins.ravel()])
+
+
+def relax_and_round(h, model: ModelArrays) -> SolveResult:
+    """Solves the LP relaxation held by `h` (see `create_highs(relax=True)`), fixes z_hl_plus / z_hl_moins to rounded
+    values (`_round_transfers`) and re-solves the remaining LP. The gap to the relaxation bound is in `info`"""
+    z_cols = np.concatenate([model.column_indices("z_hl_plus").ravel(), model.column_indices("z_hl_moins").ravel()]).astype(np.int32)
+    h.changeColsBounds(len(z_cols), z_cols, model.col_lower[z_cols], model.col_upper[z_cols])
+    h.run()
+    relaxed = read_result(h)
+    if relaxed.objective is None:
+        relaxed.info.update(relaxation_bound=None, gap=None, rounding="infeasible relaxation")
+        return relaxed
+
+    z_values = _round_transfers(model, relaxed.col_value)
+    h.changeColsBounds(len(z_cols), z_cols, z_values, z_values)
+    h.run()
+    result = read_result(h)
+    result.info.update(relaxation_bound=relaxed.objective, rounding="fixed",
+                       gap=relative_gap(relaxed.objective, result.objective) if result.objective is not None else None)
+    return result
+
+
+def solve_highs_relaxed(model: ModelArrays, msg: bool = False, options: dict | None = None) -> SolveResult:
+    """Relax-and-round (`relax_and_round`), the MIP being solved when the rounded transfers are infeasible"""
+    result = relax_and_round(create_highs(model, msg=msg, options=options, relax=True), model)
+    bound = result.info["relaxation_bound"]
+    if result.objective is None and bound is not None:
+        result = solve_highs(model, msg=msg, options=options)
+        result.info.update(relaxation_bound=bound, rounding="mip",
+                           gap=relative_gap(bound, result.objective) if result.objective is not None else None)
+    return result
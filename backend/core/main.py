@@ -2,16 +2,47 @@ import backend.core.optimization as mdl
 import pulp
 from backend.core.utils.data_utils import package_results, define_xarray
 from backend.core.optimization import declare_constraints, set_obj_fn
+from backend.core.utils.metrics import record_model, record_solve
+from backend.core.utils.result_tensors import SPARSE_RESULTS, compact_results, get_results_storage
+from backend.core.utils.tracing import span
 
 
-def run_driver(params_system):
-    
+def get_pulp_solver(solver="highs_cmd", time_limit=None, mip_gap=None):
+    """Returns the pulp solver: "highs" runs highspy in-process, "highs_cmd" calls the `highs` executable.
+    `time_limit` (s) and `mip_gap` (relative) are passed to HiGHS when given"""
+    if solver == "highs":
+        return pulp.HiGHS(msg=1, timeLimit=time_limit, gapRel=mip_gap)
+    elif solver == "highs_cmd":
+        return pulp.HiGHS_CMD(msg=1, timeLimit=time_limit, gapRel=mip_gap)
+    raise ValueError(f"Unknown solver '{solver}', expected 'highs' or 'highs_cmd'")
+
+
+def get_pulp_status(LP, time_limit=None):
+    """(status, objective) of a solved pulp model. With a `time_limit`, a solution that is only feasible (or none)
+    means that HiGHS was stopped: status "time_limit", with the objective of the best incumbent when there is one"""
+    from backend.core.highs_solver import TIME_LIMIT
+    if time_limit is not None and LP.status == pulp.LpStatusOptimal and LP.sol_status == pulp.LpSolutionIntegerFeasible:
+        return TIME_LIMIT, pulp.value(LP.objective)
+    if time_limit is not None and LP.status == pulp.LpStatusNotSolved:
+        return TIME_LIMIT, None
+    # pulp.HiGHS assigns values even without a solution, keep HiGHS_CMD semantics (no objective unless optimal)
+    return pulp.LpStatus[LP.status], pulp.value(LP.objective) if LP.status == pulp.LpStatusOptimal else None
+
+
+def normalize_params_system(params_system):
+    """Adjusts params_system before building the model"""
     try:
     # Line below useful for the Burdett's data, in order to get \sum_{u} \underline{q}_{g,u} = \sum_{u} \overline{q}_{g,u} = 1
         params_system["Under_q_gu"], params_system["Over_q_gu"] = mdl.change_Under_Over(params_system["G"], params_system["U"], params_system["Under_q_gu"], params_system["Over_q_gu"])
     except Exception as e:
         print(e, "No Under_q_gu and Over_q_gu modification needed")
+    return params_system
+
 
+def build_pulp_model(params_system):
+    """Declares the variables, objective and constraints of the case-mix model with pulp.
+    Returns (LP, variables), variables being in the order of `package_results`"""
+    
     # Define K2 and A2 (usefull sets for creating the variables)
    
     K2 = mdl.defineK2(params_system["K_g"])
@@ -36,28 +67,124 @@ def run_driver(params_system):
     # Define the objective function
     set_obj_fn(LP, P_gk, P, Delta_plus, Delta_moins, params_system)
     
-    print("Declaring Constraints...")
- 
     # Set the constraints
     declare_constraints(LP, P_gk, params_system["G"], params_system["K_g"], P_gkr, params_system["R"], P, params_system["A_gk"], params_system["H"], Q, Delta_plus,
                         Delta_moins, params_system["L"], z_hl_plus, z_hl_moins, params_system["d_gr"], params_system["Under_q_g"], params_system["Over_q_g"],
                         params_system["U"], params_system["I_gu"], params_system["Under_q_gu"], params_system["Over_q_gu"], params_system["O_gk"], params_system["J_h"], params_system["N_gka_1"], params_system["N_gka_2"],
                         params_system["p_transf"], params_system["t_gkal"], params_system["m_hl"], params_system["D"], params_system["delta_l"], params_system["b_hl_in"], params_system["b_hl_out"])
+
+    return LP, (P_gk, P_gkr, P, Q, Delta_plus, Delta_moins, z_hl_plus, z_hl_moins)
+
+
+def run_driver(params_system, engine="arrays", solver="highs", mode="exact", decomposition=None, lazy_rows=False,
+               time_limit=None, mip_gap=None, info=None):
+    """Builds and solves the model. `engine` selects how the model is assembled: "pulp" (one lpSum per constraint)
+    or "arrays" (NumPy assembly of the same rows, see `backend.core.assembly`). `solver` is either "highs"
+    (in-process highspy, no files) or "highs_cmd" (the `highs` executable through pulp). The defaults are those of
+    config.yaml. Only engine="arrays" restricts P and Q to the valid (g, k, r, a, h) cells: the pulp engine declares
+    the dense G x K x R x A x H variables.
+    `mode` is "exact" (MIP) or "relaxed" (LP relaxation with rounded z_hl, engine="arrays" and solver="highs" only).
+    `decomposition` (processes, min_affinity, local_transfers) solves the independent blocks of the model in parallel
+    processes, see `backend.core.decomposition`. `lazy_rows` generates the J_h rows on demand (cutting planes,
+    engine="arrays", solver="highs" and mode="exact" only).
+    `time_limit` (s) and `mip_gap` stop HiGHS early: the status is then "time_limit" (or "cancelled", see
+    `backend.core.utils.cancellation`) with the best incumbent when one was found. `info` (a dict) is updated with
+    the solver information (mip_gap, objective_bound...) when given"""
+    
+    if decomposition:
+        from backend.core.decomposition import run_driver_decomposed
+        return run_driver_decomposed(params_system, engine, solver, mode, lazy_rows=lazy_rows, time_limit=time_limit,
+                                     mip_gap=mip_gap, info=info, **decomposition)
+
+    params_system = normalize_params_system(params_system)
+
+    if engine == "arrays":
+        return run_driver_arrays(params_system, solver, mode, lazy_rows, time_limit, mip_gap, info)
+    elif engine != "pulp":
+        raise ValueError(f"Unknown engine '{engine}', expected 'pulp' or 'arrays'")
+    elif mode != "exact" or lazy_rows:
+        raise ValueError(f"Solve mode '{mode}' and lazy_rows require engine='arrays' and solver='highs'")
+
+    print("Declaring Constraints...")
+    with span("build", engine="pulp", R=len(params_system["R"]), H=len(params_system["H"])) as current:
+        LP, variables = build_pulp_model(params_system)
+        current.set(n_vars=LP.numVariables(), n_rows=LP.numConstraints())
+    record_model("pulp", LP.numVariables(), LP.numConstraints())
+
     # Solve the model
     
     print("Starting solver...")
     
-
-    LP.solve(pulp.HiGHS_CMD(msg=1)) #options=["--tmlim", "10", "--nointopt", "--nopresol"])))
+    with span("solve", solver=solver) as current:
+        LP.solve(get_pulp_solver(solver, time_limit, mip_gap))
+    status, objective = get_pulp_status(LP, time_limit)
+    record_solve("pulp", mode, status, current.duration)
     
-    dict_results = package_results(P_gk, P_gkr, P, Q, Delta_plus, Delta_moins,z_hl_plus, z_hl_moins)
+    with span("extract"):
+        dict_results = package_results(*variables)
     
-    dict_xarray_results = define_xarray(params_system, dict_results)
+    with span("xarray"):
+        dict_xarray_results = compact_results(define_xarray(params_system, dict_results), **get_results_storage())
+
+    return status, objective, dict_xarray_results
+
 
-    status =  pulp.LpStatus[LP.status]
-    objective = pulp.value(LP.objective)
+def run_driver_arrays(params_system, solver="highs", mode="exact", lazy_rows=False, time_limit=None, mip_gap=None,
+                      info=None):
+    """Same as `run_driver` with the model assembled as arrays by `assemble_model` (through the template cache).
+    With solver="highs" the arrays are passed to highspy in memory and the column values are read back as an array"""
+    from backend.core.model_cache import build_model
+
+    if mode not in ("exact", "relaxed"):
+        raise ValueError(f"Unknown solve mode '{mode}', expected 'exact' or 'relaxed'")
+    elif mode == "relaxed" and solver != "highs":
+        raise ValueError(f"Solve mode '{mode}' requires engine='arrays' and solver='highs'")
+    elif lazy_rows and (solver != "highs" or mode != "exact"):
+        raise ValueError("lazy_rows requires solver='highs' and mode='exact'")
+
+    print("Declaring Constraints...")
+    with span("build", engine="arrays", R=len(params_system["R"]), H=len(params_system["H"])) as current:
+        model = build_model(params_system, lazy_blocks=("J_h",) if lazy_rows else ())
+        current.set(n_vars=model.n_cols, n_rows=model.n_rows, nnz=model.nnz)
+    record_model("arrays", model.n_cols, model.n_rows, model.nnz)
+
+    print("Starting solver...")
+    with span("solve", solver=solver, mode=mode, lazy_rows=lazy_rows) as current:
+        status, objective, col_value, solve_info = _solve_arrays(model, solver, mode, lazy_rows, time_limit, mip_gap)
+        current.set(status=status)
+    record_solve("arrays", mode, status, current.duration, solve_info)
+    if info is not None:
+        info.update(solve_info)
+
+    storage = get_results_storage()
+    with span("extract", **storage):
+        dict_results = model.unpack(col_value, sparse=SPARSE_RESULTS if storage["sparse"] else ())
+    with span("xarray"):
+        dict_xarray_results = compact_results(define_xarray(params_system, dict_results), **storage)
 
     return status, objective, dict_xarray_results
+
+
+def _solve_arrays(model, solver, mode, lazy_rows, time_limit=None, mip_gap=None):
+    """Solves the assembled model, returns (status, objective, col_value, solver info)"""
+    from backend.core.assembly import to_pulp
+    from backend.core.highs_solver import solve_highs, solve_highs_lazy, solve_highs_relaxed, solve_options
+
+    options = solve_options(time_limit, mip_gap)
+    if lazy_rows:
+        result = solve_highs_lazy(model, msg=True, options=options)
+        print(f"Lazy J_h rows: {result.info['lazy_rows']} of {result.info['J_h_rows']} added in {result.info['lazy_rounds']} round(s)")
+    elif solver == "highs" and mode == "relaxed":
+        result = solve_highs_relaxed(model, msg=True, options=options)
+        print("Relax-and-round:", result.info["rounding"], "gap to the relaxation bound:", result.info["gap"])
+    elif solver == "highs":
+        result = solve_highs(model, msg=True, options=options)
+    else:
+        LP, variables = to_pulp(model)
+        LP.solve(get_pulp_solver(solver, time_limit, mip_gap))
+        status, objective = get_pulp_status(LP, time_limit)
+        return status, objective, [v.varValue for v in variables], {}
+    return result.status, result.objective, result.col_value, result.info
     
 
 
@@ -0,0 +1,164 @@
+import json
+import os
+import numpy as np
+
+##############################################
+### COMMUNES GEO ARTIFACT                  ###
+##############################################
+
+# The maternity serializer needs, for every French commune, its code, department code, centroid (Lambert-93
+# EPSG:2154 and WGS84) and polygon in Lambert-93. Reading communes-50m.parquet and reprojecting every polygon takes
+# seconds, so it is done once by `build_artifact`, which writes one .npy file per column in a directory:
+#   codes, dep_codes          fixed-width strings, sorted by code
+#   centroids_m, centroids_wgs84   (N, 2) float64
+#   wkb_m, wkb_offsets        polygons in EPSG:2154 as concatenated WKB (commune i: wkb_m[wkb_offsets[i]:wkb_offsets[i + 1]])
+#   manifest.json             version and size / mtime of the source file
+# `get_communes()` memory-maps the columns (shared by the processes through the page cache). Every call checks the
+# manifest: the artifact is rebuilt when the source file changed, and reopened when it was rebuilt since it was
+# mapped. Without the source file, an existing artifact is used as is.
+# Offline build, from the repository root:
+#   python -m backend.core.mappers.datasets_mappers.communes_geo
+
+ARTIFACT_VERSION = 1
+CRS_METERS = 2154
+COLUMNS = ("codes", "dep_codes", "centroids_m", "centroids_wgs84", "wkb_m", "wkb_offsets")
+
+
+def department_code(commune_code: str) -> str:
+    """INSEE department of a commune: 3 characters overseas (97x), 2 otherwise (including 2A / 2B)"""
+    return commune_code[:3] if commune_code.startswith("97") else commune_code[:2]
+
+
+def source_fingerprint(source_path: str) -> dict | None:
+    if not os.path.exists(source_path):
+        return None
+    stat = os.stat(source_path)
+    return {"path": os.path.basename(source_path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def build_artifact(df_geo_comms, directory: str, source: dict | None = None) -> dict:
+    """Writes the artifact of a GeoDataFrame of communes ("code" column, any CRS) in `directory`, returns the manifest"""
+    import shapely
+    df_geo_comms = df_geo_comms.drop_duplicates(subset="code").sort_values("code")
+    geometries_m = df_geo_comms.geometry.to_crs(epsg=CRS_METERS)
+    centroids_m = geometries_m.centroid
+    centroids_wgs84 = centroids_m.to_crs(epsg=4326)
+
+    codes = df_geo_comms["code"].astype(str).to_numpy()
+    wkb = shapely.to_wkb(geometries_m.values)
+    columns = {"codes": codes.astype("U"),
+               "dep_codes": np.array([department_code(code) for code in codes]).astype("U"),
+               "centroids_m": np.column_stack([centroids_m.x.values, centroids_m.y.values]),
+               "centroids_wgs84": np.column_stack([centroids_wgs84.x.values, centroids_wgs84.y.values]),
+               "wkb_m": np.frombuffer(b"".join(wkb), dtype=np.uint8),
+               "wkb_offsets": np.concatenate([[0], np.cumsum([len(g) for g in wkb])]).astype(np.int64)}
+
+    # Columns first and manifest last (each through an atomic rename): a reader never sees a partial artifact
+    os.makedirs(directory, exist_ok=True)
+    for name, column in columns.items():
+        tmp_path = os.path.join(directory, f"{name}.{os.getpid()}.tmp.npy")
+        np.save(tmp_path, column)
+        os.replace(tmp_path, os.path.join(directory, f"{name}.npy"))
+    manifest = {"version": ARTIFACT_VERSION, "n_communes": len(codes), "source": source}
+    tmp_path = os.path.join(directory, f"manifest.json.{os.getpid()}.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, os.path.join(directory, "manifest.json"))
+    return manifest
+
+
+def read_manifest(directory: str) -> dict | None:
+    try:
+        with open(os.path.join(directory, "manifest.json")) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def is_stale(directory: str, source_path: str) -> bool:
+    """True when the artifact is missing, of another version, or built from another state of the source file"""
+    manifest = read_manifest(directory)
+    if manifest is None or manifest.get("version") != ARTIFACT_VERSION:
+        return True
+    fingerprint = source_fingerprint(source_path)
+    return fingerprint is not None and manifest.get("source") != fingerprint
+
+
+def ensure_artifact(directory: str, source_path: str) -> dict:
+    """Builds the artifact from `source_path` (parquet) when it is stale, returns its manifest"""
+    if is_stale(directory, source_path):
+        import geopandas as gpd
+        from backend.core.utils.tracing import span
+        if not os.path.exists(source_path):
+            raise FileNotFoundError(f"Communes file '{source_path}' not found and no artifact in '{directory}'")
+        with span("build_communes_artifact"):
+            return build_artifact(gpd.read_parquet(source_path), directory, source_fingerprint(source_path))
+    return read_manifest(directory)
+
+
+class Communes:
+    """Memory-mapped columns of the artifact, with lookups by commune code"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.manifest = read_manifest(directory)
+        for name in COLUMNS:
+            setattr(self, name, np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r"))
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def indices(self, codes) -> np.ndarray:
+        """Sorted positions of the known communes among `codes` (unknown codes are ignored)"""
+        codes = np.unique(np.asarray(codes, dtype=str))
+        positions = np.searchsorted(self.codes, codes)
+        known = positions < len(self.codes)
+        positions, codes = positions[known], codes[known]
+        return positions[self.codes[positions] == codes]
+
+    def geometries(self, indices: np.ndarray) -> np.ndarray:
+        """Shapely polygons (EPSG:2154) of the communes at `indices`"""
+        import shapely
+        offsets = self.wkb_offsets
+        return shapely.from_wkb([self.wkb_m[offsets[i]:offsets[i + 1]].tobytes() for i in indices])
+
+    def to_geodataframe(self, indices: np.ndarray):
+        """GeoDataFrame ("code", "dep_code", geometry in EPSG:2154) of the communes at `indices`"""
+        import geopandas as gpd
+        return gpd.GeoDataFrame({"code": self.codes[indices].astype(str), "dep_code": self.dep_codes[indices].astype(str)},
+                                geometry=self.geometries(indices), crs=f"EPSG:{CRS_METERS}")
+
+
+_COMMUNES = None
+
+
+def get_communes() -> Communes:
+    """Process-wide communes, from the artifact of the `open_data` section of config.yaml (rebuilt when stale,
+    reopened when rebuilt)"""
+    global _COMMUNES
+    from backend.core.utils.data_utils import read_configs
+    configs = read_configs("open_data")
+    manifest = ensure_artifact(configs["communes_artifact"], configs["communes"])
+    if _COMMUNES is None or _COMMUNES.directory != configs["communes_artifact"] or _COMMUNES.manifest != manifest:
+        _COMMUNES = Communes(configs["communes_artifact"])
+    return _COMMUNES
+
+
+if __name__ == "__main__":
+
+    import argparse
+    from backend.core.utils.data_utils import read_configs
+
+    configs = read_configs("open_data")
+    parser = argparse.ArgumentParser(description="Builds the communes geo artifact used by the maternity serializer")
+    parser.add_argument("--source", default=configs["communes"], help="communes parquet file")
+    parser.add_argument("--output", default=configs["communes_artifact"], help="artifact directory")
+    parser.add_argument("--force", action="store_true", help="rebuild even when the artifact is up to date")
+    args = parser.parse_args()
+
+    if args.force or is_stale(args.output, args.source):
+        import geopandas as gpd
+        manifest = build_artifact(gpd.read_parquet(args.source), args.output, source_fingerprint(args.source))
+    else:
+        manifest = read_manifest(args.output)
+    print(json.dumps(manifest, indent=2))
@@ -0,0 +1,132 @@
+import json
+import os
+import numpy as np
+
+##############################################
+### NATIONAL FACILITY-COMMUNE DISTANCES    ###
+##############################################
+
+# Distances (m, float32) between every commune polygon of the communes artifact (see `communes_geo`) and every
+# maternity of summary_maternity_capacity.csv, computed once by `build_store` and written in a directory:
+#   distances_m      (communes x facilities) float32, communes in the order of the communes artifact
+#   nofinesset       facility ids (sorted), facility_coords (facilities x 2) lon / lat used for the distances
+#   manifest.json    version, size / mtime of the maternities file and manifest of the communes artifact
+# `get_distance_store()` memory-maps it read-only, so that the uvicorn workers share it through the page cache,
+# and the w_rh of a request is a fancy-indexed slice. Facilities unknown to the store, or whose coordinates were
+# edited, are reported as missing and computed per request. The store is built offline (tens of seconds):
+#   python -m backend.core.mappers.datasets_mappers.distance_store
+# Every call checks the manifest: a missing or stale store (maternities file or communes artifact changed since) is
+# ignored, and a store rebuilt since it was mapped is reopened.
+
+STORE_VERSION = 1
+CHUNK_COMMUNES = 2048
+
+
+def facility_points(coords, crs):
+    """GeoSeries of the facilities lon / lat `coords`, projected to `crs`"""
+    import geopandas as gpd
+    coords = np.array(list(coords), dtype=float).reshape(-1, 2)
+    return gpd.GeoSeries(gpd.points_from_xy(coords[:, 0], coords[:, 1]), crs="EPSG:4326").to_crs(crs)
+
+
+def build_store(df_maternities, communes, directory: str, source: dict | None = None) -> dict:
+    """Writes the distances between the communes (a `communes_geo.Communes`) and the facilities of `df_maternities`
+    ("nofinesset", "coords" columns) in `directory`, returns the manifest"""
+    import shapely
+    from backend.core.mappers.datasets_mappers.communes_geo import CRS_METERS, read_manifest
+    df_maternities = df_maternities.drop_duplicates(subset="nofinesset").assign(
+        nofinesset=lambda df: df["nofinesset"].astype(str)).sort_values("nofinesset")
+    points = np.asarray(facility_points(df_maternities["coords"], f"EPSG:{CRS_METERS}"))
+
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = os.path.join(directory, f"distances_m.{os.getpid()}.tmp.npy")
+    distances = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float32, shape=(len(communes), len(points)))
+    for start in range(0, len(communes), CHUNK_COMMUNES):
+        polygons = communes.geometries(range(start, min(start + CHUNK_COMMUNES, len(communes))))
+        distances[start:start + len(polygons)] = shapely.distance(polygons[:, None], points[None, :])
+    distances.flush()
+    del distances
+    os.replace(tmp_path, os.path.join(directory, "distances_m.npy"))
+
+    columns = {"nofinesset": df_maternities["nofinesset"].to_numpy().astype("U"),
+               "facility_coords": np.array(list(df_maternities["coords"]), dtype=float).reshape(-1, 2)}
+    for name, column in columns.items():
+        tmp_path = os.path.join(directory, f"{name}.{os.getpid()}.tmp.npy")
+        np.save(tmp_path, column)
+        os.replace(tmp_path, os.path.join(directory, f"{name}.npy"))
+    manifest = {"version": STORE_VERSION, "shape": [len(communes), len(points)], "source": source,
+                "communes": read_manifest(communes.directory)}
+    tmp_path = os.path.join(directory, f"manifest.json.{os.getpid()}.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, os.path.join(directory, "manifest.json"))
+    return manifest
+
+
+def is_stale(directory: str, source_path: str, communes_directory: str) -> bool:
+    """True when the store is missing, of another version, or built from other maternities or communes"""
+    from backend.core.mappers.datasets_mappers.communes_geo import read_manifest, source_fingerprint
+    manifest = read_manifest(directory)
+    if manifest is None or manifest.get("version") != STORE_VERSION:
+        return True
+    fingerprint = source_fingerprint(source_path)
+    return (fingerprint is not None and manifest.get("source") != fingerprint) or \
+        manifest.get("communes") != read_manifest(communes_directory)
+
+
+class DistanceStore:
+    """Memory-mapped distances, sliced by commune positions and facility ids"""
+
+    def __init__(self, directory: str):
+        from backend.core.mappers.datasets_mappers.communes_geo import read_manifest
+        self.directory = directory
+        self.manifest = read_manifest(directory)
+        self.distances_m = np.load(os.path.join(directory, "distances_m.npy"), mmap_mode="r")
+        self.nofinesset = np.load(os.path.join(directory, "nofinesset.npy"), mmap_mode="r")
+        self.facility_coords = np.load(os.path.join(directory, "facility_coords.npy"), mmap_mode="r")
+
+    def lookup(self, commune_indices: np.ndarray, nofinesset, coords) -> tuple[np.ndarray, np.ndarray]:
+        """(distances, missing): (communes x facilities) float64 distances of the communes at `commune_indices` of
+        the communes artifact, and the mask of the facilities not in the store or at other coordinates
+        (their columns are NaN)"""
+        ids = np.asarray(nofinesset, dtype=str)
+        coords = np.array(list(coords), dtype=float).reshape(-1, 2)
+        if len(self.nofinesset) == 0:
+            return np.full((len(commune_indices), len(ids)), np.nan), np.ones(len(ids), dtype=bool)
+        positions = np.minimum(np.searchsorted(self.nofinesset, ids), len(self.nofinesset) - 1)
+        found = (self.nofinesset[positions] == ids) & np.isclose(self.facility_coords[positions], coords).all(axis=1)
+        distances = np.full((len(commune_indices), len(ids)), np.nan)
+        distances[:, found] = self.distances_m[np.ix_(np.asarray(commune_indices), positions[found])]
+        return distances, ~found
+
+
+_DISTANCE_STORE = None
+
+
+def get_distance_store() -> DistanceStore | None:
+    """Process-wide distance store of the `open_data` section of config.yaml (None when missing or stale, reopened
+    when rebuilt)"""
+    global _DISTANCE_STORE
+    from backend.core.mappers.datasets_mappers.communes_geo import read_manifest
+    from backend.core.utils.data_utils import read_configs
+    configs = read_configs("open_data")
+    directory = configs.get("distance_store")
+    if not directory or is_stale(directory, configs["maternities"], configs["communes_artifact"]):
+        _DISTANCE_STORE = None
+        return None
+    if _DISTANCE_STORE is None or _DISTANCE_STORE.directory != directory or \
+            _DISTANCE_STORE.manifest != read_manifest(directory):
+        _DISTANCE_STORE = DistanceStore(directory)
+    return _DISTANCE_STORE
+
+
+if __name__ == "__main__":
+
+    from backend.core.mappers.datasets_mappers.communes_geo import get_communes, source_fingerprint
+    from backend.core.mappers.datasets_mappers.maternite_serializer import read_maternity
+    from backend.core.utils.data_utils import read_configs
+
+    configs = read_configs("open_data")
+    manifest = build_store(read_maternity(), get_communes(), configs["distance_store"],
+                           source_fingerprint(configs["maternities"]))
+    print(json.dumps(manifest, indent=2))
@@ -3,52 +3,38 @@ from typing import Union
 from backend.core.data_models.input_models import Facility, Region, Instance, Resource, PatientsGroup, Activity, Pathway
 import geopandas as gpd
 import numpy as np
-import time
-
-start = time.time()
-DF_LABOURS_ALL = pd.read_csv("backend/data/open_data/summary_maternity_labours.csv", low_memory=False)
-end = time.time()
-print(f"Reading DF_LABOURS_ALL {end-start}s")
-
-start = time.time()
-DF_GEO_COMMS = gpd.read_parquet("backend/data/open_data/communes-50m.parquet")
-end = time.time()
-print(f"Reading DF_GEO_COMMS {end-start}s")
-
-start = time.time()
-DF_GEO_COMMS_METERS= DF_GEO_COMMS.to_crs(epsg=2154)
-end = time.time()
-print(f"Converting to CRS {end-start}s")
-
-start = time.time()
-centroids_m = DF_GEO_COMMS_METERS.geometry.centroid
-end = time.time()
-print(f"Fetching centroids {end-start}s")
-
-start = time.time()
-centroids_wgs84 = centroids_m.to_crs(epsg=4326)
-end = time.time()
-print(f"Converting centroids to crs {end-start}s")
-
-start = time.time()
-# Precompute centroids once
-DICT_COMM_CENTROIDS = dict(zip(
-    DF_GEO_COMMS["code"],
-    np.vstack([centroids_wgs84.x.values,
-               centroids_wgs84.y.values]).T
-))
-end = time.time()
-print(f"Computing dict of centroids {end-start}s")
-
-
-def get_Regions(df_instance: pd.DataFrame) -> list[Region]:
-    """Creates `Region` instance using public data on French communes (Commune code and coordinates)"""
-    df_labours = DF_LABOURS_ALL[DF_LABOURS_ALL["dep_code"].isin(df_instance["dep_code"])]
-    df_geo_comms = DF_GEO_COMMS_METERS[DF_GEO_COMMS_METERS["code"].isin(df_labours["comm_code"])]
-    affinities_dict = _get_affinities(df_instance, df_geo_comms)
-    communes_ids = list(df_geo_comms["code"].drop_duplicates().sort_values())
-    list_regions = [Region(region_id=c_id, coordinates=DICT_COMM_CENTROIDS[c_id], facilities_affinity=affinities_dict[c_id]) for c_id in communes_ids]
-    return list_regions
+from backend.core.utils.tracing import span, set_attributes
+
+# The open data files are loaded on first use: the labours summary is read once per process, the communes come
+# from the memory-mapped artifact of `communes_geo` (built from communes-50m.parquet when missing or stale).
+
+_DF_LABOURS_ALL = None
+
+
+def get_labours() -> pd.DataFrame:
+    """Deliveries per commune and year (summary_maternity_labours.csv), read once per process"""
+    global _DF_LABOURS_ALL
+    from backend.core.utils.data_utils import read_configs
+    if _DF_LABOURS_ALL is None:
+        with span("read_labours"):
+            _DF_LABOURS_ALL = pd.read_csv(read_configs("open_data")["labours"], low_memory=False)
+            set_attributes(rows=len(_DF_LABOURS_ALL))
+    return _DF_LABOURS_ALL
+
+
+def get_Regions(df_instance: pd.DataFrame) -> tuple[list[Region], np.ndarray]:
+    """Creates `Region` instance using public data on French communes (Commune code and coordinates).
+    Also returns the affinities ``w_rh'' (communes x facilities, facilities in the order of `df_instance`)"""
+    from backend.core.mappers.datasets_mappers.communes_geo import get_communes
+    df_labours = get_labours()[get_labours()["dep_code"].isin(df_instance["dep_code"])]
+    communes = get_communes()
+    indices = communes.indices(df_labours["comm_code"].astype(str))
+    df_geo_comms = communes.to_geodataframe(indices)
+    with span("affinities", R=len(df_geo_comms), H=len(df_instance)):
+        w_rh = _get_affinities(df_instance, df_geo_comms, indices)
+    list_regions = [Region(region_id=c_id, coordinates=coordinates)
+                    for c_id, coordinates in zip(df_geo_comms["code"], communes.centroids_wgs84[indices].tolist())]
+    return list_regions, w_rh
 
 
 def get_Facilities(df_instance : pd.DataFrame, max_transferable_in : int = 10, max_transferable_out : int = 1) -> list[Facility]:
@@ -62,7 +48,7 @@ def get_Facilities(df_instance : pd.DataFrame, max_transferable_in : int = 10, m
             facility_name = str(row['facility_name']),
             region = row['comm_name'],
             coordinates = list(row['coords']), 
-            resources_capacity = {"cap" : int(row['beds'] * 365)},
+            resources_capacity = {"cap" : _get_bed_days(row['beds'])},
             max_transferable_in = {"cap": max_transferable_in},
             max_transferable_out = {"cap": max_transferable_out},
             linked_facilities = linked_facilities_dict[row['nofinesset']],
@@ -70,6 +56,16 @@ def get_Facilities(df_instance : pd.DataFrame, max_transferable_in : int = 10, m
     list_facilities = df_instance.apply(row_to_facility, axis=1).tolist()
     return list_facilities
 
+def _get_bed_days(beds) -> int:
+    """Yearly capacity in bed/days of a facility with `beds` beds"""
+    return int(beds * 365)
+
+
+def get_capacities(df_instance : pd.DataFrame) -> list[list[int]]:
+    """Returns ``m_hl'' (bed/days per facility) in the order of `get_Facilities`"""
+    return [[_get_bed_days(beds)] for beds in df_instance["beds"]]
+
+
 def _get_available_pathways(f_type):
     """Returns available pathways for each facility ``type''"""
     pathways_dict = {"1": ["p1"], "2a": ["p1", "p2a"], "2b" :["p1", "p2b"], "3": ["p1", "p2a", "p2b", "p3"]}
@@ -101,7 +97,7 @@ def get_demand_lower_bounds(df_instance : pd.DataFrame) -> list[list[float]]:
     from backend.core.utils.data_utils import read_configs
     config = read_configs("data_maternity")
     labour_types_distribution =  config["labour_types_distribution"]
-    df_labours = DF_LABOURS_ALL[DF_LABOURS_ALL["dep_code"].isin(df_instance["dep_code"])]
+    df_labours = get_labours()[get_labours()["dep_code"].isin(df_instance["dep_code"])]
     df_labours = df_labours.drop(columns=["region_code"])
     df_comm_avg = (df_labours
         .groupby(["comm_code"], as_index=False)
@@ -149,49 +145,74 @@ def get_PatientPathways(df_instance : pd.DataFrame) -> list[Pathway]:
     return pathways
 
     
-def _get_affinities(df_instance: pd.DataFrame, df_geo_comms: gpd.GeoDataFrame):
-    """ Returns {facility_id: {community_id: score}} where score is 1/Euclidian distance"""
-    from shapely.geometry import Point
-    import geopandas as gpd
-    distances = np.zeros((len(df_instance), len(df_geo_comms)))
-    facilities_points = gpd.GeoSeries([Point(c) for c in df_instance["coords"]], crs="EPSG:4326").to_crs(df_geo_comms.crs)
-    for i, comm_geometry in enumerate(df_geo_comms.geometry):
-        distances[:, i] = facilities_points.distance(comm_geometry)
-    scores = 1 / np.where(distances == 0, 100, distances)
-    affinities_dict = {comm_id: dict(zip(df_instance["nofinesset"].tolist(), scores[:, i])) \
-                       for i, comm_id in enumerate(df_geo_comms["code"].tolist())}
-    return affinities_dict
+def _get_affinities(df_instance: pd.DataFrame, df_geo_comms: gpd.GeoDataFrame, indices: np.ndarray | None = None) -> np.ndarray:
+    """ Returns the (communes x facilities) scores 1/Euclidian distance between each commune polygon and facility
+    (100 m when the facility is inside the commune). With the `indices` of the communes in the communes artifact,
+    the distances are read from the national distance store when it is built, the other facilities are computed"""
+    from backend.core.mappers.datasets_mappers.distance_store import get_distance_store
+    store = get_distance_store() if indices is not None else None
+    if store is None:
+        distances = _get_distances(df_instance, df_geo_comms)
+    else:
+        distances, missing = store.lookup(indices, df_instance["nofinesset"], df_instance["coords"])
+        if missing.any():
+            distances[:, missing] = _get_distances(df_instance[missing], df_geo_comms)
+        set_attributes(stored=int((~missing).sum()))
+    return 1 / np.where(distances == 0, 100, distances)
+
+
+def _get_distances(df_instance: pd.DataFrame, df_geo_comms: gpd.GeoDataFrame) -> np.ndarray:
+    """(communes x facilities) distances between the commune polygons and the facilities, in one vectorized pass"""
+    import shapely
+    from backend.core.mappers.datasets_mappers.distance_store import facility_points
+    facilities_points = facility_points(df_instance["coords"], df_geo_comms.crs)
+    return shapely.distance(np.asarray(df_geo_comms.geometry)[:, None], np.asarray(facilities_points)[None, :])
 
 
 def serialize_maternite(df_instance : pd.DataFrame) -> Union[dict, dict]:
     """Serialize maternite objects into dictionaries (params_system.json; params_metadata.json)"""
     from backend.core.mappers.input_mappers import convert_dm_to_json
     from backend.core.data_models.input_models import SystemData
-    import time
-    print("Init regions computations")
-    start = time.time()
-    list_regions = get_Regions(df_instance)
-    end = time.time()
-    print("\n\n\n\nElapsed time:", end - start, "seconds")
+    with span("regions"):
+        list_regions, w_rh = get_Regions(df_instance)
+        set_attributes(R=len(list_regions))
 
-    list_facilities = get_Facilities(df_instance)
-    list_resources = get_Resources(df_instance)
-    list_patients = get_PatientGroups(df_instance)
-    list_pathways = get_PatientPathways(df_instance)
-    list_activities = get_Activities(df_instance)
-    instance = get_Instance(df_instance)
-    maternite_data = SystemData(regions = list_regions, resources=list_resources, facilities=list_facilities, patients=list_patients ,\
-               pathways=list_pathways, activities= list_activities, instance=instance)
-    params_system, params_metadata = convert_dm_to_json(maternite_data)
+    with span("data_models", H=len(df_instance)):
+        list_facilities = get_Facilities(df_instance)
+        list_resources = get_Resources(df_instance)
+        list_patients = get_PatientGroups(df_instance)
+        list_pathways = get_PatientPathways(df_instance)
+        list_activities = get_Activities(df_instance)
+        instance = get_Instance(df_instance)
+        maternite_data = SystemData(regions = list_regions, resources=list_resources, facilities=list_facilities, patients=list_patients ,\
+                   pathways=list_pathways, activities= list_activities, instance=instance)
+    with span("convert_dm_to_json"):
+        params_system, params_metadata = convert_dm_to_json(maternite_data, {"w_rh": w_rh.tolist()})
     return params_system, params_metadata
 
 
 
-def read_maternity() -> pd.DataFrame:
+def serialize_maternite_facilities(df_instance : pd.DataFrame) -> tuple[dict, dict]:
+    """Facility part of `serialize_maternite`: (params_system with H, O_gk, J_h, b_hl_in, b_hl_out, m_hl and D,
+    params_metadata["facilities"]), to update a serialized instance whose departments (hence regions) did not change"""
+    from backend.core.mappers.input_mappers import create_json_from_facilities, create_json_from_pathways, create_json_from_patients
+    from backend.core.utils.data_utils import create_metadata
+    list_facilities = get_Facilities(df_instance)
+    list_patients = get_PatientGroups(df_instance)
+    params_system = create_json_from_patients(list_patients, {})
+    params_system = create_json_from_pathways(get_PatientPathways(df_instance), params_system)
+    params_system = create_json_from_facilities(list_facilities, params_system)
+    keys = ("H", "O_gk", "J_h", "b_hl_in", "b_hl_out", "m_hl")
+    params_system = {key: params_system[key] for key in keys} | {"D": [int(df_instance["deliveries_per_facility"].sum())]}
+    return params_system, create_metadata(list_facilities, [], list_patients)["facilities"]
+
+
+def read_maternity(filepath: str | None = None) -> pd.DataFrame:
     """Create Dataframe from summary_maternity_capacity.csv. We average the number of deliveries per facility across the years
     and take the latest number of beds recorded"""
     import ast 
-    df = pd.read_csv("backend/data/open_data/summary_maternity_capacity.csv")
+    from backend.core.utils.data_utils import read_configs
+    df = pd.read_csv(filepath or read_configs("open_data")["maternities"])
     df.loc[df["comm_code"] == "85166", "comm_code"] = "85194" # update the commune code of Olonne-sur-Mer
     df["coords"] = df["coords"].apply(ast.literal_eval)
     df.sort_values(by=["year"], ascending=False, inplace=True)
@@ -202,4 +223,40 @@ def read_maternity() -> pd.DataFrame:
     .agg(deliveries_per_facility=("deliveries_per_facility", "mean"),
         beds=("beds", "first")))
     df = df.drop_duplicates(subset=["nofinesset"], keep="first")
-    return df
\ No newline at end of file
+    return df
+
+
+class MaternityDataset:
+    """`read_maternity()` kept in memory, with the row positions of every region, department and
+    (region, department) pair. `subset` returns a new DataFrame that callers may modify freely"""
+
+    def __init__(self, filepath: str):
+        import os
+        self.filepath = filepath
+        self.mtime_ns = os.stat(filepath).st_mtime_ns
+        self.df = read_maternity(filepath)
+        self.index = {(None, None): np.arange(len(self.df))}
+        self.index.update({(region, None): positions for region, positions in self.df.groupby("region_name").indices.items()})
+        self.index.update({(None, department): positions for department, positions in self.df.groupby("dep_name").indices.items()})
+        self.index.update(self.df.groupby(["region_name", "dep_name"]).indices)
+
+    def subset(self, region: str | None = None, department: str | None = None) -> pd.DataFrame:
+        """Maternities of `region` and / or `department` (all when both are None), in the order of the file"""
+        positions = self.index.get((region or None, department or None), np.array([], dtype=int))
+        return self.df.take(positions)
+
+
+_MATERNITY_DATASET = None
+
+
+def get_maternity_dataset() -> MaternityDataset:
+    """Process-wide `MaternityDataset`, reloaded when the maternities file changes"""
+    global _MATERNITY_DATASET
+    import os
+    from backend.core.utils.data_utils import read_configs
+    filepath = read_configs("open_data")["maternities"]
+    if _MATERNITY_DATASET is None or _MATERNITY_DATASET.filepath != filepath or \
+            _MATERNITY_DATASET.mtime_ns != os.stat(filepath).st_mtime_ns:
+        with span("read_maternity"):
+            _MATERNITY_DATASET = MaternityDataset(filepath)
+    return _MATERNITY_DATASET
@@ -2,11 +2,9 @@ import numpy as np
 
 def create_facilityStats(results: dict, params_system: dict, params_metadata: dict, by_region: bool = False,
                          by_group: bool = False,  by_pathway: bool = False, ) -> list:
-    """Creates list of  FacilityStats instances, either total per facility or per facility per region."""
-    from backend.core.data_models.output_models import FacilityStats
-    
-    list_facilities_loads = []
-    
+    """Creates the GeoJSON features of FacilityStats, either total per facility or per facility per region."""
+    from backend.core.data_models.output_models import FacilityStats, geojson_features
+
     Delta_plus = results["Delta_plus"]
     Delta_moins = results["Delta_moins"]
     facilities = Delta_plus.facility.values
@@ -23,34 +21,34 @@ def create_facilityStats(results: dict, params_system: dict, params_metadata: di
     Delta_moins_index = {(f,r): delta_moins_values[i, j]
                    for i, f in enumerate(facilities)
                    for j, r in enumerate(resources)}
-    
-    capacity_cache = {str(h): calculate_facility_capacity(params_system, h) for h in params_system["H"]}
-    transfers_in_cache = {str(h): get_transfers_in(h, Delta_plus_index, params_system) for h in params_system["H"]}
-    transfers_out_cache = {str(h): get_transfers_out(h, Delta_moins_index, params_system) for h in params_system["H"]}
 
-    list_facilities_loads = []
-    
-    for row in df_loads.itertuples(index=False):
-        h = row.facility.split("_")[1]
-        g = getattr(row, "group", None)
-        k = getattr(row, "pathway", None)
-        r = getattr(row, "region", None)
-        if r: r=r.split("_")[1]
-        
-        facility_instance = FacilityStats(
-            facility_id=params_metadata["facilities"][h]["name"],
-            facility_type=None,
-            coordinates=params_metadata["facilities"][h]["coordinates"],
-            patient_group=g,
-            patient_pathway=k,
-            region_id=str(r),
-            load=row.load,
-            capacities=capacity_cache[h],
-            transfers_in=transfers_in_cache[h],
-            transfers_out=transfers_out_cache[h]
-        )
-        list_facilities_loads.append(facility_instance)
-    return list_facilities_loads
+    # One entry per facility, gathered for every row through the position of its facility label
+    H = params_system["H"]
+    metadata = [params_metadata["facilities"][str(h)] for h in H]
+    names = _object_array([m["name"] for m in metadata])
+    coordinates = _object_array([list(m["coordinates"]) for m in metadata])
+    capacities = _object_array([calculate_facility_capacity(params_system, h) for h in H])
+    transfers_in = _object_array([get_transfers_in(h, Delta_plus_index, params_system) for h in H])
+    transfers_out = _object_array([get_transfers_out(h, Delta_moins_index, params_system) for h in H])
+    h_idx = df_loads["facility"].map({f"facility_{h}": i for i, h in enumerate(H)}).to_numpy()
+
+    region_id = df_loads["region"].str.split("_").str[1].to_numpy() if "region" in df_loads else "None"
+    return geojson_features(FacilityStats, "Point", coordinates[h_idx].tolist(),
+                            facility_id=names[h_idx],
+                            patient_group=df_loads["group"].to_numpy() if "group" in df_loads else None,
+                            patient_pathway=df_loads["pathway"].to_numpy() if "pathway" in df_loads else None,
+                            region_id=region_id,
+                            load=df_loads["load"].to_numpy(dtype=float),
+                            capacities=capacities[h_idx],
+                            transfers_in=transfers_in[h_idx],
+                            transfers_out=transfers_out[h_idx])
+
+
+def _object_array(items: list) -> np.ndarray:
+    """1-d object array of `items` (lists and dicts are kept as elements)"""
+    array = np.empty(len(items), dtype=object)
+    array[:] = items
+    return array
 
 def _compute_load(results, by_region, by_group, by_pathway, params_system):
     P = results["P_gkrah"]
@@ -100,37 +98,72 @@ def calculate_facility_capacity(params_system, facility_id):
     return capacities
 
 
-def calculate_total_out(results:dict, h_id, params_system: dict) -> int:
-    """ Return the number of patients transfered from one facililty to another"""
-    h_id = "facility_" + str(h_id)
-    total_demand = params_system["D"][0]
-
-    perc_out = results["Q_gkrah"].sel(facility=h_id).sum(dim=["group", "pathway", "region", "activity"]).item()
-    perc_tot = results["P_gkrah"].sel(facility=h_id).sum(dim=["group", "pathway", "region", "activity"]).item() 
-
-    demand_h = total_demand * perc_tot    
-    total_out = demand_h * perc_out
-    
-    return total_out
-
-
-def create_patientTransfers(results: dict, params_system: dict, params_metadata : dict) -> list:
-    """ Returns a list of patientTransfer Instances """
-    from backend.core.data_models.output_models import PatientTransfer
-    list_patient_transfer = []
-    for h1 in params_system["H"]:
-        origin_coordinates = params_metadata["facilities"][str(h1)]["coordinates"]
-        allowed_transfers = params_system["J_h"][h1]
-        total_out = calculate_total_out(results, h1, params_system) 
-        transfers_distribution = total_out / len(allowed_transfers)
-
-        for h2 in allowed_transfers:
-            destination_coordinates = params_metadata["facilities"][str(h2)]["coordinates"]
-            instance_patientTransfer = PatientTransfer(patients_group_id = None,
-                                                       pathway_id = None,
-                                                       origin_coordinates = origin_coordinates,
-                                                       destination_coordinates = destination_coordinates,
-                                                       volume = transfers_distribution)
-            
-            list_patient_transfer.append(instance_patientTransfer) 
-    return list_patient_transfer
\ No newline at end of file
+def _nonzero_cells(result) -> tuple:
+    """(indices (ndim x nnz), values) of the non-zero cells of a `CooTensor` or a DataArray, NaN as 0"""
+    from backend.core.utils.result_tensors import CooTensor
+    if isinstance(result, CooTensor):
+        return result.indices.astype(np.int64), np.nan_to_num(result.data.astype(float))
+    values = np.nan_to_num(np.asarray(result.values, dtype=float))
+    indices = np.array(np.nonzero(values), dtype=np.int64).reshape(values.ndim, -1)
+    return indices, values[tuple(indices)]
+
+
+def transfer_flows(results: dict, params_system: dict) -> np.ndarray:
+    """H x H matrix of the patients moved from facility h to facility h' between consecutive activities.
+    Between activities a and a+1 a facility sends out the decrease of P_{g,k,r,a,h} (the J_h constraints), spread over
+    the facilities h' in J_h proportionally to the increase of P_{g,k,r,a+1,h'} (evenly when none increases).
+    Q_gkrah is only bounded from below by the decrease, and only on the N_gka pairs, so the P differences are used.
+    Only the non-zero cells of P_gkrah are read (the coordinates of a `CooTensor`), the tensor is never densified"""
+    nG, nK, nR, nA, nH = results["P_gkrah"].shape
+    J = np.zeros((nH, nH))
+    for h, J2_h in enumerate(params_system["J_h"]):
+        J[h, J2_h] = 1.0
+    if nA < 2 or not J.any():
+        return np.zeros((nH, nH))
+
+    # P_{g,k,r,a,h} enters the difference of the pair (a, a+1) with +1 and the one of (a-1, a) with -1, on the pairs
+    # of existing activities (the tensors being padded up to max A_gk)
+    (g, k, r, a, h), values = _nonzero_cells(results["P_gkrah"])
+    A_gk = np.array([list(A_g) + [0] * (nK - len(A_g)) for A_g in params_system["A_gk"]])[:, :nK]
+    first, second = a + 1 < A_gk[g, k], (a >= 1) & (a < A_gk[g, k])
+    pairs = np.ravel_multi_index((np.concatenate([g[first], g[second]]), np.concatenate([k[first], k[second]]),
+                                  np.concatenate([r[first], r[second]]), np.concatenate([a[first], a[second] - 1])),
+                                 (nG, nK, nR, nA - 1))
+    cells, inverse = np.unique(pairs * nH + np.concatenate([h[first], h[second]]), return_inverse=True)
+    moves = np.bincount(inverse, weights=np.concatenate([values[first], -values[second]]), minlength=len(cells))
+    move, facility = np.divmod(cells, nH)  # sorted by move
+
+    # Departures joined with the arrivals of the same move, kept when the arrival is in J_h of the departure
+    out, arrival = moves > 0, moves < 0
+    out_move, out_h, out_value = move[out], facility[out], moves[out]
+    arrival_move, arrival_h, arrival_value = move[arrival], facility[arrival], -moves[arrival]
+    starts = np.searchsorted(arrival_move, out_move, side="left")
+    counts = np.searchsorted(arrival_move, out_move, side="right") - starts
+    departures = np.repeat(np.arange(len(out_move)), counts)
+    arrivals = starts[departures] + np.arange(len(departures)) - np.repeat(np.cumsum(counts) - counts, counts)
+    linked = J[out_h[departures], arrival_h[arrivals]] > 0
+    departures, arrivals = departures[linked], arrivals[linked]
+
+    reachable = np.bincount(departures, weights=arrival_value[arrivals], minlength=len(out_move))
+    flows = np.zeros((nH, nH))
+    np.add.at(flows, (out_h[departures], arrival_h[arrivals]),
+              out_value[departures] / reachable[departures] * arrival_value[arrivals])
+    unmatched = np.bincount(out_h[reachable == 0], weights=out_value[reachable == 0], minlength=nH)
+    n_links = np.maximum(J.sum(axis=1), 1)
+    flows += J * (unmatched / n_links)[:, None]
+    return params_system["D"][0] * flows
+
+
+def create_patientTransfers(results: dict, params_system: dict, params_metadata : dict,
+                            min_volume: float | None = None) -> list:
+    """ Returns the GeoJSON features of PatientTransfer, one per pair of facilities with a flow above `min_volume`
+    patients (`results.min_transfer_volume` of config.yaml when None) """
+    from backend.core.data_models.output_models import PatientTransfer, geojson_features
+    if min_volume is None:
+        from backend.core.utils.data_utils import read_configs
+        min_volume = (read_configs("results") or {}).get("min_transfer_volume", 0.0)
+    flows = transfer_flows(results, params_system)
+    h1, h2 = np.nonzero(flows > max(min_volume, 0.0))
+    coordinates = [list(params_metadata["facilities"][str(h)]["coordinates"]) for h in params_system["H"]]
+    return geojson_features(PatientTransfer, "LineString", [[coordinates[o], coordinates[d]] for o, d in zip(h1, h2)],
+                            volume=flows[h1, h2])
@@ -0,0 +1,104 @@
+import numpy as np
+
+##############################################
+### AGGREGATION OF REGIONS (COMMUNES)      ###
+##############################################
+
+# Every P/Q variable and every d_gr row is indexed by r. For the maternity dataset a region is a commune,
+# so R reaches thousands. `aggregate_regions` drops the regions without demand (their P_gkr are fixed to 0)
+# and groups the others into `n_regions` super-regions with a demand-weighted k-means on the coordinates.
+# A super-region gets the summed demand and the demand-weighted mean affinity of its communes: the model
+# then assumes that the patients of a super-region are spread over its communes in proportion to demand.
+# `disaggregate_results` maps a solution back onto the original regions with that same assumption.
+
+
+def _weighted_kmeans(points: np.ndarray, weights: np.ndarray, n_clusters: int, n_iter: int = 100,
+                     seed: int = 0) -> np.ndarray:
+    """Returns the cluster (0..n-1, no empty cluster) of every point. k-means++ seeding, Lloyd iterations"""
+    rng = np.random.default_rng(seed)
+    centers = points[[rng.choice(len(points), p=weights / weights.sum())]]
+    for _ in range(1, n_clusters):
+        d2 = ((points[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2).min(axis=1)
+        p = weights * d2
+        if p.sum() == 0:
+            break
+        centers = np.vstack([centers, points[rng.choice(len(points), p=p / p.sum())]])
+
+    labels = np.zeros(len(points), dtype=np.int64)
+    for _ in range(n_iter):
+        labels = ((points[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2).argmin(axis=1)
+        totals = np.bincount(labels, weights=weights, minlength=len(centers))
+        sums = np.zeros_like(centers)
+        np.add.at(sums, labels, points * weights[:, None])
+        new_centers = np.where(totals[:, None] > 0, sums / np.where(totals > 0, totals, 1)[:, None], centers)
+        if np.allclose(new_centers, centers):
+            break
+        centers = new_centers
+    return np.unique(labels, return_inverse=True)[1]
+
+
+def aggregate_regions(params_system: dict, params_metadata: dict, n_regions: int | None) -> tuple[dict, dict]:
+    """Returns (params_system, params_metadata) with at most `n_regions` super-regions and without zero-demand regions.
+    The original regions and the mapping are kept in params_metadata["aggregation"] for `disaggregate_results`"""
+    d_gr = np.asarray(params_system["d_gr"], dtype=float)
+    w_rh = np.asarray(params_system["w_rh"], dtype=float)
+    demand = d_gr.sum(axis=0)
+    kept = np.flatnonzero(demand > 0)
+
+    coordinates = np.asarray([params_metadata["regions"][str(r)]["coordinates"] for r in kept], dtype=float).reshape(-1, 2)
+    if n_regions is None or n_regions >= len(kept):
+        labels_kept = np.arange(len(kept))
+    else:
+        # lon/lat to locally isotropic coordinates
+        points = coordinates * np.array([np.cos(np.radians(coordinates[:, 1].mean())), 1.0])
+        labels_kept = _weighted_kmeans(points, demand[kept], max(n_regions, 1))
+    n_super = int(labels_kept.max(initial=-1)) + 1
+
+    labels = np.full(len(demand), -1, dtype=np.int64)
+    labels[kept] = labels_kept
+    demand_super = np.bincount(labels_kept, weights=demand[kept], minlength=n_super)
+    shares = np.zeros(len(demand))
+    shares[kept] = demand[kept] / demand_super[labels_kept]
+
+    one_hot = np.zeros((n_super, len(demand)))
+    one_hot[labels[kept], kept] = 1.0
+    d_gr_super = d_gr @ one_hot.T
+    w_rh_super = (one_hot * shares) @ w_rh
+    coordinates_super = (one_hot[:, kept] * shares[kept]) @ coordinates
+
+    params_system = {**params_system, "R": list(range(n_super)), "d_gr": d_gr_super.tolist(), "w_rh": w_rh_super.tolist()}
+    regions = {str(i): {"coordinates": coordinates_super[i].tolist(),
+                        "name": "+".join(params_metadata["regions"][str(r)]["name"] for r in kept[labels_kept == i])}
+               for i in range(n_super)}
+    aggregation = {"labels": labels.tolist(), "shares": shares.tolist(), "regions": params_metadata["regions"],
+                   "d_gr": d_gr.tolist(), "w_rh": w_rh.tolist()}
+    params_metadata = {**params_metadata, "regions": regions, "aggregation": aggregation}
+    return params_system, params_metadata
+
+
+def disaggregate_results(results: dict, params_system: dict, params_metadata: dict) -> tuple[dict, dict, dict]:
+    """Maps the xarray results of an aggregated model back onto the original regions (P_r = share_r * P_R).
+    Returns (results, params_system, params_metadata) of the original regions, unchanged when there was no aggregation"""
+    import xarray as xr
+    from backend.core.utils.result_tensors import CooTensor
+
+    aggregation = params_metadata.get("aggregation")
+    if aggregation is None:
+        return results, params_system, params_metadata
+
+    labels = np.asarray(aggregation["labels"])
+    shares = xr.DataArray(np.asarray(aggregation["shares"]), dims=["region"])
+    regions = [f"region_{r}" for r in range(len(labels))]
+
+    results = dict(results)
+    for name, result in results.items():
+        if isinstance(result, CooTensor):
+            results[name] = result.expand("region", labels, aggregation["shares"], regions)
+        elif "region" in result.dims:
+            expanded = result.isel(region=np.maximum(labels, 0)) * shares
+            results[name] = expanded.assign_coords(region=regions).rename(result.name)
+
+    params_system = {**params_system, "R": list(range(len(labels))), "d_gr": aggregation["d_gr"], "w_rh": aggregation["w_rh"]}
+    params_metadata = {key: value for key, value in params_metadata.items() if key != "aggregation"}
+    params_metadata["regions"] = aggregation["regions"]
+    return results, params_system, params_metadata
@@ -0,0 +1,122 @@
+import hashlib
+import json
+import threading
+import numpy as np
+from collections import OrderedDict
+from backend.core.assembly import ModelArrays, STRUCTURAL_BLOCKS, assemble_model
+
+##############################################
+### MODEL TEMPLATES KEYED BY STRUCTURE     ###
+##############################################
+
+# Two params_system with the same index sets (same G, K_g, A_gk, O_gk, J_h, N_gka_*, R, H, L) give the
+# same columns and the same structural blocks (see `STRUCTURAL_BLOCKS`), J_h and Q_gkrah being most of
+# the matrix. A `ModelTemplate` keeps these compressed blocks; a new params_system with the same
+# fingerprint only rebuilds the blocks carrying numeric data (d_gr, q, f, t_gkal, delta_l, m_hl, b_hl),
+# the row bounds and the objective.
+
+STRUCTURE_KEYS = ("G", "K_g", "A_gk", "O_gk", "J_h", "N_gka_1", "N_gka_2", "R", "H", "L")
+
+
+def structure_key(params_system: dict, sparse: bool = True) -> str:
+    """Fingerprint of the index sets of `params_system`"""
+    content = json.dumps([params_system[key] for key in STRUCTURE_KEYS] + [sparse], default=str)
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+class ModelTemplate:
+    """Structural blocks of an assembled model, shared by every params_system with the same index sets"""
+
+    def __init__(self, model: ModelArrays, sparse: bool = True):
+        self.sparse = sparse
+        self.blocks = {}
+        for name in STRUCTURAL_BLOCKS:
+            if name not in model.row_blocks:
+                continue
+            start, end = model.row_blocks[name]
+            a0, a1 = model.a_start[start], model.a_start[end]
+            self.blocks[name] = (np.diff(model.a_start[start:end + 1]), model.a_index[a0:a1].copy(),
+                                 model.a_value[a0:a1].copy(), model.row_lower[start:end].copy(),
+                                 model.row_upper[start:end].copy())
+
+    @property
+    def nbytes(self) -> int:
+        return sum(array.nbytes for block in self.blocks.values() for array in block)
+
+    def instantiate(self, params_system: dict, lazy_blocks: tuple = ()) -> ModelArrays:
+        """Assembles the model of `params_system`, copying the structural blocks"""
+        return assemble_model(params_system, sparse=self.sparse, cached_blocks=self.blocks, lazy_blocks=lazy_blocks)
+
+
+class TemplateCache:
+    """LRU of `ModelTemplate` bounded by memory size, with hit/miss counters"""
+
+    def __init__(self, max_bytes: int = 256 * 2**20):
+        self.max_bytes = max_bytes
+        self.templates = OrderedDict()
+        self.nbytes = 0
+        self.hits, self.misses, self.evictions = 0, 0, 0
+        self.lock = threading.Lock()
+
+    def get(self, key: str) -> ModelTemplate | None:
+        with self.lock:
+            template = self.templates.get(key)
+            if template is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.templates.move_to_end(key)
+            return template
+
+    def put(self, key: str, template: ModelTemplate):
+        if template.nbytes > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.templates:
+                self.nbytes -= self.templates.pop(key).nbytes
+            self.templates[key] = template
+            self.nbytes += template.nbytes
+            while self.nbytes > self.max_bytes:
+                _, evicted = self.templates.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+                self.evictions += 1
+
+    def get_model(self, params_system: dict, sparse: bool = True, lazy_blocks: tuple = ()) -> ModelArrays:
+        """Returns the model of `params_system`, built from the template of its structure when there is one"""
+        key = structure_key(params_system, sparse)
+        template = self.get(key)
+        if template is not None:
+            return template.instantiate(params_system, lazy_blocks)
+        model = assemble_model(params_system, sparse=sparse, lazy_blocks=lazy_blocks)
+        self.put(key, ModelTemplate(model, sparse))
+        return model
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "hit_rate": self.hits / lookups if lookups else None,
+                    "templates": len(self.templates), "nbytes": self.nbytes, "max_bytes": self.max_bytes}
+
+
+_TEMPLATE_CACHE = None
+
+
+def get_template_cache() -> TemplateCache | None:
+    """Returns the process-wide template cache (None when disabled in config.yaml)"""
+    global _TEMPLATE_CACHE
+    from backend.core.utils.data_utils import read_configs
+    if _TEMPLATE_CACHE is None:
+        max_mb = (read_configs("model_cache") or {}).get("max_mb", 0)
+        if max_mb <= 0:
+            return None
+        _TEMPLATE_CACHE = TemplateCache(max_bytes=int(max_mb * 2**20))
+    return _TEMPLATE_CACHE
+
+
+def build_model(params_system: dict, sparse: bool = True, lazy_blocks: tuple = ()) -> ModelArrays:
+    """`assemble_model` going through the template cache"""
+    cache = get_template_cache()
+    if cache is None:
+        return assemble_model(params_system, sparse=sparse, lazy_blocks=lazy_blocks)
+    return cache.get_model(params_system, sparse=sparse, lazy_blocks=lazy_blocks)
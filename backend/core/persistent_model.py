@@ -0,0 +1,162 @@
+import threading
+import numpy as np
+from collections import OrderedDict
+from backend.core.assembly import objective_costs
+from backend.core.highs_solver import DEFAULT_OPTIONS, create_highs, read_result, relax_and_round, relative_gap, solve_options
+from backend.core.model_cache import build_model
+from backend.core.utils.metrics import record_model, record_solve
+from backend.core.utils.result_tensors import SPARSE_RESULTS, compact_results, get_results_storage
+from backend.core.utils.tracing import span
+
+##################################################
+### PERSISTENT MODEL WITH INCREMENTAL RE-SOLVE ###
+##################################################
+
+# A `PersistentModel` keeps the assembled arrays and the `highspy.Highs` instance of one scenario alive.
+# When only b_hl_out (transfers slider), m_hl (bed capacities) or alpha change, the model is not rebuilt:
+# the right-hand sides of the affected rows (or the objective) are edited in place and HiGHS re-solves
+# from its current basis (LP) or from the previous incumbent (MIP).
+
+
+class PersistentModel:
+    """Assembled model + live HiGHS instances (MIP and, on demand, its LP relaxation) accepting RHS edits on m_hl and b_hl_out"""
+
+    def __init__(self, params_system: dict, params_metadata: dict | None = None, msg: bool = False,
+                 options: dict | None = None):
+        from backend.core.main import normalize_params_system
+        self.params_system = normalize_params_system(params_system)
+        self.params_metadata = params_metadata
+        self.msg, self.options = msg, options
+        with span("build", engine="arrays", R=len(self.params_system["R"]), H=len(self.params_system["H"])) as current:
+            self.model = build_model(self.params_system)
+            current.set(n_vars=self.model.n_cols, n_rows=self.model.n_rows, nnz=self.model.nnz)
+        record_model("arrays", self.model.n_cols, self.model.n_rows, self.model.nnz)
+        self.instances = {}  # solve mode: highspy.Highs
+        self.limits = {}  # time_limit / mip_rel_gap of the current solve
+        self.result = None
+        self.n_solves = 0
+        self.lock = threading.RLock()
+
+    def _get_highs(self, mode: str):
+        if mode not in self.instances:
+            self.instances[mode] = create_highs(self.model, msg=self.msg, options={**(self.options or {}), **self.limits},
+                                                relax=(mode == "relaxed"))
+        return self.instances[mode]
+
+    def _set_limits(self, time_limit: float | None, mip_gap: float | None):
+        """Deadline and gap of the next solve on every instance (the options of the model when None)"""
+        limits = {"time_limit": float("inf"), "mip_rel_gap": 1e-4, **DEFAULT_OPTIONS, **(self.options or {})}
+        limits = {name: value for name, value in limits.items() if name in ("time_limit", "mip_rel_gap")}
+        limits.update(solve_options(time_limit, mip_gap))
+        self.limits = limits
+        for h in self.instances.values():
+            for name, value in limits.items():
+                h.setOptionValue(name, value)
+
+    def _change_row_upper(self, block: str, upper: np.ndarray):
+        start, end = self.model.row_blocks[block]
+        rows = np.arange(start, end, dtype=np.int32)
+        self.model.row_upper[start:end] = upper
+        for h in self.instances.values():
+            h.changeRowsBounds(len(rows), rows, self.model.row_lower[start:end], self.model.row_upper[start:end])
+
+    def update(self, b_hl_out: list | None = None, m_hl: list | None = None, alpha: float | None = None):
+        """Changes the transfer upper bounds, the capacities and/or alpha. Only row bounds and costs are modified"""
+        s = self.model.sets
+        if alpha is not None:
+            self.params_system["alpha"] = [alpha]
+            self.model.col_cost = objective_costs(self.model, alpha)
+            for h in self.instances.values():
+                h.changeColsCost(self.model.n_cols, np.arange(self.model.n_cols, dtype=np.int32), self.model.col_cost)
+        if b_hl_out is not None:
+            self.params_system["b_hl_out"] = b_hl_out
+            s["b_hl_out"] = np.asarray(b_hl_out, dtype=float).reshape(s["nH"], s["nL"])
+        if m_hl is not None:
+            self.params_system["m_hl"] = m_hl
+            s["m_hl"] = np.asarray(m_hl, dtype=float).reshape(s["nH"], s["nL"])
+            self._change_row_upper("m_hl_2", s["m_hl"].ravel())
+            self._change_row_upper("delta_plus_b_hl_in", (s["b_hl_in"] * s["m_hl"]).ravel())
+        if b_hl_out is not None or m_hl is not None:
+            self._change_row_upper("delta_moins_b_hl_out", (s["b_hl_out"] * s["m_hl"]).ravel())
+
+    def _solve_exact(self):
+        import highspy
+
+        h = self._get_highs("exact")
+        if self.result is not None and self.result.objective is not None and self.model.integrality.any():
+            # Previous incumbent as starting point, ignored by HiGHS when it became infeasible
+            start = highspy.HighsSolution()
+            start.col_value = self.result.col_value
+            start.value_valid = True
+            h.setSolution(start)
+        h.run()
+        return read_result(h)
+
+    def _solve_relaxed(self):
+        result = relax_and_round(self._get_highs("relaxed"), self.model)
+        bound = result.info["relaxation_bound"]
+        if result.objective is None and bound is not None:
+            # Rounded transfers infeasible: exact MIP
+            result = self._solve_exact()
+            result.info.update(relaxation_bound=bound, rounding="mip",
+                               gap=relative_gap(bound, result.objective) if result.objective is not None else None)
+        return result
+
+    def solve(self, mode: str = "exact", time_limit: float | None = None, mip_gap: float | None = None):
+        """Solves (or re-solves) the model. Returns (status, objective, dict_xarray_results) as `run_driver`.
+        mode="relaxed" solves the LP relaxation and rounds the z_hl (see `relax_and_round`).
+        `time_limit` (s) and `mip_gap` apply to this solve only, see `run_driver`"""
+        from backend.core.utils.data_utils import define_xarray
+
+        with self.lock, span("solve", solver="highs", mode=mode, persistent=True, n_solves=self.n_solves) as current:
+            self._set_limits(time_limit, mip_gap)
+            if mode == "exact":
+                self.result = self._solve_exact()
+            elif mode == "relaxed":
+                self.result = self._solve_relaxed()
+            else:
+                raise ValueError(f"Unknown solve mode '{mode}', expected 'exact' or 'relaxed'")
+            self.n_solves += 1
+        record_solve("arrays", mode, self.result.status, current.duration, self.result.info)
+
+        storage = get_results_storage()
+        with span("extract", **storage):
+            dict_results = self.model.unpack(self.result.col_value, sparse=SPARSE_RESULTS if storage["sparse"] else ())
+        with span("xarray"):
+            dict_xarray_results = compact_results(define_xarray(self.params_system, dict_results), **storage)
+        return self.result.status, self.result.objective, dict_xarray_results
+
+
+class ModelStore:
+    """Process-wide LRU of `PersistentModel` keyed by scenario"""
+
+    def __init__(self, max_models: int = 8):
+        self.max_models = max_models
+        self.models = OrderedDict()
+        self.hits, self.misses = 0, 0
+        self.lock = threading.Lock()
+
+    def get(self, key: str) -> PersistentModel | None:
+        with self.lock:
+            handle = self.models.get(key)
+            if handle is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.models.move_to_end(key)
+            return handle
+
+    def put(self, key: str, handle: PersistentModel):
+        with self.lock:
+            self.models[key] = handle
+            self.models.move_to_end(key)
+            while len(self.models) > self.max_models:
+                self.models.popitem(last=False)
+
+    def discard(self, key: str):
+        with self.lock:
+            self.models.pop(key, None)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "models": len(self.models), "max_models": self.max_models}
@@ -0,0 +1,41 @@
+import os
+import time
+
+##############################################
+### COOPERATIVE CANCELLATION OF SOLVES     ###
+##############################################
+
+# A solve running in a job worker is cancelled through a flag file: the API process creates it (`request_cancel`)
+# and the HiGHS interrupt callbacks of the worker (see `highs_solver.create_highs`) poll `cancel_requested`, at most
+# every CHECK_INTERVAL seconds. HiGHS then stops with its best incumbent and the solve reports "cancelled".
+
+CHECK_INTERVAL = 0.2
+
+_CANCEL_FILE = None
+_last_check, _cancelled = 0.0, False
+
+
+def set_cancel_file(path: str | None):
+    """Flag file of the solve running in this process (None: not cancellable)"""
+    global _CANCEL_FILE, _last_check, _cancelled
+    _CANCEL_FILE, _last_check, _cancelled = path, 0.0, False
+
+
+def cancellable() -> bool:
+    return _CANCEL_FILE is not None
+
+
+def cancel_requested() -> bool:
+    global _last_check, _cancelled
+    if _CANCEL_FILE is None or _cancelled:
+        return _cancelled
+    now = time.monotonic()
+    if now - _last_check >= CHECK_INTERVAL:
+        _last_check = now
+        _cancelled = os.path.exists(_CANCEL_FILE)
+    return _cancelled
+
+
+def request_cancel(path: str):
+    with open(path, "w"):
+        pass
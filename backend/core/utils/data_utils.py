@@ -1,4 +1,6 @@
 import pulp
+import numpy as np
+from itertools import chain
 from pathlib import Path
 import geopandas as gpd
 from backend.core.data_models.input_models import PatientsGroup, Facility, Region
@@ -22,17 +24,32 @@ def extract_values(obj):
         return pulp.value(obj)
 
 
+def extract_array(variables: dict, depth: int) -> np.ndarray:
+    """Values of the nested `LpVariable.dicts` `variables` (`depth` levels, built on full index lists) as one array.
+    Reads `varValue` in a single flat pass instead of one `pulp.value` call and one list per level; unsolved
+    variables give NaN"""
+    shape, level = [], variables
+    for _ in range(depth):
+        shape.append(len(level))
+        level = next(iter(level.values()), {})
+    flat = [variables]
+    for _ in range(depth):
+        flat = chain.from_iterable(d.values() for d in flat)
+    values = np.array([v.varValue for v in flat], dtype=float)
+    return values.reshape(shape)
+
+
 def package_results(P_gk, P_gkr, P, Q, Delta_plus, Delta_moins, z_hl_plus, z_hl_moins):
 
     dict_results = {
-        "P_gk": extract_values(P_gk),
-        "P_gkr": extract_values(P_gkr),
-        "P_gkrah": extract_values(P),
-        "Q_gkrah": extract_values(Q),
-        "Delta_plus": extract_values(Delta_plus),
-        "Delta_moins": extract_values(Delta_moins),
-        "z_hl_plus": extract_values(z_hl_plus),
-        "z_hl_moins": extract_values(z_hl_moins),
+        "P_gk": extract_array(P_gk, 2),
+        "P_gkr": extract_array(P_gkr, 3),
+        "P_gkrah": extract_array(P, 5),
+        "Q_gkrah": extract_array(Q, 5),
+        "Delta_plus": extract_array(Delta_plus, 2),
+        "Delta_moins": extract_array(Delta_moins, 2),
+        "z_hl_plus": extract_array(z_hl_plus, 2),
+        "z_hl_moins": extract_array(z_hl_moins, 2),
     }
 
     return dict_results
@@ -40,56 +57,65 @@ def package_results(P_gk, P_gkr, P, Q, Delta_plus, Delta_moins, z_hl_plus, z_hl_
 
 def define_xarray(params_system: dict, dict_results: dict) -> dict:
     """
-    Creates a dictionary of xarray items with variables inside dict_results
+    Creates a dictionary of xarray items with variables inside dict_results.
+    Float arrays (`package_results`, `ModelArrays.unpack`) are wrapped without copy, `CooTensor` values
+    (sparse P_gkrah / Q_gkrah) stay sparse and only get their dims and coords
     """
 
 
     import xarray as xr
-    import numpy as np
+    from backend.core.utils.result_tensors import CooTensor
+
+    def wrap(values, dims, coords, name):
+        if isinstance(values, CooTensor):
+            return CooTensor(values.indices, values.data, values.shape, dims, coords, name)
+        return xr.DataArray(values, dims=dims, coords=coords, name=name)
     
+    dict_results = {name: values if isinstance(values, CooTensor) else np.asarray(values, dtype=float)
+                    for name, values in dict_results.items()}
     groups = [f"group_{i}" for i in params_system["G"]]
-    pathways = [f"pathway_{i}" for i in range(np.array(params_system["A_gk"]).shape[1])]
+    pathways = [f"pathway_{i}" for i in range(dict_results["P_gkrah"].shape[1])]
     regions = [f"region_{i}" for i in params_system["R"]]
-    activities = [f"activity_{i}" for i in range(np.array(params_system["t_gkal"]).shape[2])]
+    activities = [f"activity_{i}" for i in range(dict_results["P_gkrah"].shape[3])]
     facilities = [f"facility_{i}" for i in params_system["H"]]
     resources = [f"resource_{i}" for i in params_system["L"]]
 
-    P_xr = xr.DataArray(np.array(dict_results["P_gkrah"], dtype=float),
+    P_xr = wrap(dict_results["P_gkrah"],
                         dims=["group", "pathway","region","activity","facility"],
                         coords={"group":groups,"pathway":pathways,"region":regions,"activity":activities,"facility":facilities},
                         name = "P")
     
-    P_gkr_xr = xr.DataArray(np.array(dict_results["P_gkr"], dtype=float),
+    P_gkr_xr = xr.DataArray(dict_results["P_gkr"],
                             dims=["group", "pathway","region"],
                             coords={"group":groups,"pathway":pathways,"region":regions},
                             name = "P_gkr")
     
-    P_gk_xr = xr.DataArray(np.array(dict_results["P_gk"], dtype=float),
+    P_gk_xr = xr.DataArray(dict_results["P_gk"],
                            dims=["group", "pathway"],
                            coords={"group":groups,"pathway":pathways},
                            name = "P_gk")    
     
-    Q_xr = xr.DataArray(np.array(dict_results["Q_gkrah"], dtype=float),
+    Q_xr = wrap(dict_results["Q_gkrah"],
                         dims=["group", "pathway","region","activity","facility"],
                         coords={"group":groups,"pathway":pathways,"region":regions,"activity":activities,"facility":facilities},
                         name = "Q")
     
-    Delta_plus_xr = xr.DataArray(np.array(dict_results["Delta_plus"], dtype=float),
+    Delta_plus_xr = xr.DataArray(dict_results["Delta_plus"],
                                 dims=["facility", "resource"],
                                 coords={"facility":facilities,"resource":resources},
                                 name = "Delta_plus")
     
-    Delta_moins_xr = xr.DataArray(np.array(dict_results["Delta_moins"], dtype=float),
+    Delta_moins_xr = xr.DataArray(dict_results["Delta_moins"],
                                   dims=["facility", "resource"],
                                   coords={"facility":facilities,"resource":resources},
                                   name = "Delta_moins")
     
-    z_hl_plus_xr = xr.DataArray(np.array(dict_results["z_hl_plus"], dtype=float),
+    z_hl_plus_xr = xr.DataArray(dict_results["z_hl_plus"],
                                 dims=["facility", "resource"],
                                 coords={"facility":facilities,"resource":resources},
                                 name = "z_hl_plus")
     
-    z_hl_moins_xr = xr.DataArray(np.array(dict_results["z_hl_moins"], dtype=float),
+    z_hl_moins_xr = xr.DataArray(dict_results["z_hl_moins"],
                                 dims=["facility", "resource"],
                                 coords={"facility":facilities,"resource":resources},
                                 name = "z_hl_moins") 
@@ -0,0 +1,237 @@
+import math
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+##############################################
+### PROMETHEUS METRICS (TEXT EXPOSITION)   ###
+##############################################
+
+# In-process counters, gauges and histograms rendered in the Prometheus text format (version 0.0.4) by the
+# /api/metrics route, without any client library or external service. Every metric is process-wide: with several
+# uvicorn workers each worker exposes its own values.
+# Solves run in the processes of the job queue (see `backend.api.jobs`), whose registries are never scraped. There,
+# `collect_records` keeps the record_model / record_solve calls, which the job returns with its result along with the
+# statistics of the worker caches; the API process replays the calls (`replay_records`) and adds the last statistics
+# of every worker (`set_worker_stats`) to its own in the cache gauges.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+SIZE_BUCKETS = tuple(10.0 ** e for e in range(2, 9))
+GAP_BUCKETS = (1e-6, 1e-5, 1e-4, 1e-3, 1e-2, 0.05, 0.1, 0.5)
+ITERATION_BUCKETS = tuple(10.0 ** e for e in range(1, 8))
+
+
+def _format_value(value: float) -> str:
+    value = float(value)
+    if value == math.inf:
+        return "+Inf"
+    return str(int(value)) if value.is_integer() and abs(value) < 1e15 else repr(value)
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for v in labels.values())
+    return "{" + ",".join(f'{k}="{v}"' for k, v in zip(labels, escaped)) + "}"
+
+
+class _Metric:
+    """Counters and gauges built with `function` (returning {label values: value}) are computed at scrape time"""
+    kind = None
+
+    def __init__(self, name: str, documentation: str, labels: tuple = (), function=None):
+        self.name, self.documentation, self.labels = name, documentation, tuple(labels)
+        self.values = OrderedDict()  # label values: value
+        self.function = function
+        self.lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labels):
+            raise ValueError(f"Metric '{self.name}' expects labels {self.labels}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def samples(self) -> list:
+        """[(suffix, labels, value)]"""
+        if self.function is not None:
+            return [("", dict(zip(self.labels, key)), value) for key, value in self.function().items() if value is not None]
+        with self.lock:
+            return [("", dict(zip(self.labels, key)), value) for key, value in self.values.items()]
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, labels, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self.lock:
+            counts, total = self.values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self.values[key] = (counts, total + value)
+
+    def samples(self) -> list:
+        samples = []
+        with self.lock:
+            for key, (counts, total) in self.values.items():
+                labels = dict(zip(self.labels, key))
+                for bound, count in zip(self.buckets, counts):
+                    samples.append(("_bucket", {**labels, "le": _format_value(bound)}, count))
+                samples.append(("_sum", labels, total))
+                samples.append(("_count", labels, counts[-1]))
+        return samples
+
+
+class Registry:
+    """Ordered set of metrics rendered together"""
+
+    def __init__(self):
+        self.metrics = OrderedDict()
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric '{metric.name}' already registered")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(line for metric in self.metrics.values() for line in metric.render()) + "\n"
+
+
+REGISTRY = Registry()
+
+##############################################
+### METRICS OF THE OPTIMIZATION SERVICE    ###
+##############################################
+
+REQUEST_LATENCY = REGISTRY.register(Histogram(
+    "safepaw_http_request_duration_seconds", "Latency of the API routes", ("route", "method", "status")))
+REQUESTS_IN_FLIGHT = REGISTRY.register(Gauge(
+    "safepaw_http_requests_in_flight", "API requests being processed", ("route",)))
+SOLVE_DURATION = REGISTRY.register(Histogram(
+    "safepaw_solve_duration_seconds", "Wall time of the solver calls", ("engine", "mode")))
+SOLVE_STATUS = REGISTRY.register(Counter(
+    "safepaw_solve_status_total", "Solver calls by returned status", ("engine", "status")))
+SOLVE_MIP_GAP = REGISTRY.register(Histogram(
+    "safepaw_solve_mip_gap", "Relative MIP gap of the solutions returned by HiGHS", ("mode",), GAP_BUCKETS))
+SOLVE_ITERATIONS = REGISTRY.register(Histogram(
+    "safepaw_solve_simplex_iterations", "Simplex iterations per HiGHS solve", ("mode",), ITERATION_BUCKETS))
+MODEL_SIZE = REGISTRY.register(Histogram(
+    "safepaw_model_size", "Size of the built models (dimension: columns, rows or nnz)", ("engine", "dimension"), SIZE_BUCKETS))
+
+
+_RECORDS = None  # [(recorder, args)] of the calls collected instead of recorded
+_WORKER_STATS = {}  # pid of a job worker: statistics of its caches reported with its last job
+
+
+@contextmanager
+def collect_records():
+    """Within the block, record_model / record_solve calls are appended to the yielded list instead of recorded"""
+    global _RECORDS
+    previous, _RECORDS = _RECORDS, []
+    try:
+        yield _RECORDS
+    finally:
+        _RECORDS = previous
+
+
+def replay_records(records: list):
+    """Records the calls collected by `collect_records` (in another process)"""
+    recorders = {"record_model": record_model, "record_solve": record_solve}
+    for recorder, args in records:
+        recorders[recorder](*args)
+
+
+def set_worker_stats(pid: int, stats: dict):
+    _WORKER_STATS[pid] = stats
+
+
+def worker_stats(name: str) -> list:
+    """Last `name` statistics reported by every job worker"""
+    return [stats[name] for stats in list(_WORKER_STATS.values()) if stats.get(name) is not None]
+
+
+def _template_cache_stats() -> dict:
+    """Template cache statistics of this process and of the job workers"""
+    from backend.core.model_cache import _TEMPLATE_CACHE
+    all_stats = ([_TEMPLATE_CACHE.stats()] if _TEMPLATE_CACHE is not None else []) + worker_stats("template_cache")
+    if not all_stats:
+        return {}
+    hits, misses = sum(stats["hits"] for stats in all_stats), sum(stats["misses"] for stats in all_stats)
+    return {"hits": hits, "misses": misses, "hit_rate": hits / (hits + misses) if hits + misses else None,
+            "nbytes": sum(stats["nbytes"] for stats in all_stats)}
+
+
+def _cache_lookups() -> dict:
+    stats = _template_cache_stats()
+    return {("hit",): stats.get("hits"), ("miss",): stats.get("misses")}
+
+
+REGISTRY.register(Counter("safepaw_model_template_cache_lookups_total", "Lookups of the model template cache",
+                          ("result",), function=_cache_lookups))
+REGISTRY.register(Gauge("safepaw_model_template_cache_hit_ratio", "Hit ratio of the model template cache",
+                        function=lambda: {(): _template_cache_stats().get("hit_rate")}))
+REGISTRY.register(Gauge("safepaw_model_template_cache_bytes", "Memory held by the model templates",
+                        function=lambda: {(): _template_cache_stats().get("nbytes")}))
+
+
+def record_model(engine: str, n_cols: int, n_rows: int, nnz: int | None = None):
+    if _RECORDS is not None:
+        _RECORDS.append(("record_model", (engine, n_cols, n_rows, nnz)))
+        return
+    MODEL_SIZE.observe(n_cols, engine=engine, dimension="columns")
+    MODEL_SIZE.observe(n_rows, engine=engine, dimension="rows")
+    if nnz is not None:
+        MODEL_SIZE.observe(nnz, engine=engine, dimension="nnz")
+
+
+def record_solve(engine: str, mode: str, status: str, seconds: float, info: dict | None = None):
+    """Solve time and status, MIP gap and simplex iterations when HiGHS reports them"""
+    info = info or {}
+    if _RECORDS is not None:
+        info = {key: info[key] for key in ("mip_gap", "simplex_iteration_count") if key in info}
+        _RECORDS.append(("record_solve", (engine, mode, status, seconds, info)))
+        return
+    SOLVE_DURATION.observe(seconds, engine=engine, mode=mode)
+    SOLVE_STATUS.inc(engine=engine, status=status)
+    gap = info.get("mip_gap")
+    if gap is not None and math.isfinite(gap):
+        SOLVE_MIP_GAP.observe(gap, mode=mode)
+    if info.get("simplex_iteration_count") is not None:
+        SOLVE_ITERATIONS.observe(info["simplex_iteration_count"], mode=mode)
@@ -0,0 +1,152 @@
+import numpy as np
+
+##############################################
+### SPARSE (COO) RESULT TENSORS            ###
+##############################################
+
+# P_gkrah and Q_gkrah are G x K x R x A x H tensors with few non-zero cells (a commune sends its patients to a
+# handful of facilities). `CooTensor` keeps only the non-zero cells (coordinates + values, float32 by default) and
+# offers the operations used on the results: `sum(dim=...)`, `sel(dim=label)`, `item()`, `to_dataframe()` (dense,
+# on the reduced tensor), `values` and `expand` for the disaggregation of super-regions.
+# Enabled by `results.sparse` in config.yaml, see `get_results_storage`.
+
+SPARSE_RESULTS = ("P_gkrah", "Q_gkrah")
+
+
+class CooTensor:
+    """N-d tensor stored as coordinates (ndim x nnz) and values, with xarray-like dims and coords"""
+
+    def __init__(self, indices: np.ndarray, data: np.ndarray, shape: tuple, dims: tuple | None = None,
+                 coords: dict | None = None, name: str | None = None):
+        self.data = np.asarray(data)
+        self.indices = np.asarray(indices, dtype=np.int32).reshape(len(shape), len(self.data))
+        self.shape = tuple(int(n) for n in shape)
+        self.dims = tuple(dims) if dims is not None else tuple(f"dim_{i}" for i in range(len(shape)))
+        self.coords = coords or {}
+        self.name = name
+
+    @classmethod
+    def from_flat(cls, positions: np.ndarray, values: np.ndarray, shape: tuple, dtype=np.float32, tol: float = 0.0,
+                  **kwargs) -> "CooTensor":
+        """From the flat (C order) positions of `values` in a tensor of `shape`, dropping |values| <= tol"""
+        values = np.asarray(values, dtype=float)
+        keep = np.abs(values) > tol
+        indices = np.array(np.unravel_index(np.asarray(positions)[keep], shape), dtype=np.int32).reshape(len(shape), -1)
+        return cls(indices, values[keep].astype(dtype), shape, **kwargs)
+
+    @classmethod
+    def from_dense(cls, array: np.ndarray, dtype=np.float32, tol: float = 0.0, **kwargs) -> "CooTensor":
+        array = np.asarray(array, dtype=float)
+        flat = array.ravel()
+        positions = np.flatnonzero(np.abs(flat) > tol)
+        return cls.from_flat(positions, flat[positions], array.shape, dtype=dtype, tol=tol, **kwargs)
+
+    @property
+    def nnz(self) -> int:
+        return len(self.data)
+
+    @property
+    def nbytes(self) -> int:
+        return self.indices.nbytes + self.data.nbytes
+
+    @property
+    def dtype(self):
+        return self.data.dtype
+
+    @property
+    def values(self) -> np.ndarray:
+        if self.shape == ():
+            return np.array(self.data.sum(), dtype=self.data.dtype)
+        dense = np.zeros(self.shape, dtype=self.data.dtype)
+        np.add.at(dense, tuple(self.indices), self.data)
+        return dense
+
+    def _like(self, indices, data, keep_axes) -> "CooTensor":
+        dims = tuple(self.dims[i] for i in keep_axes)
+        return CooTensor(indices, data, tuple(self.shape[i] for i in keep_axes), dims,
+                         {dim: self.coords[dim] for dim in dims if dim in self.coords}, self.name)
+
+    def astype(self, dtype) -> "CooTensor":
+        return CooTensor(self.indices, self.data.astype(dtype), self.shape, self.dims, self.coords, self.name)
+
+    def sum(self, dim=None) -> "CooTensor":
+        """Sum over `dim` (a name or a list of names, all dimensions when None). Duplicate cells are merged"""
+        summed = set(self.dims if dim is None else [dim] if isinstance(dim, str) else dim)
+        keep_axes = [i for i, d in enumerate(self.dims) if d not in summed]
+        shape = tuple(self.shape[i] for i in keep_axes)
+        if not keep_axes:
+            return CooTensor(np.zeros((0, 1)), np.array([self.data.sum(dtype=float)]), (), (), {}, self.name)
+        flat = np.ravel_multi_index(tuple(self.indices[keep_axes]), shape)
+        unique, inverse = np.unique(flat, return_inverse=True)
+        data = np.bincount(inverse, weights=self.data, minlength=len(unique)).astype(self.data.dtype)
+        return self._like(np.array(np.unravel_index(unique, shape)), data, keep_axes)
+
+    def sel(self, **indexers) -> "CooTensor":
+        """Selects one label per dimension (the dimension is dropped), as `DataArray.sel`"""
+        keep = np.ones(self.nnz, dtype=bool)
+        for dim, label in indexers.items():
+            axis = self.dims.index(dim)
+            position = list(self.coords[dim]).index(label) if dim in self.coords else int(label)
+            keep &= self.indices[axis] == position
+        keep_axes = [i for i, d in enumerate(self.dims) if d not in indexers]
+        return self._like(self.indices[keep_axes][:, keep], self.data[keep], keep_axes)
+
+    def item(self) -> float:
+        if self.shape != ():
+            raise ValueError("item() requires a 0-d tensor, use sum() first")
+        return float(self.data.sum())
+
+    def to_dataarray(self):
+        """Dense `xarray.DataArray` (use on reduced tensors)"""
+        import xarray as xr
+        return xr.DataArray(self.values, dims=self.dims, coords={d: c for d, c in self.coords.items() if d in self.dims},
+                            name=self.name)
+
+    def to_dataframe(self, name: str | None = None):
+        return self.to_dataarray().to_dataframe(name=name or self.name)
+
+    def expand(self, dim: str, labels: np.ndarray, weights: np.ndarray, new_coords: list) -> "CooTensor":
+        """New tensor with len(labels) positions along `dim`: position j takes weights[j] * old position labels[j]
+        (labels < 0 stay empty)"""
+        axis = self.dims.index(dim)
+        labels = np.asarray(labels)
+        order = np.argsort(labels, kind="stable")
+        order = order[labels[order] >= 0]
+        counts = np.bincount(labels[order], minlength=self.shape[axis])
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+
+        source = self.indices[axis]
+        repeats = counts[source]
+        entries = np.repeat(np.arange(self.nnz), repeats)
+        offsets = np.arange(len(entries)) - np.repeat(np.cumsum(repeats) - repeats, repeats)
+        targets = order[starts[source[entries]] + offsets]
+
+        indices = self.indices[:, entries].copy()
+        indices[axis] = targets
+        data = (self.data[entries] * np.asarray(weights)[targets]).astype(self.data.dtype)
+        shape = self.shape[:axis] + (len(labels),) + self.shape[axis + 1:]
+        return CooTensor(indices, data, shape, self.dims, {**self.coords, dim: list(new_coords)}, self.name)
+
+    def __repr__(self) -> str:
+        return f"<CooTensor {self.name} {dict(zip(self.dims, self.shape))} nnz={self.nnz} {self.dtype}>"
+
+
+def get_results_storage() -> dict:
+    """`results` section of config.yaml, as keyword arguments of `compact_results`"""
+    from backend.core.utils.data_utils import read_configs
+    storage = read_configs("results") or {}
+    return {"sparse": bool(storage.get("sparse", False)), "dtype": storage.get("dtype", "float64")}
+
+
+def compact_results(results: dict, sparse: bool = True, dtype: str = "float32", tol: float = 0.0) -> dict:
+    """Stores P_gkrah and Q_gkrah of `define_xarray` results as `CooTensor` (when `sparse`) and every array as `dtype`"""
+    compacted = {}
+    for name, result in results.items():
+        if isinstance(result, CooTensor):
+            compacted[name] = result.astype(dtype) if result.dtype != dtype else result
+        elif sparse and name in SPARSE_RESULTS:
+            compacted[name] = CooTensor.from_dense(result.values, dtype=dtype, tol=tol, dims=result.dims,
+                                                   coords={d: list(result[d].values) for d in result.dims}, name=result.name)
+        else:
+            compacted[name] = result.astype(dtype, copy=False)
+    return compacted
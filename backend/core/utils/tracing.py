@@ -0,0 +1,75 @@
+import contextvars
+import json
+import logging
+import time
+from contextlib import contextmanager
+
+##############################################
+### PER-REQUEST PHASE TRACING              ###
+##############################################
+
+# `span(name, **sizes)` times a phase and nests it under the span that is open in the current context (one API
+# request, one solve...). When the outermost span closes, every span of the tree is logged as one JSON record on
+# the "safepaw.trace" logger: {"trace", "span" (path of names), "duration_s", sizes (n_vars, n_rows, nnz, R, H...)}.
+# `Span.summary()` gives the same records for the optional "timing" field of the API responses.
+
+logger = logging.getLogger("safepaw.trace")
+
+_CURRENT_SPAN = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    """One timed phase with its sizes and nested phases"""
+
+    def __init__(self, name: str, **attributes):
+        self.name = name
+        self.attributes = attributes
+        self.children = []
+        self.start = time.perf_counter()
+        self.duration = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def records(self, prefix: str = "") -> list[dict]:
+        """Flattened tree: one record per span, parents first"""
+        path = prefix + self.name
+        duration = self.duration if self.duration is not None else time.perf_counter() - self.start
+        records = [{"span": path, "duration_s": round(duration, 6), **self.attributes}]
+        for child in self.children:
+            records.extend(child.records(path + "/"))
+        return records
+
+    def summary(self) -> dict:
+        """Timing summary returned by the API: total and per-span durations"""
+        records = self.records()
+        return {"total_s": records[0]["duration_s"], "spans": records}
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Times the enclosed block as a child of the current span (or as a new trace)"""
+    parent = _CURRENT_SPAN.get()
+    current = Span(name, **attributes)
+    if parent is not None:
+        parent.children.append(current)
+    token = _CURRENT_SPAN.set(current)
+    try:
+        yield current
+    finally:
+        current.duration = time.perf_counter() - current.start
+        _CURRENT_SPAN.reset(token)
+        if parent is None:
+            log_trace(current)
+
+
+def set_attributes(**attributes):
+    """Adds sizes to the current span (no-op outside of a span)"""
+    current = _CURRENT_SPAN.get()
+    if current is not None:
+        current.set(**attributes)
+
+
+def log_trace(root: Span):
+    for record in root.records():
+        logger.info(json.dumps({"trace": root.name, **record}, default=str))
@@ -0,0 +1,103 @@
+import json
+import os
+import time
+import pytest
+from fastapi.testclient import TestClient
+from backend import create_app
+from backend.api.jobs import JobQueue, QueueFull
+from backend.api.services import get_scenario_key
+from backend.benchmarks.synthetic import synthetic_maternity
+from tests.conftests import maternity_params, sample_params
+
+
+def _wait(job, timeout=60):
+    job.future.result(timeout=timeout)
+    while job.finished is None:
+        time.sleep(0.01)
+
+
+def test_job_queue_backpressure():
+
+    queue = JobQueue(workers=1, max_queued=1)
+    try:
+        first, second = queue.submit("sleep", time.sleep, 0.5), queue.submit("sleep", time.sleep, 0.5)
+        assert queue.stats()["saturated"]
+        with pytest.raises(QueueFull):
+            queue.submit("sleep", time.sleep, 0.5)
+
+        assert queue.cancel(second.id).status == "cancelled" and second.future.cancelled()
+        _wait(first)
+        assert queue.get(first.id).as_dict()["status"] == "done"
+        failed = queue.submit("divmod", divmod, 1, 0)
+        with pytest.raises(ZeroDivisionError):
+            _wait(failed)
+        assert failed.as_dict()["status"] == "failed" and "division" in failed.as_dict()["error"]
+    finally:
+        queue.shutdown()
+
+
+def _persistent_solve(df_instance, params_system) -> tuple:
+    """(status, worker pid, whether the model of the scenario was in the store of the worker)"""
+    from backend.api.services import get_model_store, solve_maternite_persistent
+    hit = get_scenario_key(df_instance) in get_model_store().models
+    status = solve_maternite_persistent(df_instance, 0.1, get_model_store(), params=(params_system, {}))[0]
+    return status, os.getpid(), hit
+
+
+def test_jobs_of_a_scenario_share_a_worker(maternity_params):
+
+    queue = JobQueue(workers=2)
+    scenarios = [synthetic_maternity(len(maternity_params["H"]), seed=seed) for seed in range(3)]
+    try:
+        first, second = ([queue.submit("persistent", _persistent_solve, df_instance, maternity_params,
+                                       key=get_scenario_key(df_instance)) for df_instance in scenarios] for _ in range(2))
+        first, second = ([job.future.result(timeout=60) for job in jobs] for jobs in (first, second))
+    finally:
+        queue.shutdown()
+
+    assert all(status == "Optimal" for status, _, _ in first + second)
+    assert not any(hit for _, _, hit in first) and all(hit for _, _, hit in second)
+    assert [pid for _, pid, _ in first] == [pid for _, pid, _ in second]
+
+
+def _metric(client, prefix: str) -> float:
+    """Sum of the /api/metrics samples starting with `prefix`"""
+    lines = client.get("/api/metrics").text.splitlines()
+    return sum(float(line.rsplit(" ", 1)[1]) for line in lines if line.startswith(prefix))
+
+
+def test_solve_metrics_of_the_workers(sample_params):
+
+    # The solve runs in a worker process, its metrics are recorded in the API process
+    params = {**sample_params, "Under_q_g": [0.0] * len(sample_params["G"])}
+    with TestClient(create_app()) as client:
+        before = {prefix: _metric(client, prefix) for prefix in (
+            'safepaw_solve_status_total{engine="arrays",status="Optimal"}',
+            'safepaw_model_size_count{engine="arrays",dimension="rows"}',
+            "safepaw_model_template_cache_lookups_total")}
+        response = client.post("/api/optimize", files={"file_params": ("params_toy.json", json.dumps(params))})
+        assert response.status_code == 200 and response.json()["status"] == "Optimal"
+
+        for prefix, value in before.items():
+            assert _metric(client, prefix) == value + 1, prefix
+
+
+def test_optimize_job_routes(sample_params):
+
+    # Feasible variant of the reference instance, read with the toy metadata (same regions and facilities)
+    params = {**sample_params, "Under_q_g": [0.0] * len(sample_params["G"])}
+    with TestClient(create_app()) as client:
+        response = client.post("/api/jobs/optimize", files={"file_params": ("params_toy.json", json.dumps(params))})
+        assert response.status_code == 202
+        job_id = response.json()["job_id"]
+
+        for _ in range(600):
+            job = client.get(f"/api/jobs/{job_id}").json()
+            if job["status"] in ("done", "failed"):
+                break
+            time.sleep(0.1)
+
+        assert job["status"] == "done" and job["result"]["status"] == "Optimal"
+        assert client.get("/api/jobs/unknown").status_code == 404 and client.delete("/api/jobs/unknown").status_code == 404
+        assert client.post("/api/optimize?time_limit=-1", files={"file_params": ("params_toy.json", "{}")}).status_code == 422
+        assert client.get("/api/jobs").json()["pending"] == 0
@@ -0,0 +1,47 @@
+import shutil
+import pandas as pd
+from fastapi.testclient import TestClient
+from backend import create_app
+from backend.core.mappers.datasets_mappers.maternite_serializer import MaternityDataset, get_maternity_dataset, read_maternity
+
+
+def test_maternity_dataset_subsets():
+
+    df = read_maternity()
+    dataset = get_maternity_dataset()
+    assert get_maternity_dataset() is dataset
+    region, department = df["region_name"].iloc[0], df["dep_name"].iloc[0]
+
+    pd.testing.assert_frame_equal(dataset.subset(), df)
+    pd.testing.assert_frame_equal(dataset.subset(region), df[df["region_name"] == region])
+    pd.testing.assert_frame_equal(dataset.subset(region, department),
+                                  df[(df["region_name"] == region) & (df["dep_name"] == department)])
+    pd.testing.assert_frame_equal(dataset.subset(department=department), df[df["dep_name"] == department])
+    assert dataset.subset("Unknown region").empty
+
+    subset = dataset.subset(region)
+    subset["beds"] = 0
+    assert (dataset.subset(region)["beds"] > 0).all()
+
+
+def test_maternity_dataset_reload(tmp_path):
+
+    filepath = tmp_path / "maternities.csv"
+    shutil.copy("backend/data/open_data/summary_maternity_capacity.csv", filepath)
+    assert len(MaternityDataset(str(filepath)).subset()) == len(read_maternity(str(filepath)))
+
+    # Reloaded when the file changed since it was read
+    dataset = get_maternity_dataset()
+    dataset.mtime_ns -= 1
+    assert get_maternity_dataset() is not dataset
+
+
+def test_update_maternites_keeps_dataset():
+
+    dataset = get_maternity_dataset()
+    region = dataset.df["region_name"].iloc[0]
+    beds = int(dataset.subset(region)["beds"].sum())
+    with TestClient(create_app()) as client:
+        updated = client.post("/api/update_maternites", json={"region": region, "global_capacity": 50}).json()
+        read = client.post("/api/read_maternites", json={"region": region}).json()
+    assert updated["capacity_total"] > beds and read["capacity_total"] == beds
@@ -0,0 +1,47 @@
+import json
+from fastapi.testclient import TestClient
+from backend import create_app
+from backend.api.result_cache import ResultCache, cacheable, content_key, strip_timing
+from tests.conftests import sample_params
+
+
+def test_result_cache_lru_and_disk(tmp_path):
+
+    content = {"status": "Optimal", "obj_val": "1.00", "list_facility_load": list(range(100))}
+    size = len(json.dumps(content).encode())
+    cache = ResultCache(max_bytes=2 * size, directory=str(tmp_path))
+    for key in ("a", "b", "c"):
+        cache.put(key, content)
+    assert list(cache.entries) == ["b", "c"] and cache.nbytes == 2 * size and cache.evictions == 1
+
+    # Evicted from memory but still on disk, and a new process finds the stored entries
+    assert cache.get("a") == content and cache.stats()["disk_hits"] == 1
+    assert ResultCache(directory=str(tmp_path)).get("c") == content
+    assert cache.get("d") is None and cache.stats()["misses"] == 1
+
+    assert not cacheable({"status": "time_limit"}) and cacheable({"status": "Optimal"})
+    assert strip_timing({"status": "Optimal", "results": {"avg_distance": 1.0, "timing": {}}}) == \
+        {"status": "Optimal", "results": {"avg_distance": 1.0}}
+
+
+def test_content_key():
+
+    records = [{"nofinesset": "1", "beds": 10}, {"nofinesset": "2", "beds": 20}]
+    key = content_key("optimize_maternite", records, 0.1, None, None, None)
+    assert key == content_key("optimize_maternite", [dict(reversed(list(r.items()))) for r in records], 0.1, None, None, None)
+    assert key != content_key("optimize_maternite", records, 0.2, None, None, None)
+    assert key != content_key("optimize_maternite", records[::-1], 0.1, None, None, None)
+    assert content_key("optimize", b"{}", b"{}", None) != content_key("optimize", b"{}", b"{} ", None)
+
+
+def test_optimize_cached(sample_params):
+
+    params = {**sample_params, "Under_q_g": [0.0] * len(sample_params["G"])}
+    with TestClient(create_app()) as client:
+        first = client.post("/api/optimize", files={"file_params": ("params_toy.json", json.dumps(params))}).json()
+        hits = client.get("/api/result_cache").json()["hits"]
+        second = client.post("/api/optimize?timing=true", files={"file_params": ("params_toy.json", json.dumps(params))}).json()
+
+        assert second.pop("cached") and "timing" not in second
+        assert second == {key: value for key, value in first.items() if key != "cached"}
+        assert client.get("/api/result_cache").json()["hits"] == hits + 1
@@ -0,0 +1,102 @@
+import numpy as np
+import pandas as pd
+import pytest
+from fastapi.testclient import TestClient
+from backend import create_app
+from backend.api.sessions import ScenarioSession, SessionStore
+from backend.core.mappers.datasets_mappers.maternite_serializer import get_maternity_dataset, serialize_maternite_facilities
+
+
+def _session(n_regions=None) -> ScenarioSession:
+    # Two departments, the serialized parameters of the communes being replaced by random affinities
+    dataset = get_maternity_dataset()
+    df_instance = pd.concat([dataset.subset(department="Ain"), dataset.subset(department="Aisne").head(1)])
+    session = ScenarioSession(df_instance, 0.1, n_regions)
+    params_system, facilities = serialize_maternite_facilities(session.df_instance)
+    params_system["w_rh"] = np.random.default_rng(0).random((3, len(df_instance)))
+    session.set_params((params_system, {"facilities": facilities}), session.version)
+    return session
+
+
+def test_session_deltas():
+
+    session = _session()
+    ids = session.df_instance["nofinesset"].tolist()
+    w_rh = session.params[0]["w_rh"]
+
+    assert session.apply_delta({"beds": {ids[1]: 20}, "transfers": 0.3}) == [ids[1]]
+    params_system, params_metadata = session.params
+    assert params_system["m_hl"][1] == [20 * 365] and session.transfers == 0.3 and session.version == 1
+
+    session.apply_delta({"remove": [ids[0]], "demand": 10})
+    params_system, params_metadata = session.params
+    assert params_system["H"] == [0, 1, 2, 3] and np.array_equal(params_system["w_rh"], w_rh[:, 1:])
+    assert params_system["J_h"][0] == [1, 2, 3] and params_system["m_hl"][0] == [20 * 365]
+    assert params_system["D"] == [int(session.df_instance["deliveries_per_facility"].sum())]
+    assert params_metadata["facilities"]["0"]["name"] == session.df_instance["facility_name"].iloc[0]
+
+    # Invalid deltas leave the session unchanged
+    for delta in ({"beds": {"unknown": 1}}, {"remove": [ids[1]], "beds": {ids[2]: -1}}, {"remove": [ids[1]], "mode": "x"},
+                  {"remove": [ids[1]], "demand": "ten"}):
+        with pytest.raises(ValueError):
+            session.apply_delta(delta)
+    assert len(session.df_instance) == 4 and session.version == 2
+
+    # Last facility of a department removed: the communes change, serialized again on the next solve
+    version = session.version
+    session.apply_delta({"remove": [ids[-1]]})
+    assert session.params is None and not session.set_params(({}, {}), version)
+
+
+def test_session_percentages_apply_to_the_base_instance():
+
+    session = _session()
+    base = session.base_instance
+    ids = base["nofinesset"].astype(str).tolist()
+
+    session.apply_delta({"global_capacity": 10, "demand": 10})
+    session.apply_delta({"global_capacity": 10, "demand": 10})
+    for column in ("beds", "deliveries_per_facility"):
+        assert session.df_instance[column].tolist() == (base[column] + base[column] * 10 / 100).astype(int).tolist()
+    assert session.params[0]["D"] == [int(session.df_instance["deliveries_per_facility"].sum())]
+
+    # Beds are set before the scaling, removals are kept, 0 resets a percent
+    session.apply_delta({"beds": {ids[1]: 20}, "remove": [ids[0]]})
+    session.apply_delta({"global_capacity": 0})
+    assert session.df_instance["beds"].tolist() == [20] + base["beds"].tolist()[2:]
+    assert session.summary()["global_capacity"] == 0 and session.summary()["demand"] == 10
+
+
+def test_session_store():
+
+    store = SessionStore(max_sessions=2, ttl_s=60)
+    first, second, third = (store.put(_session()) for _ in range(3))
+    assert store.get(first.id) is None and store.get(second.id) is second
+    third.last_used -= 120
+    assert store.get(third.id) is None and store.delete(second.id) and not store.delete(second.id)
+
+
+def test_session_routes():
+
+    dataset = get_maternity_dataset()
+    region = dataset.df["region_name"].iloc[0]
+    beds = int(dataset.subset(region)["beds"].sum())
+    with TestClient(create_app()) as client:
+        response = client.post("/api/sessions", json={"region": region, "transfers": 0.1})
+        assert response.status_code == 201 and response.json()["capacity_total"] == beds
+        session_id = response.json()["session_id"]
+        facility = dataset.subset(region)["nofinesset"].iloc[0]
+
+        edited = client.patch(f"/api/sessions/{session_id}", json={"beds": {facility: 1000}, "remove": [
+            dataset.subset(region)["nofinesset"].iloc[1]]}).json()
+        assert edited["version"] == 1 and len(edited["list_facility_load"]) == 1 and len(edited["removed"]) == 1
+        assert edited["list_facility_load"][0]["properties"]["capacities"] == {"beds": 1000}
+        assert client.patch(f"/api/sessions/{session_id}", json={"beds": {"unknown": 1}}).status_code == 422
+
+        session = client.get(f"/api/sessions/{session_id}?instance=true").json()
+        assert len(session["dict_instance"]) == session["n_facilities"] == len(dataset.subset(region)) - 1
+        assert int(dataset.subset(region)["beds"].sum()) == beds  # the shared dataset is not edited
+
+        assert client.delete(f"/api/sessions/{session_id}").status_code == 200
+        assert client.get(f"/api/sessions/{session_id}").status_code == 404
+        assert client.post(f"/api/sessions/{session_id}/optimize", json={}).status_code == 404
@@ -0,0 +1,22 @@
+from backend.benchmarks.run_benchmarks import benchmark_case, scaling_curves
+from backend.benchmarks.synthetic import synthetic_system_data
+
+
+def test_synthetic_case_is_feasible_and_timed():
+
+    data = synthetic_system_data(n_groups=2, n_pathways=2, n_regions=6, n_activities=2, n_facilities=3, n_resources=2)
+    case = benchmark_case("synthetic", system_data=data)
+
+    assert case["sizes"] == {"G": 2, "K": 2, "R": 6, "A": 2, "H": 3, "L": 2}
+    assert case["engines"]["arrays"]["status"] == case["engines"]["pulp"]["status"] == "Optimal"
+    assert abs(case["engines"]["arrays"]["objective"] - case["engines"]["pulp"]["objective"]) < 1e-6
+    assert {"convert_dm_to_json", "arrays.build", "pulp.build", "pulp.package_results", "output.patient_transfers"} <= set(case["phases"])
+
+
+def test_scaling_curves_fit_one_exponent_per_phase():
+
+    cases = [{"family": "synthetic", "engines": {"arrays": {"n_cols": n}}, "phases": {"arrays.build": 0.001 * n**2}}
+             for n in (10, 20, 40)]
+    curves = scaling_curves(cases)
+
+    assert abs(curves["arrays.build"]["exponent"] - 2) < 1e-9
@@ -0,0 +1,65 @@
+import os
+import geopandas as gpd
+import numpy as np
+from shapely.geometry import MultiPolygon, box
+from backend.core.mappers.datasets_mappers.communes_geo import Communes, build_artifact, department_code, ensure_artifact, \
+    get_communes, is_stale, source_fingerprint
+from tests.conftests import open_data
+
+
+def _communes() -> gpd.GeoDataFrame:
+    geometries = [box(2.30, 48.80, 2.40, 48.90), MultiPolygon([box(9.0, 42.0, 9.1, 42.1), box(9.2, 42.0, 9.3, 42.1)]),
+                  box(-61.6, 16.0, -61.5, 16.1)]
+    return gpd.GeoDataFrame({"code": ["75056", "2B033", "97101"]}, geometry=geometries, crs="EPSG:4326")
+
+
+def test_communes_artifact(tmp_path):
+
+    directory = str(tmp_path / "artifact")
+    build_artifact(_communes(), directory)
+    communes = Communes(directory)
+
+    assert list(communes.codes) == ["2B033", "75056", "97101"] and list(communes.dep_codes) == ["2B", "75", "971"]
+    assert isinstance(communes.centroids_m, np.memmap) and communes.centroids_m.shape == (3, 2)
+    assert np.allclose(communes.centroids_wgs84[1], [2.35, 48.85], atol=1e-3)
+
+    indices = communes.indices(["97101", "00000", "75056", "75056"])
+    assert list(indices) == [1, 2]
+    df_geo_comms = communes.to_geodataframe(indices)
+    assert df_geo_comms.crs.to_epsg() == 2154 and list(df_geo_comms["code"]) == ["75056", "97101"]
+    expected = _communes().set_index("code").loc[["75056", "97101"]].to_crs(epsg=2154).geometry
+    assert np.allclose(df_geo_comms.area.values, expected.area.values)
+    assert department_code("01001") == "01"
+
+
+def test_communes_artifact_rebuild(tmp_path):
+
+    source, directory = str(tmp_path / "communes.parquet"), str(tmp_path / "artifact")
+    with open(source, "w") as f:
+        f.write("v1")
+    assert is_stale(directory, source)
+    build_artifact(_communes(), directory, source_fingerprint(source))
+    assert not is_stale(directory, source) and ensure_artifact(directory, source)["n_communes"] == 3
+
+    with open(source, "w") as f:
+        f.write("v2, changed")
+    assert is_stale(directory, source)
+    os.remove(source)  # no source: the existing artifact is used as is
+    assert not is_stale(directory, source)
+
+
+def test_get_communes_reopens_a_rebuilt_artifact(tmp_path, open_data):
+
+    source, directory = str(tmp_path / "communes.parquet"), str(tmp_path / "artifact")
+    with open(source, "w") as f:
+        f.write("v1")
+    build_artifact(_communes(), directory, source_fingerprint(source))
+    open_data.update(communes=source, communes_artifact=directory)
+    communes = get_communes()
+    assert len(communes) == 3 and get_communes() is communes
+
+    # Source changed and artifact rebuilt (offline build, another process)
+    with open(source, "w") as f:
+        f.write("v2, changed")
+    build_artifact(_communes().iloc[:2], directory, source_fingerprint(source))
+    assert len(get_communes()) == 2 and get_communes() is not communes
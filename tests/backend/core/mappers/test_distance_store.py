@@ -0,0 +1,48 @@
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+from shapely.geometry import box
+from backend.core.mappers.datasets_mappers import communes_geo, distance_store, maternite_serializer
+from tests.conftests import open_data
+
+
+def test_distance_store(tmp_path, open_data):
+
+    geometries = [box(2.30, 48.80, 2.40, 48.90), box(2.20, 48.80, 2.30, 48.90), box(2.40, 48.80, 2.50, 48.90)]
+    communes_dir, store_dir, source = str(tmp_path / "communes"), str(tmp_path / "distances"), str(tmp_path / "maternities.csv")
+    communes_geo.build_artifact(gpd.GeoDataFrame({"code": ["75056", "92012", "94080"]}, geometry=geometries, crs="EPSG:4326"),
+                                communes_dir)
+    communes = communes_geo.Communes(communes_dir)
+    df_maternities = pd.DataFrame({"nofinesset": ["3", "1", "2"], "coords": [(2.45, 48.85), (2.10, 48.85), (2.35, 48.85)]})
+    df_maternities.to_csv(source)
+
+    assert distance_store.is_stale(store_dir, source, communes_dir)
+    manifest = distance_store.build_store(df_maternities, communes, store_dir, communes_geo.source_fingerprint(source))
+    assert manifest["shape"] == [3, 3] and not distance_store.is_stale(store_dir, source, communes_dir)
+    store = distance_store.DistanceStore(store_dir)
+    assert store.distances_m.dtype == np.float32 and isinstance(store.distances_m, np.memmap)
+
+    # Same affinities as computed per request, facility "4" unknown and facility "1" moved are computed
+    df_instance = pd.DataFrame({"nofinesset": ["2", "4", "1", "3"],
+                                "coords": [(2.35, 48.85), (2.15, 48.95), (2.12, 48.86), (2.45, 48.85)]})
+    indices = communes.indices(["94080", "75056"])
+    distances, missing = store.lookup(indices, df_instance["nofinesset"], df_instance["coords"])
+    assert list(missing) == [False, True, True, False] and np.isnan(distances[:, missing]).all()
+
+    df_geo_comms = communes.to_geodataframe(indices)
+    expected = maternite_serializer._get_affinities(df_instance, df_geo_comms)
+    open_data.update(distance_store=store_dir, maternities=source, communes_artifact=communes_dir)
+    assert distance_store.get_distance_store().directory == store_dir
+    w_rh = maternite_serializer._get_affinities(df_instance, df_geo_comms, indices)
+    assert np.allclose(w_rh, expected, rtol=1e-6) and w_rh[0, 0] == 1 / 100
+
+    communes_geo.build_artifact(gpd.GeoDataFrame({"code": ["75056"]}, geometry=geometries[:1], crs="EPSG:4326"), communes_dir)
+    assert distance_store.is_stale(store_dir, source, communes_dir) and distance_store.get_distance_store() is None
+
+    # Rebuilt against the new communes: reopened, and an empty store reports every facility as missing
+    distance_store.build_store(df_maternities.iloc[:0], communes_geo.Communes(communes_dir), store_dir,
+                               communes_geo.source_fingerprint(source))
+    store = distance_store.get_distance_store()
+    assert store is not None and store.distances_m.shape == (1, 0)
+    distances, missing = store.lookup(np.array([0]), df_instance["nofinesset"], df_instance["coords"])
+    assert missing.all() and distances.shape == (1, 4) and np.isnan(distances).all()
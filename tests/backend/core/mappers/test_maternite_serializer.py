@@ -0,0 +1,43 @@
+import copy
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+from shapely.geometry import Point, box
+from backend.core.main import run_driver
+from backend.core.mappers.datasets_mappers import communes_geo, maternite_serializer
+from tests.conftests import open_data
+
+
+def test_serialize_maternite_affinities(tmp_path, monkeypatch, open_data):
+
+    geometries = [box(2.30, 48.80, 2.40, 48.90), box(2.20, 48.80, 2.30, 48.90), box(2.40, 48.80, 2.50, 48.90)]
+    communes = gpd.GeoDataFrame({"code": ["75056", "92012", "94080"]}, geometry=geometries, crs="EPSG:4326")
+    communes_geo.build_artifact(communes, str(tmp_path))
+    open_data.update(communes_artifact=str(tmp_path), communes=str(tmp_path / "communes.parquet"), distance_store=None)
+    monkeypatch.setattr(maternite_serializer, "_DF_LABOURS_ALL", pd.DataFrame(
+        {"region_code": "11", "dep_code": ["92", "75", "75"], "comm_code": ["92012", "75056", "75056"],
+         "deliveries_per_comm": [100.0, 300.0, 500.0]}))
+    df_instance = pd.DataFrame({"nofinesset": ["2", "1"], "region_code": "11", "type": ["3", "1"], "dep_code": ["75", "92"],
+                                "comm_code": ["75056", "92012"], "facility_name": ["B", "A"], "comm_name": ["Paris", "Boulogne"],
+                                "coords": [(2.35, 48.85), (2.10, 48.85)], "deliveries_per_facility": [800.0, 100.0],
+                                "beds": [50, 10]})
+
+    params_system, params_metadata = maternite_serializer.serialize_maternite(df_instance)
+
+    # Communes of the departments of the instance, sorted by code; facilities in the order of df_instance
+    assert [region["name"] for region in params_metadata["regions"].values()] == ["75056", "92012"]
+    w_rh = np.asarray(params_system["w_rh"])
+    assert w_rh.shape == (2, 2) and w_rh[0, 0] == 1 / 100  # facility "2" is inside Paris
+    points = gpd.GeoSeries([Point(c) for c in df_instance["coords"]], crs="EPSG:4326").to_crs(epsg=2154)
+    polygons = communes.set_index("code").loc[["75056", "92012"]].to_crs(epsg=2154).geometry
+    assert np.isclose(w_rh[1, 0], 1 / points.iloc[0].distance(polygons.iloc[1]))
+    assert np.isclose(w_rh[0, 1], 1 / points.iloc[1].distance(polygons.iloc[0]))
+    assert np.allclose(params_metadata["regions"]["0"]["coordinates"], [2.35, 48.85], atol=1e-3)
+
+    # The arrays engine reads w_rh: every commune is served by its closest facility, and the objective moves with w_rh
+    status, objective, results = run_driver(copy.deepcopy(params_system), engine="arrays", solver="highs")
+    assert status == "Optimal" and objective > 0 and isinstance(params_system["w_rh"], list)
+    served = results["P_gkrah"].sum(["group", "pathway", "activity"]).values
+    assert np.array_equal(served.argmax(axis=1), w_rh.argmax(axis=1))
+    _, objective_far, _ = run_driver({**copy.deepcopy(params_system), "w_rh": (w_rh / 2).tolist()}, engine="arrays", solver="highs")
+    assert np.isclose(objective_far, objective / 2, rtol=1e-3)
@@ -0,0 +1,135 @@
+import copy
+import numpy as np
+import xarray as xr
+from backend.api.services import get_facility_capacity_maternite
+from backend.benchmarks.synthetic import synthetic_maternity
+from backend.core.data_models.output_models import FacilityStats
+from backend.core.main import normalize_params_system, run_driver
+from backend.core.mappers.output_mappers import (_compute_load, calculate_facility_capacity, create_facilityStats,
+                                                 create_patientTransfers, transfer_flows)
+from backend.core.utils.result_tensors import CooTensor, compact_results
+from tests.conftests import maternity_params, sample_params
+
+
+def _solve(sample_params):
+    params_system = normalize_params_system(copy.deepcopy(sample_params))
+    params_system["Under_q_g"] = [0.0] * len(params_system["G"])
+    status, objective, results = run_driver(params_system, engine="arrays", solver="highs")
+    assert status == "Optimal"
+    rng = np.random.default_rng(0)
+    params_metadata = {"facilities": {str(h): {"name": f"f{h}", "coordinates": rng.random(2).tolist()}
+                                      for h in params_system["H"]}}
+    return params_system, params_metadata, results
+
+
+def _facility_stats_per_row(results, params_system, params_metadata, by_region, by_group, by_pathway):
+    """Reference: one FacilityStats per row of the loads"""
+    features = []
+    for row in _compute_load(results, by_region, by_group, by_pathway, params_system).itertuples(index=False):
+        h = row.facility.split("_")[1]
+        i = int(h)
+        r = getattr(row, "region", None)
+        features.append(FacilityStats(
+            facility_id=params_metadata["facilities"][h]["name"], coordinates=params_metadata["facilities"][h]["coordinates"],
+            patient_group=getattr(row, "group", None), patient_pathway=getattr(row, "pathway", None),
+            region_id=str(r.split("_")[1] if r else r), load=row.load, capacities=calculate_facility_capacity(params_system, i),
+            transfers_in={l: results["Delta_plus"].values[i, l] for l in params_system["L"]},
+            transfers_out={l: results["Delta_moins"].values[i, l] for l in params_system["L"]}).as_geojson_feature())
+    return features
+
+
+def test_facility_features_match_per_row_models(sample_params):
+
+    params_system, params_metadata, results = _solve(sample_params)
+
+    for by_region, by_group, by_pathway in [(False, False, False), (True, False, False), (True, True, True)]:
+        assert create_facilityStats(results, params_system, params_metadata, by_region, by_group, by_pathway) ==\
+            _facility_stats_per_row(results, params_system, params_metadata, by_region, by_group, by_pathway)
+
+
+def test_transfer_flows_follow_J_h(sample_params):
+
+    params_system, params_metadata, results = _solve(sample_params)
+    flows = transfer_flows(results, params_system)
+
+    # Everything that leaves a facility between two activities goes to its J_h facilities
+    P = results["P_gkrah"].values
+    A_gk = np.array(params_system["A_gk"])
+    valid = np.arange(1, P.shape[3])[None, None, :] < A_gk[:, :, None]
+    out = np.clip(P[..., :-1, :] - P[..., 1:, :], 0, None) * valid[:, :, None, :, None]
+    assert np.allclose(flows.sum(axis=1), params_system["D"][0] * out.sum(axis=(0, 1, 2, 3)))
+    for h in params_system["H"]:
+        assert not np.delete(flows[h], params_system["J_h"][h]).any()
+
+    features = create_patientTransfers(results, params_system, params_metadata, min_volume=0.0)
+    assert len(features) == np.count_nonzero(flows)
+    assert np.isclose(sum(f["properties"]["volume"] for f in features), flows.sum())
+    assert all(f["properties"]["volume"] > 1.0 for f in create_patientTransfers(results, params_system, params_metadata, 1.0))
+
+
+def test_transfer_flows_split_by_arrivals():
+
+    # Facility 0 loses 0.4 between the two activities, facilities 1 and 2 gain 0.3 and 0.1
+    P = np.zeros((1, 1, 1, 2, 3))
+    P[0, 0, 0, 0] = [0.6, 0.0, 0.0]
+    P[0, 0, 0, 1] = [0.2, 0.3, 0.1]
+    params_system = {"D": [100], "J_h": [[1, 2], [0], [0]], "A_gk": [[2]], "H": [0, 1, 2]}
+    results = {"P_gkrah": xr.DataArray(P, dims=["group", "pathway", "region", "activity", "facility"])}
+
+    assert np.allclose(transfer_flows(results, params_system), [[0, 30, 10], [0, 0, 0], [0, 0, 0]])
+    params_metadata = {"facilities": {str(h): {"coordinates": [h, h]} for h in range(3)}}
+    features = create_patientTransfers(results, params_system, params_metadata, min_volume=20)
+    assert [f["geometry"]["coordinates"] for f in features] == [[[0, 0], [1, 1]]]
+    assert np.isclose(features[0]["properties"]["volume"], 30)
+
+
+def _dense_transfer_flows(P, params_system):
+    """Reference: differences of the dense P_gkrah between consecutive activities"""
+    nG, nK, nR, nA, nH = P.shape
+    J = np.zeros((nH, nH))
+    for h, J2_h in enumerate(params_system["J_h"]):
+        J[h, J2_h] = 1.0
+    valid = np.arange(1, nA)[None, None, :] < np.array(params_system["A_gk"])[:, :, None]
+    moves = ((P[..., :-1, :] - P[..., 1:, :]) * valid[:, :, None, :, None]).reshape(-1, nH)
+    out, arrivals = np.clip(moves, 0, None), np.clip(-moves, 0, None)
+    reachable = arrivals @ J.T
+    spread = np.divide(out, reachable, out=np.zeros_like(out), where=reachable > 0)
+    unmatched = np.where(reachable > 0, 0.0, out).sum(axis=0)
+    flows = J * (spread.T @ arrivals) + J * (unmatched / np.maximum(J.sum(axis=1), 1))[:, None]
+    return params_system["D"][0] * flows
+
+
+def test_sparse_transfer_flows_match_dense(maternity_params):
+
+    # Maternity instance with up to 3 activities per pathway: every (g, k, r, a) row uses 1 to 3 facilities
+    params_system = normalize_params_system(copy.deepcopy(maternity_params))
+    params_system["A_gk"] = [[3], [2], [3], [1]]
+    params_system["J_h"][0] = [1]
+    rng = np.random.default_rng(0)
+    nG, nR, nH = len(params_system["G"]), len(params_system["R"]), len(params_system["H"])
+    P = np.zeros((nG, 1, nR, 3, nH))
+    for g, r, a in np.ndindex(nG, nR, 3):
+        if a < params_system["A_gk"][g][0]:
+            facilities = rng.choice(nH, size=rng.integers(1, 4), replace=False)
+            P[g, 0, r, a, facilities] = rng.dirichlet(np.ones(len(facilities))) * params_system["d_gr"][g][r]
+    P[0, 0, 0, 2] = P[0, 0, 0, 1]  # no move between activities 1 and 2
+    dims = ["group", "pathway", "region", "activity", "facility"]
+    dense = {"P_gkrah": xr.DataArray(P, dims=dims)}
+    sparse = compact_results(dense, sparse=True, dtype="float64")
+    expected = _dense_transfer_flows(P, params_system)
+
+    assert isinstance(sparse["P_gkrah"], CooTensor)
+    assert expected.sum() > 0
+    assert np.allclose(transfer_flows(sparse, params_system), expected)
+    assert np.allclose(transfer_flows(dense, params_system), expected)
+    assert not transfer_flows(compact_results(dense, sparse=True), maternity_params | {"A_gk": [[1]] * nG}).any()
+
+
+def test_capacity_features_match_per_row_models():
+
+    df_maternites = synthetic_maternity(12)
+    df_maternites = df_maternites.iloc[np.r_[0:12, 3, 5]]  # duplicated names keep their first row
+    expected = [FacilityStats(facility_id=row.facility_name, facility_type=row.type, coordinates=row.coords,
+                              capacities={"beds": int(row.beds)}).as_geojson_feature()
+                for row in df_maternites.drop_duplicates("facility_name").itertuples(index=False)]
+    assert get_facility_capacity_maternite(df_maternites) == expected
@@ -0,0 +1,39 @@
+import copy
+import numpy as np
+from backend.core.main import run_driver
+from backend.core.mappers.output_mappers import _compute_load
+from backend.core.mappers.region_aggregation import aggregate_regions, disaggregate_results
+from tests.conftests import maternity_params
+
+
+def _metadata(params_system):
+    rng = np.random.default_rng(0)
+    return {"regions": {str(r): {"coordinates": [2 + rng.random(), 47 + rng.random()], "name": f"c{r}"}
+                        for r in params_system["R"]}}
+
+
+def test_aggregation_keeps_demand(maternity_params):
+
+    params_system = copy.deepcopy(maternity_params)
+    params_system["d_gr"] = [row[:-1] + [0.0] for row in params_system["d_gr"]]
+    aggregated, metadata = aggregate_regions(params_system, _metadata(params_system), 3)
+
+    assert len(aggregated["R"]) == 3 and len(metadata["regions"]) == 3
+    assert np.allclose(np.sum(aggregated["d_gr"], axis=1), np.sum(params_system["d_gr"], axis=1))
+    assert metadata["aggregation"]["labels"][-1] == -1
+
+
+def test_disaggregated_loads_match(maternity_params):
+
+    params_system = copy.deepcopy(maternity_params)
+    aggregated, metadata = aggregate_regions(params_system, _metadata(params_system), 4)
+    status, objective, results = run_driver(copy.deepcopy(aggregated), engine="arrays", solver="highs")
+    assert status == "Optimal"
+
+    results_r, params_r, metadata_r = disaggregate_results(results, aggregated, metadata)
+
+    assert results_r["P_gkrah"].sizes["region"] == len(params_system["R"])
+    assert np.allclose(_compute_load(results_r, False, False, False, params_r)["load"],
+                       _compute_load(results, False, False, False, aggregated)["load"])
+    assert np.allclose(results_r["P_gkr"].sum("pathway").values, np.asarray(params_system["d_gr"]), atol=1e-6)
+    assert "aggregation" not in metadata_r
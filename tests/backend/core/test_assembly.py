@@ -0,0 +1,96 @@
+import numpy as np
+import pulp
+import pytest
+from backend.core.assembly import _pad, assemble_model, index_arrays
+import backend.core.optimization as mdl
+from tests.conftests import sample_params, maternity_params
+
+
+def _build_pulp_model(params_system):
+    K2 = mdl.defineK2(params_system["K_g"])
+    A2 = mdl.defineA2(params_system["A_gk"])
+    G, R, H, L = params_system["G"], params_system["R"], params_system["H"], params_system["L"]
+    LP = pulp.LpProblem("test", pulp.LpMaximize)
+    P = pulp.LpVariable.dicts("P", (G, K2, R, A2, H), 0, None)
+    P_gkr = pulp.LpVariable.dicts("P_gkr", (G, K2, R), 0, None)
+    P_gk = pulp.LpVariable.dicts("P_gk", (G, K2), 0, None)
+    Q = pulp.LpVariable.dicts("Q", (G, K2, R, A2, H), 0, None)
+    Delta_plus = pulp.LpVariable.dicts("Delta_plus", (H, L), 0, None)
+    Delta_moins = pulp.LpVariable.dicts("Delta_moins", (H, L), 0, None)
+    z_hl_plus = pulp.LpVariable.dicts("z_hl_plus", (H, L), cat=pulp.LpInteger, lowBound=0)
+    z_hl_moins = pulp.LpVariable.dicts("z_hl_moins", (H, L), cat=pulp.LpInteger, lowBound=0)
+    mdl.set_obj_fn(LP, P_gk, P, Delta_plus, Delta_moins, params_system)
+    p = params_system
+    mdl.declare_constraints(LP, P_gk, G, p["K_g"], P_gkr, R, P, p["A_gk"], H, Q, Delta_plus, Delta_moins, L, z_hl_plus, z_hl_moins,
+                            p["d_gr"], p["Under_q_g"], p["Over_q_g"], p["U"], p["I_gu"], p["Under_q_gu"], p["Over_q_gu"],
+                            p["O_gk"], p["J_h"], p["N_gka_1"], p["N_gka_2"], p["p_transf"], p["t_gkal"], p["m_hl"], p["D"],
+                            p["delta_l"], p["b_hl_in"], p["b_hl_out"])
+    return LP
+
+
+def _column_names(model):
+    prefix = {"P_gkrah": "P", "Q_gkrah": "Q"}
+    names = []
+    for name, (_, shape) in model.layout.items():
+        names += [prefix.get(name, name) + "_" + "_".join(map(str, idx)) for idx in np.ndindex(*shape)]
+    return names
+
+
+def test_assemble_model_matches_pulp_rows(sample_params):
+
+    LP = _build_pulp_model(sample_params)
+    model = assemble_model(sample_params, sparse=False)
+    names = _column_names(model)
+    constraints = list(LP.constraints.values())
+
+    assert model.n_rows == len(constraints)
+    for i, c in enumerate(constraints):
+        start, end = model.a_start[i], model.a_start[i + 1]
+        row = {names[j]: v for j, v in zip(model.a_index[start:end], model.a_value[start:end])}
+        expected = {v.name: a for v, a in c.items() if a != 0}
+        assert row.keys() == expected.keys()
+        assert np.allclose([row[k] for k in expected], list(expected.values()))
+        lower, upper = model.row_lower[i], model.row_upper[i]
+        rhs = -c.constant
+        if c.sense == pulp.LpConstraintEQ:
+            assert lower == upper == rhs
+        elif c.sense == pulp.LpConstraintLE:
+            assert lower == -np.inf and np.isclose(upper, rhs)
+        else:
+            assert upper == np.inf and np.isclose(lower, rhs)
+
+    objective = {v.name: a for v, a in LP.objective.items() if a != 0}
+    costs = {names[j]: model.col_cost[j] for j in np.flatnonzero(model.col_cost)}
+    assert costs.keys() == objective.keys()
+    assert np.allclose([costs[k] for k in objective], list(objective.values()))
+
+
+def test_sparse_model_same_optimum(maternity_params):
+    from backend.core.highs_solver import solve_highs
+
+    p = maternity_params
+    p["Under_q_gu"], p["Over_q_gu"] = mdl.change_Under_Over(p["G"], p["U"], p["Under_q_gu"], p["Over_q_gu"])
+    dense = assemble_model(maternity_params, sparse=False)
+    sparse = assemble_model(maternity_params)
+    assert sparse.n_cols < dense.n_cols and sparse.n_rows < dense.n_rows
+    assert "O_gk" not in sparse.row_blocks and "Q" not in sparse.row_blocks
+
+    result_dense = solve_highs(dense, options={"mip_rel_gap": 0})
+    result_sparse = solve_highs(sparse, options={"mip_rel_gap": 0})
+    assert result_sparse.status == result_dense.status == "Optimal"
+    assert np.isclose(result_sparse.objective, result_dense.objective)
+
+    P_sparse = sparse.unpack(result_sparse.col_value)["P_gkrah"]
+    assert P_sparse.shape == dense.layout["P_gkrah"][1]
+    assert not np.isnan(P_sparse).any()
+    assert np.isclose(P_sparse.sum(), 1.0)
+
+
+def test_pad_arrays_and_ragged_lists(maternity_params):
+
+    w_rh = np.asarray(maternity_params["w_rh"])
+    assert np.array_equal(_pad(w_rh, w_rh.shape), w_rh)
+    assert np.array_equal(_pad([np.array([1.0, 2.0]), [3.0]], (3, 2)), [[1, 2], [3, 0], [0, 0]])
+    assert np.array_equal(index_arrays({**maternity_params, "w_rh": w_rh})["w_rh"], index_arrays(maternity_params)["w_rh"])
+    with pytest.raises(TypeError):
+        _pad([1.0, [2.0]], (2, 2))
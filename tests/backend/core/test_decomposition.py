@@ -0,0 +1,56 @@
+import copy
+import numpy as np
+from backend.core.decomposition import coupling_components, merge_block_info
+from backend.core.main import normalize_params_system, run_driver
+from tests.conftests import maternity_params
+
+
+def _two_departments(params_system):
+    """Two copies of the instance, patients of one copy being far from the facilities of the other"""
+    p = normalize_params_system(copy.deepcopy(params_system))
+    nR, nH = len(p["R"]), len(p["H"])
+    w_rh = np.asarray(p["w_rh"])
+    p["R"], p["H"] = list(range(2 * nR)), list(range(2 * nH))
+    p["w_rh"] = np.block([[w_rh, w_rh * 1e-3], [w_rh * 1e-3, w_rh]]).tolist()
+    p["d_gr"] = [[d / 2 for d in row] * 2 for row in p["d_gr"]]
+    p["O_gk"] = [[O + [h + nH for h in O] for O in O_g] for O_g in p["O_gk"]]
+    p["J_h"] = [[h2 for h2 in range(2 * nH) if h2 != h] for h in range(2 * nH)]
+    p["b_hl_in"], p["b_hl_out"] = [[0] for _ in p["H"]], [[0] for _ in p["H"]]
+    p["m_hl"] = p["m_hl"] * 2
+    return p, float(w_rh.min())
+
+
+def test_components_follow_affinity(maternity_params):
+
+    params_system, min_affinity = _two_departments(maternity_params)
+
+    assert len(coupling_components(params_system)) == 1
+    components = coupling_components(params_system, min_affinity=min_affinity)
+    assert len(components) == 2
+    assert sorted(np.concatenate([h for _, h in components]).tolist()) == params_system["H"]
+
+
+def test_decomposed_solve_merges_blocks(maternity_params):
+
+    params_system, min_affinity = _two_departments(maternity_params)
+    _, objective_full, _ = run_driver(copy.deepcopy(params_system), engine="arrays", solver="highs")
+    info = {}
+    status, objective, results = run_driver(copy.deepcopy(params_system), engine="arrays", solver="highs", info=info,
+                                            decomposition={"processes": 2, "min_affinity": min_affinity})
+
+    assert status == "Optimal"
+    assert info["blocks"] == 2
+    assert np.isclose(info["objective_bound"], objective, rtol=1e-3)
+    assert 0 <= info["mip_gap"] <= 1e-3
+    assert objective <= objective_full + 1e-6
+    assert np.isclose(objective, objective_full, rtol=1e-2)
+    assert results["P_gkrah"].shape == (4, 1, 2 * len(maternity_params["R"]), 1, 2 * len(maternity_params["H"]))
+    assert np.allclose(results["P_gkr"].sum("pathway").values, np.asarray(params_system["d_gr"]), atol=1e-6)
+
+
+def test_merge_block_info():
+
+    info = merge_block_info([{"objective_bound": 10.0, "mip_gap": 0.0, "mip_node_count": 1},
+                             {"objective_bound": 5.5, "mip_gap": 0.02, "mip_node_count": 3}])
+
+    assert info == {"blocks": 2, "objective_bound": 15.5, "mip_node_count": 4, "mip_gap": 0.02}
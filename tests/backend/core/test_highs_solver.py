@@ -0,0 +1,67 @@
+import copy
+import numpy as np
+from backend.core.assembly import assemble_model
+from backend.core.highs_solver import CANCELLED, TIME_LIMIT, solve_highs, solve_highs_lazy, solve_options
+from backend.core.main import normalize_params_system, run_driver
+from backend.core.utils.cancellation import request_cancel, set_cancel_file
+from tests.conftests import sample_params
+
+
+def test_in_process_highs_matches_pulp_status(sample_params):
+
+    status_pulp, objective_pulp, _ = run_driver(copy.deepcopy(sample_params), engine="pulp", solver="highs")
+    status, objective, results = run_driver(copy.deepcopy(sample_params), engine="arrays", solver="highs")
+
+    assert status == status_pulp
+    assert (objective is None) == (objective_pulp is None)
+    assert set(results) == {"P_gk", "P_gkr", "P_gkrah", "Q_gkrah", "Delta_plus", "Delta_moins", "z_hl_plus", "z_hl_moins"}
+
+
+def test_lazy_J_h_rows_give_the_full_model_optimum(sample_params):
+
+    # Feasible variant of the sample where activities alternate between facilities, so that J_h rows bind
+    sample_params["Under_q_g"] = [0.0] * len(sample_params["G"])
+    sample_params["J_h"] = [[1], [0]]
+
+    status_full, objective_full, _ = run_driver(copy.deepcopy(sample_params), engine="arrays", solver="highs")
+    status, objective, _ = run_driver(copy.deepcopy(sample_params), engine="arrays", solver="highs", lazy_rows=True)
+
+    assert status == status_full == "Optimal"
+    assert abs(objective - objective_full) <= 1e-6 * abs(objective_full)
+
+
+def test_last_lazy_round_adds_only_the_missing_rows(sample_params):
+
+    sample_params["Under_q_g"] = [0.0] * len(sample_params["G"])
+    sample_params["J_h"] = [[1], [0]]
+    params_system = normalize_params_system(sample_params)
+    full_model = assemble_model(params_system)
+    lazy_model = assemble_model(params_system, lazy_blocks=("J_h",))
+
+    result = solve_highs_lazy(lazy_model, max_rounds=2)
+
+    assert result.status == "Optimal" and result.info["lazy_rounds"] == 3
+    assert result.info["lazy_rows"] == result.info["J_h_rows"]
+    assert lazy_model.n_rows + result.info["lazy_rows"] == full_model.n_rows
+
+
+def test_time_limit_and_cancellation_statuses(sample_params, tmp_path):
+
+    params_system = normalize_params_system(copy.deepcopy(sample_params))
+    params_system["Under_q_g"] = [0.0] * len(params_system["G"])
+    model = assemble_model(params_system)
+
+    result = solve_highs(model, options=solve_options(time_limit=0.0))
+    assert result.status == TIME_LIMIT and result.objective is None and np.isnan(result.col_value).all()
+
+    result = solve_highs(model, options=solve_options(mip_gap=0.5))
+    assert result.status == "Optimal" and result.info["mip_gap"] <= 0.5
+
+    cancel_file = tmp_path / "cancel"
+    request_cancel(cancel_file)
+    set_cancel_file(str(cancel_file))
+    try:
+        assert solve_highs(model).status == CANCELLED
+    finally:
+        set_cancel_file(None)
+    assert solve_highs(model).status == "Optimal"
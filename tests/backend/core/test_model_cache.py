@@ -0,0 +1,45 @@
+import copy
+import numpy as np
+from backend.core.assembly import assemble_model
+from backend.core.main import normalize_params_system
+from backend.core.model_cache import ModelTemplate, TemplateCache, structure_key
+from tests.conftests import maternity_params
+
+
+def _other_data(params_system):
+    params_system = copy.deepcopy(params_system)
+    params_system["d_gr"] = [[0.5 * d for d in row] for row in params_system["d_gr"]]
+    params_system["t_gkal"] = [[[[2 * t for t in ls] for ls in a] for a in k] for k in params_system["t_gkal"]]
+    params_system["m_hl"] = [[m + 100 for m in row] for row in params_system["m_hl"]]
+    params_system["alpha"] = [0.3]
+    return params_system
+
+
+def test_template_matches_fresh_assembly(maternity_params):
+
+    params_system = normalize_params_system(copy.deepcopy(maternity_params))
+    other = _other_data(params_system)
+    assert structure_key(params_system) == structure_key(other)
+
+    template = ModelTemplate(assemble_model(params_system))
+    model, expected = template.instantiate(other), assemble_model(other)
+
+    for name in ["col_cost", "col_lower", "col_upper", "integrality", "row_lower", "row_upper", "a_start", "a_index", "a_value"]:
+        assert np.array_equal(getattr(model, name), getattr(expected, name)), name
+    assert model.row_blocks == expected.row_blocks
+
+
+def test_cache_counters_and_eviction(maternity_params):
+
+    params_system = normalize_params_system(copy.deepcopy(maternity_params))
+    cache = TemplateCache()
+    cache.get_model(params_system)
+    cache.get_model(_other_data(params_system))
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    cache.max_bytes = cache.nbytes
+    smaller = copy.deepcopy(params_system)
+    smaller["J_h"] = [[] for _ in smaller["H"]]
+    cache.get_model(smaller)
+    assert cache.evictions == 1 and len(cache.templates) == 1
+    assert cache.nbytes <= cache.max_bytes
@@ -0,0 +1,72 @@
+import copy
+import numpy as np
+from backend.core.assembly import assemble_model
+from backend.core.highs_solver import solve_highs
+from backend.core.main import normalize_params_system
+from backend.core.persistent_model import PersistentModel, ModelStore
+from tests.conftests import maternity_params
+
+
+def test_update_matches_fresh_solve(maternity_params):
+
+    handle = PersistentModel(copy.deepcopy(maternity_params))
+    status, objective, _ = handle.solve()
+    assert status == "Optimal"
+
+    b_hl_out = [[0.05] for _ in maternity_params["H"]]
+    m_hl = [[int(m * 0.8) for m in row] for row in maternity_params["m_hl"]]
+    handle.update(b_hl_out=b_hl_out, m_hl=m_hl)
+    status, objective, results = handle.solve()
+
+    params_system = normalize_params_system(copy.deepcopy(maternity_params))
+    params_system["b_hl_out"], params_system["m_hl"] = b_hl_out, m_hl
+    expected = solve_highs(assemble_model(params_system))
+
+    assert status == expected.status
+    assert np.isclose(objective, expected.objective, rtol=1e-6)
+    assert handle.n_solves == 2
+    assert results["z_hl_plus"].shape == (len(maternity_params["H"]), len(maternity_params["L"]))
+
+
+def test_model_store_evicts_least_recently_used():
+
+    store = ModelStore(max_models=2)
+    store.put("a", 1)
+    store.put("b", 2)
+    store.get("a")
+    store.put("c", 3)
+
+    assert store.get("b") is None
+    assert store.get("a") == 1 and store.get("c") == 3
+
+
+def test_alpha_update_matches_fresh_solve(maternity_params):
+
+    handle = PersistentModel(copy.deepcopy(maternity_params))
+    handle.solve()
+    handle.update(alpha=0.5)
+    status, objective, _ = handle.solve()
+
+    params_system = normalize_params_system(copy.deepcopy(maternity_params))
+    params_system["alpha"] = [0.5]
+    expected = solve_highs(assemble_model(params_system))
+
+    assert status == expected.status
+    assert np.isclose(objective, expected.objective, rtol=1e-6)
+
+
+def test_relaxed_mode_bounds(maternity_params):
+
+    params_system = copy.deepcopy(maternity_params)
+    params_system["m_hl"] = [[int(m * 0.6) for m in row] for row in params_system["m_hl"]]
+    params_system["b_hl_in"] = [[0.5] for _ in params_system["H"]]
+    handle = PersistentModel(params_system)
+    _, objective_exact, _ = handle.solve()
+    status, objective, results = handle.solve(mode="relaxed")
+    info = handle.result.info
+
+    assert status == "Optimal"
+    assert objective <= objective_exact + 1e-6 <= info["relaxation_bound"] + 2e-6
+    assert info["gap"] >= 0
+    z = np.concatenate([results["z_hl_plus"].values.ravel(), results["z_hl_moins"].values.ravel()])
+    assert np.allclose(z, np.round(z))
@@ -0,0 +1,29 @@
+import copy
+import numpy as np
+from backend.core.main import build_pulp_model, get_pulp_solver, normalize_params_system
+from backend.core.utils.data_utils import define_xarray, extract_values, package_results
+from tests.conftests import sample_params
+
+
+def test_package_results_matches_per_variable_extraction(sample_params):
+
+    params_system = normalize_params_system(copy.deepcopy(sample_params))
+    params_system["Under_q_g"] = [0.0] * len(params_system["G"])
+    LP, variables = build_pulp_model(params_system)
+    LP.solve(get_pulp_solver("highs"))
+
+    dict_results = package_results(*variables)
+
+    for name, variable in zip(["P_gk", "P_gkr", "P_gkrah", "Q_gkrah", "Delta_plus", "Delta_moins", "z_hl_plus", "z_hl_moins"], variables):
+        assert np.array_equal(dict_results[name], np.array(extract_values(variable), dtype=float), equal_nan=True)
+
+
+def test_define_xarray_wraps_arrays_without_copy(sample_params):
+
+    params_system = normalize_params_system(copy.deepcopy(sample_params))
+    LP, variables = build_pulp_model(params_system)
+    dict_results = {name: np.zeros_like(values, dtype=float) for name, values in package_results(*variables).items()}
+
+    results = define_xarray(params_system, dict_results)
+
+    assert all(np.shares_memory(results[name].values, dict_results[name]) for name in dict_results)
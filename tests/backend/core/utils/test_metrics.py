@@ -0,0 +1,22 @@
+from backend.core.utils.metrics import Counter, Gauge, Histogram, Registry
+
+
+def test_registry_renders_prometheus_text():
+
+    registry = Registry()
+    latency = registry.register(Histogram("latency_seconds", "Latency", ("route",), buckets=(0.1, 1)))
+    status = registry.register(Counter("status_total", "Statuses", ("status",)))
+    registry.register(Gauge("cache_hit_ratio", "Hit ratio", function=lambda: {(): 0.5}))
+    latency.observe(0.05, route="/api/optimize")
+    latency.observe(0.5, route="/api/optimize")
+    status.inc(status="Optimal")
+    status.inc(status="Optimal")
+
+    lines = registry.render().splitlines()
+
+    assert "# TYPE latency_seconds histogram" in lines
+    assert 'latency_seconds_bucket{route="/api/optimize",le="0.1"} 1' in lines
+    assert 'latency_seconds_bucket{route="/api/optimize",le="+Inf"} 2' in lines
+    assert 'latency_seconds_count{route="/api/optimize"} 2' in lines
+    assert 'status_total{status="Optimal"} 2' in lines
+    assert "cache_hit_ratio 0.5" in lines
@@ -0,0 +1,54 @@
+import copy
+import numpy as np
+from backend.core.assembly import assemble_model
+from backend.core.highs_solver import solve_highs
+from backend.core.main import normalize_params_system
+from backend.core.mappers.output_mappers import _compute_load, get_average_distance, transfer_flows
+from backend.core.mappers.region_aggregation import disaggregate_results
+from backend.core.utils.data_utils import define_xarray
+from backend.core.utils.result_tensors import SPARSE_RESULTS, CooTensor, compact_results
+from tests.conftests import sample_params
+
+
+def _solve(sample_params, sparse):
+    params_system = normalize_params_system(copy.deepcopy(sample_params))
+    params_system["Under_q_g"] = [0.0] * len(params_system["G"])
+    model = assemble_model(params_system)
+    result = solve_highs(model)
+    return params_system, define_xarray(params_system, model.unpack(result.col_value, sparse=SPARSE_RESULTS if sparse else ()))
+
+
+def test_sparse_results_match_dense(sample_params):
+
+    params_system, dense = _solve(sample_params, sparse=False)
+    _, sparse = _solve(sample_params, sparse=True)
+
+    assert isinstance(sparse["P_gkrah"], CooTensor) and sparse["P_gkrah"].nnz < sparse["P_gkrah"].values.size
+    for name in SPARSE_RESULTS:
+        assert np.allclose(sparse[name].values, dense[name].values)
+        assert np.allclose(sparse[name].sum(dim=["group", "activity"]).values, dense[name].sum(dim=["group", "activity"]).values)
+        assert np.isclose(sparse[name].sel(facility="facility_0").sum().item(), dense[name].sel(facility="facility_0").sum().item())
+
+    assert get_average_distance(sparse, params_system) == get_average_distance(dense, params_system)
+    assert np.allclose(_compute_load(sparse, True, True, False, params_system)["load"],
+                       _compute_load(dense, True, True, False, params_system)["load"])
+    assert np.allclose(transfer_flows(sparse, params_system), transfer_flows(dense, params_system))
+
+
+def test_compact_results_and_disaggregation(sample_params):
+
+    params_system, dense = _solve(sample_params, sparse=False)
+    compact = compact_results(dense, sparse=True, dtype="float32")
+
+    assert compact["P_gkrah"].dtype == np.float32 and compact["Delta_plus"].dtype == np.float32
+    assert np.allclose(compact["Q_gkrah"].values, dense["Q_gkrah"].values, atol=1e-6)
+
+    # Two original regions per model region, with shares 0.25 / 0.75
+    n_regions = len(params_system["R"])
+    aggregation = {"labels": np.repeat(np.arange(n_regions), 2).tolist(), "shares": [0.25, 0.75] * n_regions,
+                   "d_gr": None, "w_rh": None, "regions": {}}
+    expected, _, _ = disaggregate_results(dense, params_system, {"aggregation": aggregation})
+    expanded, _, _ = disaggregate_results(compact, params_system, {"aggregation": aggregation})
+
+    assert expanded["P_gkrah"].coords["region"] == list(expected["P_gkrah"].region.values)
+    assert np.allclose(expanded["P_gkrah"].values, expected["P_gkrah"].values, atol=1e-6)
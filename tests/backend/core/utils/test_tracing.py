@@ -0,0 +1,33 @@
+import copy
+import json
+import logging
+from backend.core.main import run_driver
+from backend.core.utils.tracing import span, set_attributes
+from tests.conftests import sample_params
+
+
+def test_spans_nest_and_log_one_record_per_span(caplog):
+
+    with caplog.at_level(logging.INFO, logger="safepaw.trace"):
+        with span("request") as trace:
+            with span("build", R=3):
+                set_attributes(n_rows=10)
+            with span("solve"):
+                pass
+
+    records = [json.loads(r.getMessage()) for r in caplog.records if r.name == "safepaw.trace"]
+    assert [r["span"] for r in records] == ["request", "request/build", "request/solve"]
+    assert records[1]["R"] == 3 and records[1]["n_rows"] == 10
+    assert all(r["trace"] == "request" for r in records)
+    assert trace.summary()["total_s"] >= records[1]["duration_s"] + records[2]["duration_s"] - 1e-6
+
+
+def test_run_driver_records_build_sizes(sample_params):
+
+    with span("request") as trace:
+        run_driver(copy.deepcopy(sample_params), engine="arrays", solver="highs")
+
+    spans = {r["span"]: r for r in trace.summary()["spans"]}
+    assert {"request/build", "request/solve", "request/extract", "request/xarray"} <= set(spans)
+    assert spans["request/build"]["n_vars"] > 0 and spans["request/build"]["nnz"] > 0
+    assert spans["request/build"]["H"] == len(sample_params["H"])
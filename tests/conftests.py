@@ -16,3 +16,22 @@ def sample_datamodel():
     
     return SystemData.model_validate(data)
     
+
+@pytest.fixture
+def maternity_params():
+    with open(Path(__file__).parent/ "data" / "reference_params_maternity.json") as f:
+        return json.load(f)
+
+
+@pytest.fixture
+def open_data(monkeypatch):
+    """Entries of the `open_data` section of config.yaml overridden during the test (dict to update)"""
+    from backend.core.utils import data_utils
+    read_configs, overrides = data_utils.read_configs, {}
+
+    def read_configs_with_overrides(config_category, *args, **kwargs):
+        configs = read_configs(config_category, *args, **kwargs)
+        return {**configs, **overrides} if config_category == "open_data" else configs
+
+    monkeypatch.setattr(data_utils, "read_configs", read_configs_with_overrides)
+    return overrides